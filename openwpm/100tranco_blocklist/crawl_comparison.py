@@ -0,0 +1,140 @@
+""" Comparison of two crawls of the same site list (e.g. without and with a blocklist), by site_url.
+
+The crawls can be two browsers of the same database, or of two databases (the second one is attached to the
+connection). The URLs each crawl requested for each site_url are loaded once into a temporary table, with the
+amount of requests of each URL, and indexed by (crawl, site_url, url) and (crawl, url). The comparisons are
+then index lookups on that table, in stead of joining site_visits and http_requests of both crawls and
+checking every request with a correlated NOT IN over all the requests of the other crawl.
+"""
+
+# Crawls of the comparison, as stored in crawl_pair_urls.crawl
+CRAWL_A = 0
+CRAWL_B = 1
+
+OTHER_DATABASE_SCHEMA = "crawl_b"
+
+CREATE_URL_SETS = """
+CREATE TEMP TABLE IF NOT EXISTS crawl_pair_urls (
+    crawl INTEGER NOT NULL,
+    site_url TEXT NOT NULL,
+    url TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    PRIMARY KEY (crawl, site_url, url)
+) WITHOUT ROWID
+"""
+
+CREATE_URL_INDEX = """
+CREATE INDEX IF NOT EXISTS temp.crawl_pair_urls_url ON crawl_pair_urls (crawl, url)
+"""
+
+# {schema} is the schema of the crawl's database (main or the attached one)
+INSERT_URL_SET = """
+INSERT INTO temp.crawl_pair_urls (crawl, site_url, url, requests)
+SELECT :crawl, site_visits.site_url, http_requests.url, COUNT(*)
+FROM {schema}.site_visits AS site_visits
+INNER JOIN {schema}.http_requests AS http_requests
+    ON site_visits.visit_id = http_requests.visit_id
+    AND site_visits.browser_id = http_requests.browser_id
+WHERE :browser_id IS NULL OR site_visits.browser_id = :browser_id
+GROUP BY site_visits.site_url, http_requests.url
+"""
+
+# Same estimate as the query tranco100_blocklist.py used before: the requests of crawl B for a site_url are
+# only counted if crawl A never requested their URL (for any site)
+BLOCKED_REQUESTS_ESTIMATE = """
+SELECT
+    a.site_url,
+    a.requests AS requests_a,
+    COALESCE(b.new_requests, 0) AS requests_b,
+    a.requests - COALESCE(b.new_requests, 0) AS blocked_requests
+FROM (
+    SELECT site_url, SUM(requests) AS requests
+    FROM temp.crawl_pair_urls
+    WHERE crawl = 0
+    GROUP BY site_url
+) AS a
+LEFT JOIN (
+    SELECT b_urls.site_url, SUM(b_urls.requests) AS new_requests
+    FROM temp.crawl_pair_urls AS b_urls
+    WHERE b_urls.crawl = 1
+    AND NOT EXISTS (
+        SELECT 1 FROM temp.crawl_pair_urls AS a_urls
+        WHERE a_urls.crawl = 0 AND a_urls.url = b_urls.url
+    )
+    GROUP BY b_urls.site_url
+) AS b ON a.site_url = b.site_url
+ORDER BY blocked_requests DESC
+LIMIT :limit
+"""
+
+# Distinct URLs each crawl requested for each site_url, and how many of them only one of the crawls did
+SITE_URL_SET_DIFFERENCES = """
+SELECT
+    site_url,
+    SUM(crawl = 0) AS urls_a,
+    SUM(crawl = 1) AS urls_b,
+    SUM(crawl = 0 AND NOT in_other) AS only_a,
+    SUM(crawl = 1 AND NOT in_other) AS only_b
+FROM (
+    SELECT urls.crawl, urls.site_url, EXISTS (
+        SELECT 1 FROM temp.crawl_pair_urls AS other_urls
+        WHERE other_urls.crawl = 1 - urls.crawl
+        AND other_urls.site_url = urls.site_url
+        AND other_urls.url = urls.url
+    ) AS in_other
+    FROM temp.crawl_pair_urls AS urls
+)
+GROUP BY site_url
+ORDER BY only_a DESC
+"""
+
+
+class CrawlPairComparison:
+    """Comparison of crawl A (browser_a of the connection's database) and crawl B (browser_b of the same
+    database or, if database_b is given, of that database). A browser_id of None takes all the browsers
+    of the database.
+    """
+
+    def __init__(self, conn, browser_a, browser_b, database_b=None):
+        self.conn = conn
+        schema_b = "main"
+        if database_b is not None:
+            conn.execute(f"ATTACH DATABASE ? AS {OTHER_DATABASE_SCHEMA}", (database_b,))
+            schema_b = OTHER_DATABASE_SCHEMA
+        self.attached = database_b is not None
+
+        conn.execute(CREATE_URL_SETS)
+        conn.execute("DELETE FROM temp.crawl_pair_urls")
+        for crawl, browser_id, schema in (
+            (CRAWL_A, browser_a, "main"),
+            (CRAWL_B, browser_b, schema_b),
+        ):
+            conn.execute(
+                INSERT_URL_SET.format(schema=schema),
+                {"crawl": crawl, "browser_id": browser_id},
+            )
+        conn.execute(CREATE_URL_INDEX)
+        conn.execute("ANALYZE temp")
+        # Nothing is written to the crawl databases, but the attached one can't be detached in a transaction
+        conn.commit()
+
+    def get_blocked_requests_estimate(self, limit: int = -1) -> list:
+        """Returns (site_url, requests of crawl A, requests of crawl B, estimated blocked requests) for the
+        site_urls crawl A requested something for, the most blocked first. With A the crawl without blocklist
+        and B the one with it, the requests of B are only counted if A never requested their URL
+        """
+        return self.conn.execute(BLOCKED_REQUESTS_ESTIMATE, {"limit": limit}).fetchall()
+
+    def get_site_url_differences(self) -> list:
+        """Returns (site_url, distinct URLs of crawl A, distinct URLs of crawl B, URLs only crawl A requested,
+        URLs only crawl B requested) for each site_url, the most URLs only in A first
+        """
+        return self.conn.execute(SITE_URL_SET_DIFFERENCES).fetchall()
+
+    def close(self):
+        """Drops the temporary table (and detaches the database of crawl B)"""
+        self.conn.execute("DROP TABLE IF EXISTS temp.crawl_pair_urls")
+        self.conn.commit()
+        if self.attached:
+            self.conn.execute(f"DETACH DATABASE {OTHER_DATABASE_SCHEMA}")
+            self.attached = False
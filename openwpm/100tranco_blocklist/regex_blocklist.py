@@ -0,0 +1,198 @@
+""" Counts how many requests of each crawl match each EasyList entry, converted to a regex.
+
+In stead of one SELECT ... WHERE url REGEXP ? per regex and crawl (a full scan of http_requests each time),
+the URLs of the crawls are loaded once, and every regex is only run on the distinct URLs that contain a literal
+part every match of the regex has (found with an index of the URLs that contain each trigram). The counts are
+the same as searching every regex in every request.
+"""
+
+import re
+
+import numpy as np
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # Python < 3.11
+    import sre_parse
+
+TRIGRAM_LENGTH = 3
+
+# {schema} is the schema of the crawl's database (main, or an attached one). A browser_id of None takes all
+URLS_QUERY = """
+SELECT url, COUNT(*) FROM {schema}.http_requests
+WHERE :browser_id IS NULL OR browser_id = :browser_id
+GROUP BY url
+"""
+
+
+def entry_to_regex(entry: str):
+    """Converts an EasyList entry to a regex, as the entries were converted in tranco100_blocklist.py.
+    Returns None for the entries that are not converted (or not valid regexes)
+    """
+    if entry.startswith("||"):
+        return re.compile(r"^https?://([^/]+\.)?" + re.escape(entry[2:-1]) + r"/")
+    if entry.startswith("|"):
+        return re.compile(re.escape(entry[1:]))
+    if entry.startswith("/"):
+        try:
+            return re.compile(entry[1:-1])
+        except re.error:
+            print(f"Skipping {entry}, it is not a valid regex")
+    return None
+
+
+def load_regexes(entries_path: str) -> list:
+    """Returns the regexes of the entries of the file, in the order of the file"""
+    with open(entries_path, "r") as f:
+        entries = f.read().splitlines()
+    regexes = []
+    for entry in entries:
+        regex = entry_to_regex(entry)
+        if regex is not None:
+            regexes.append(regex)
+    return regexes
+
+
+def _get_longest_literal(subpattern) -> str:
+    literals = [""]
+    # Everything in a sequence is matched, so each run of literals in it too
+    for opcode, value in subpattern:
+        if opcode == sre_parse.LITERAL:
+            literals[-1] += chr(value)
+        else:
+            literals.append("")
+    return max(literals, key=len)
+
+
+def get_required_literals(regex) -> list:
+    """Returns literal parts of the regex such that every match contains one of them
+    (the longest of its sequence, or of each alternative if the regex is an alternation).
+    Returns an empty list if there are none
+    """
+    if regex.flags & re.IGNORECASE:
+        return []
+
+    subpattern = sre_parse.parse(regex.pattern)
+    alternatives = [subpattern]
+    if len(subpattern) == 1 and subpattern[0][0] == sre_parse.BRANCH:
+        alternatives = subpattern[0][1][1]
+
+    literals = [_get_longest_literal(alternative) for alternative in alternatives]
+    if not all(literals):
+        return []
+    return literals
+
+
+def load_url_counts(conn, crawls: list) -> tuple:
+    """Returns the distinct URLs requested in the crawls, given as (schema, browser_id), and an array with
+    the amount of requests of each URL (columns) in each crawl (rows)
+    """
+    url_positions = dict()
+    browser_counts = []
+    for schema, browser_id in crawls:
+        counts = dict()
+        query = URLS_QUERY.format(schema=schema)
+        for url, count in conn.execute(query, {"browser_id": browser_id}):
+            counts[url_positions.setdefault(url, len(url_positions))] = count
+        browser_counts.append(counts)
+
+    url_counts = np.zeros((len(crawls), len(url_positions)), dtype=np.int64)
+    for row, counts in enumerate(browser_counts):
+        url_counts[row, list(counts.keys())] = list(counts.values())
+    return list(url_positions), url_counts
+
+
+class URLIndex:
+    """Positions of the distinct URLs that contain each trigram (substring of 3 characters)"""
+
+    def __init__(self, urls: list):
+        self.urls = urls
+        postings = dict()
+        for position, url in enumerate(urls):
+            for trigram in set(url[i : i + TRIGRAM_LENGTH] for i in range(len(url))):
+                postings.setdefault(trigram, []).append(position)
+        self.postings = postings
+
+    def find_literal(self, literal: str):
+        """Returns the positions of the URLs that contain the literal"""
+        if len(literal) < TRIGRAM_LENGTH:
+            return [
+                position for position, url in enumerate(self.urls) if literal in url
+            ]
+        # Only the URLs with the rarest trigram of the literal can contain it
+        rarest_postings = min(
+            (
+                self.postings.get(literal[i : i + TRIGRAM_LENGTH], [])
+                for i in range(len(literal) - TRIGRAM_LENGTH + 1)
+            ),
+            key=len,
+        )
+        return [
+            position for position in rarest_postings if literal in self.urls[position]
+        ]
+
+    def get_candidates(self, regex):
+        """Returns the positions of the URLs the regex could match: the ones that contain any of its required
+        literals (all the URLs if it has none)
+        """
+        literals = get_required_literals(regex)
+        if not literals:
+            return range(len(self.urls))
+        if len(literals) == 1:
+            return self.find_literal(literals[0])
+        return sorted(
+            set(
+                position
+                for literal in literals
+                for position in self.find_literal(literal)
+            )
+        )
+
+    def search(self, regex) -> list:
+        """Returns the positions of the URLs that match the regex"""
+        return [
+            position
+            for position in self.get_candidates(regex)
+            if regex.search(self.urls[position])
+        ]
+
+
+def count_matches(regexes: list, urls: list, url_counts: np.ndarray) -> np.ndarray:
+    """Returns an array with the amount of requests (of each crawl of url_counts, see load_url_counts)
+    that match each regex, with one row for each regex
+    """
+    index = URLIndex(urls)
+    matches = np.zeros((len(regexes), url_counts.shape[0]), dtype=np.int64)
+    for i, regex in enumerate(regexes):
+        positions = index.search(regex)
+        if positions:
+            matches[i] = url_counts[:, positions].sum(axis=1)
+    return matches
+
+
+def get_blocklist_differences(
+    conn,
+    regexes: list,
+    without_blocklist_id,
+    with_blocklist_id,
+    with_blocklist_schema: str = "main",
+) -> list:
+    """Returns a (pattern, requests without blocklist, requests with blocklist, difference) tuple for each
+    regex, with the amount of requests of each browser that match the regex.
+    The crawl with blocklist can be in an attached database (with_blocklist_schema)
+    """
+    urls, url_counts = load_url_counts(
+        conn,
+        [("main", without_blocklist_id), (with_blocklist_schema, with_blocklist_id)],
+    )
+    matches = count_matches(regexes, urls, url_counts)
+    return [
+        (
+            regex.pattern,
+            int(without_blocklist),
+            int(with_blocklist),
+            int(without_blocklist - with_blocklist),
+        )
+        for regex, (without_blocklist, with_blocklist) in zip(regexes, matches)
+    ]
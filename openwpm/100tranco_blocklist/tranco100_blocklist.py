@@ -1,9 +1,28 @@
+import argparse
 import sqlite3
-import re
+
+from crawl_comparison import OTHER_DATABASE_SCHEMA, CrawlPairComparison
+from regex_blocklist import get_blocklist_differences, load_regexes
+
+# The crawls without and with blocklist are two browsers of the same database (see crawl_100tranco_blocklist.py)
+# or, with --with-blocklist-database, the crawls of two databases
+parser = argparse.ArgumentParser()
+parser.add_argument("--database", default="datadir/tranco_100.sqlite")
+parser.add_argument("--with-blocklist-database", default=None)
+parser.add_argument("--without-blocklist-id", type=int, default=None)
+parser.add_argument("--with-blocklist-id", type=int, default=None)
+args = parser.parse_args()
+
+if args.with_blocklist_database is None and (
+    args.without_blocklist_id is None or args.with_blocklist_id is None
+):
+    parser.error(
+        "--without-blocklist-id and --with-blocklist-id are needed to compare two browsers of the same database"
+    )
 
 
 # Connect to the SQLite database
-conn = sqlite3.connect("datadir/tranco_100.sqlite")
+conn = sqlite3.connect(args.database)
 
 # Query the amount of requests made by each browser
 sites_query = """
@@ -39,36 +58,13 @@ for responses in responses:
 # For each site_url, get the difference between the requests made by the browser
 # without blocklist and the ones by the browser with blocklist. This is an estimate
 # of the requests blocked for that site_url by using the blocklist.
-sites_query = """
-SELECT
-  without_blocklist.site_url,
-  COUNT(DISTINCT without_blocklist_requests.id) AS requests_without_blocklist,
-  COUNT(DISTINCT with_blocklist_requests.id) AS requests_with_blocklist,
-  COUNT(DISTINCT without_blocklist_requests.id) - COUNT(DISTINCT with_blocklist_requests.id) AS blocked_requests
-FROM
-  site_visits AS without_blocklist
-  INNER JOIN http_requests AS without_blocklist_requests
-    ON without_blocklist.visit_id = without_blocklist_requests.visit_id
-    AND without_blocklist.browser_id = without_blocklist_requests.browser_id
-  LEFT JOIN site_visits AS with_blocklist
-    ON without_blocklist.site_url = with_blocklist.site_url
-    AND with_blocklist.browser_id = 3251089431
-  LEFT JOIN http_requests AS with_blocklist_requests
-    ON with_blocklist.visit_id = with_blocklist_requests.visit_id
-    AND with_blocklist.browser_id = with_blocklist_requests.browser_id
-    AND with_blocklist_requests.url NOT IN (
-      SELECT url
-      FROM http_requests
-      WHERE browser_id = 1502965085
-    )
-WHERE
-  without_blocklist.browser_id = 1502965085
-GROUP BY
-  without_blocklist.site_url
-ORDER BY blocked_requests DESC
-LIMIT 20
-"""
-requests_per_site_url = conn.execute(sites_query).fetchall()
+comparison = CrawlPairComparison(
+    conn,
+    args.without_blocklist_id,
+    args.with_blocklist_id,
+    args.with_blocklist_database,
+)
+requests_per_site_url = comparison.get_blocked_requests_estimate(limit=20)
 
 # Print the results
 print("Estimated number of requests blocked by blocklist:")
@@ -77,34 +73,22 @@ for site_url in requests_per_site_url:
         f"{site_url[0]}: without_blocklist = {site_url[1]} | with_blocklist = {site_url[2]} | est_blocked_requests = {site_url[3]}"
     )
 
-# without blocklist id = 1502965085
-# with blocklist task 1835721461 id = 3251089431
-
 # GET REGEXP COINCIDENCES OF REQUESTS MADE BY CRAWLING WITHOUT BLOCKLIST
 
 # Get EasyList entries and convert them to RegExp
-with open("easylist_general_block.txt", "r") as f:
-    entries = f.read().splitlines()
-
-entry = "||example.com^"
-regex = re.compile(r"^https?://([^/]+\.)?" + re.escape(entry[2:-1]) + r"/")
-
-regexes = []
-for entry in entries:
-    if entry.startswith("||"):
-        regex = re.compile(r"^https?://([^/]+\.)?" + re.escape(entry[2:-1]) + r"/")
-        regexes.append(regex)
-    elif entry.startswith("|"):
-        regex = re.compile(re.escape(entry[1:]))
-        regexes.append(regex)
-    elif entry.startswith("/"):
-        regex = re.compile(entry[1:-1])
-        regexes.append(regex)
-
-
-# Use expressions to match with requests entries
-conn = sqlite3.connect("datadir/tranco_100.sqlite")
-c = conn.cursor()
+regexes = load_regexes("easylist_general_block.txt")
+
+# Amount of requests of each crawl that match each regex, from the URLs of both crawls loaded only once
+# (see regex_blocklist.py). Should I use top_level_url in stead of url?
+differences = get_blocklist_differences(
+    conn,
+    regexes,
+    args.without_blocklist_id,
+    args.with_blocklist_id,
+    "main" if args.with_blocklist_database is None else OTHER_DATABASE_SCHEMA,
+)
+comparison.close()
+conn.close()
 
 
 # Just as a tool to analyze the differences, we want to get relevant amount of blocks
@@ -114,25 +98,17 @@ max_dif = 0
 
 # Open a file to write the results
 with open("output_tranco100_regexes.txt", "w") as f:
-    for regex in regexes:
-        # Should I use top_level_url in stead of url?
-        # add the browser_id of the one without blocklist
-        query = "SELECT COUNT(*) FROM http_requests WHERE url REGEXP ? AND browser_id="
-        c.execute(query, (regex.pattern,))
-        result_without_blocklist = c.fetchone()
-
-        # add the browser_id of the one with blocklist
-        query = "SELECT COUNT(*) FROM http_requests WHERE url REGEXP ? AND browser_id="
-        c.execute(query, (regex.pattern,))
-        result_with_blocklist = c.fetchone()
-
-        difference = result_without_blocklist - result_with_blocklist
-
+    for (
+        pattern,
+        result_without_blocklist,
+        result_with_blocklist,
+        difference,
+    ) in differences:
         if difference > max_dif:
-            print(f"Estimated blocked requests for {regex.pattern}: {difference}")
+            print(f"Estimated blocked requests for {pattern}: {difference}")
 
             actual = (
-                regex.pattern,
+                pattern,
                 result_without_blocklist,
                 result_with_blocklist,
                 difference,
@@ -140,7 +116,5 @@ with open("output_tranco100_regexes.txt", "w") as f:
             asc_coincidences.append(actual)
             max_dif = difference
             f.write(
-                f"{len(asc_coincidences)}) {regex.pattern}: {result_without_blocklist} - {result_with_blocklist} = {difference}\n"
+                f"{len(asc_coincidences)}) {pattern}: {result_without_blocklist} - {result_with_blocklist} = {difference}\n"
             )
-
-conn.close()
@@ -0,0 +1,66 @@
+""" Memoized eTLD+1 resolution shared by all the scripts that classify third parties.
+
+tldextract.extract is called on columns such as top_level_url, which only take a handful of distinct values
+across millions of rows. Here every URL is reduced to its host first, and the tldextract result is cached by host
+in a bounded LRU cache, so each host is only parsed once.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import tldextract
+from tldextract.remote import lenient_netloc
+
+# Maximum amount of hosts kept in the cache
+CACHE_SIZE = 2**16
+
+
+class DomainResolver:
+    """Resolves the domain (second level domain) and registered_domain (eTLD+1) of URLs, memoized by host"""
+
+    def __init__(self, cache_size: int = CACHE_SIZE):
+        self._extract_host = lru_cache(maxsize=cache_size)(self._extract_host_uncached)
+
+    @staticmethod
+    def _extract_host_uncached(host: str) -> tuple:
+        extract_result = tldextract.extract(host)
+        return extract_result.domain, extract_result.registered_domain
+
+    @staticmethod
+    def get_host(url) -> str:
+        """Returns the host of url the same way tldextract reads it (without scheme, credentials or port)"""
+        if not isinstance(url, str):
+            return ""
+        return lenient_netloc(url)
+
+    def get_domain(self, url) -> str:
+        """Equivalent to tldextract.extract(url).domain"""
+        return self._extract_host(self.get_host(url))[0]
+
+    def get_registered_domain(self, url) -> str:
+        """Equivalent to tldextract.extract(url).registered_domain"""
+        return self._extract_host(self.get_host(url))[1]
+
+    def resolve_column(self, urls: pd.Series, attribute: str = "domain") -> pd.Series:
+        """Vectorised version of get_domain/get_registered_domain for a whole column.
+        The column is factorized, so only its unique values are resolved, and the results are mapped back to every row.
+        """
+        get_attribute = {
+            "domain": self.get_domain,
+            "registered_domain": self.get_registered_domain,
+        }[attribute]
+
+        codes, unique_urls = pd.factorize(urls)
+        resolved = np.array(
+            [get_attribute(url) for url in unique_urls] + [""], dtype=object
+        )
+        # Missing values get code -1, which picks the "" we appended at the end
+        return pd.Series(resolved[codes], index=urls.index, dtype=object)
+
+    def cache_info(self):
+        return self._extract_host.cache_info()
+
+
+# Shared resolver, so every script in the process uses the same cache
+DOMAIN_RESOLVER = DomainResolver()
@@ -1,57 +1,73 @@
 """ This file is used to search for the actual leakages in the crawled data (HTTP requests, JavaScripts, and Cookies).
-If we were to have perfomance issues, we could consider adding the eTLD+1's to the crawl_data database schema and save them at crawling time, so we can make the filtering in the SQL query in stead of relying on pandas dataframe.
+Crawls run with store_etld1=True on the storage provider have the optional *_etld1 columns (url_etld1, top_level_url_etld1,
+script_url_etld1, ..., see openwpm/storage/derived_columns.py), so their third party rows can be filtered in the SQL query
+(e.g. WHERE url_etld1 != top_level_url_etld1) in stead of in the pandas dataframe. The crawls analysed here were run
+without them, so the second level domains are resolved below with DOMAIN_RESOLVER.
 """
 
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 from pathlib import Path
-import tldextract
 
 # We are running this script standing in parent directory (leakage_processing.py file)
+from data_analysis.domain_resolver import DOMAIN_RESOLVER
 from data_analysis.leakages.keyword_encodings import Encodings
+from data_analysis.leakages.leakage_scanner import LeakageScanner
 from data_analysis.sqlite import (
-    CrawledDataQuery,
+    CrawledDataQueryByIdRange,
+    CrawledDataMaxIdQuery,
     LeakageTableCreationCommand,
     LeakageDropTableCommand,
     LeakageDataQueries,
     ColumnsToSearch,
     LeakageTableNames,
+    LeakageProgressQuery,
 )
 
 # CRAWL_DATA_PATH = Path("sqlite/[vpn_czech]10_crawls_results.sqlite")
 SEARCH_TERMS = ["JELLYBEANS"]
 SEARCH_TERMS_ENCODINGS = Encodings(SEARCH_TERMS)
+# Values without any direct encoding of the search terms are also decoded up to this many layers
+# (percent, base64, inflate, JSON) to find the terms hidden under chained encodings. It is opt-in, as decoding is
+# far slower than the direct search and finds more false positives: 0 disables it
+MAX_DECODING_DEPTH = 0
+LEAKAGE_SCANNER = LeakageScanner(
+    SEARCH_TERMS_ENCODINGS, max_decoding_depth=MAX_DECODING_DEPTH
+)
 
+# Amount of crawled rows read from the database and searched at a time,
+# so the memory used does not depend on the size of the crawl
+CHUNK_SIZE = 20000
 
-def search_leakage(
+# When searching in parallel, each table is split in this many id ranges per worker
+PARTITIONS_PER_WORKER = 4
+
+
+def find_leakages_in_chunk(
     table_df: pd.DataFrame,
     columns: list,
     table_name: str,
-    conn_leak: sqlite3.Connection,
-) -> None:
-    """Evaluates the existence of leakage in a given column among all of the entries of the given table_df.
+) -> tuple:
+    """Evaluates the existence of leakage in the given columns among all of the entries of the given table_df.
     The criteria used is Second-Level Domain difference.
-    Keep in mind that, due to the use of already_added_elements (which is used in order to not have duplicates in our leakages table),
-    this function does not detect all the leakages, but only the first one found for each original_id (if any).
+    Returns (resulting_leakages, leakage_hits): the leakages keep only one row for each original_id (with the
+    first encoding found for it), so they have no duplicates, while the hits have every (column, encoding) found.
+    table_df is usually one chunk of the crawled table, and it is modified in place to avoid copying it.
+    Nothing is written here, so it can run in the worker processes.
     """
 
-    df = table_df.copy()
-    already_added_elements = pd.Series([False] * len(table_df), index=df.index)
-
-    # (1) We will use DataFrame and concat with every new group of leakages after each column,
-    # because it is faster than appending to a list of DataFrames and then concatenating them.
-    # However, this is more memory heavy than the list approach, so we will have to be careful with the amount of data we are handling.
-    resulting_leakages = pd.DataFrame()
+    df = table_df
 
     # Filter the table_df to only contain the requests made to third parties
 
     if table_name == LeakageTableNames.HTTP_REQUESTS:
         # http_requests the leakage criteria is strict Second Level Domain matching
-        df.loc[:, "top_level_url_second_level_domain"] = df["top_level_url"].apply(
-            lambda url: tldextract.extract(url).domain
+        df.loc[:, "top_level_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["top_level_url"]
         )
-        df.loc[:, "request_url_second_level_domain"] = df["url"].apply(
-            lambda url: tldextract.extract(url).domain
+        df.loc[:, "request_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["url"]
         )
 
         # Get a series of boolean values that indicate whether the request is to a third party
@@ -66,14 +82,14 @@ def search_leakage(
     elif table_name == LeakageTableNames.JS:
         # javascripts leakage criteria is Second Level Domain between top_level_url and
         # script_url or top_level_url and document_url
-        df.loc[:, "top_level_url_second_level_domain"] = df["top_level_url"].apply(
-            lambda url: tldextract.extract(url).domain
+        df.loc[:, "top_level_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["top_level_url"]
         )
-        df.loc[:, "script_url_second_level_domain"] = df["script_url"].apply(
-            lambda url: tldextract.extract(url).domain
+        df.loc[:, "script_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["script_url"]
         )
-        df.loc[:, "document_url_second_level_domain"] = df["document_url"].apply(
-            lambda url: tldextract.extract(url).domain
+        df.loc[:, "document_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["document_url"]
         )
 
         # Get a series of boolean values that indicate whether the request is to a third party for both cases
@@ -89,12 +105,10 @@ def search_leakage(
 
     elif table_name == LeakageTableNames.COOKIES:
         # cookies leakage criteria is Second Level Domain between site_url and host
-        df["site_url_second_level_domain"] = df["site_url"].apply(
-            lambda url: tldextract.extract(url).domain
-        )
-        df["host_second_level_domain"] = df["host"].apply(
-            lambda url: tldextract.extract(url).domain
+        df["site_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["site_url"]
         )
+        df["host_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(df["host"])
 
         # Get a series of boolean values that indicate whether the request is to a third party
         requests_to_third_parties = (
@@ -104,90 +118,294 @@ def search_leakage(
         # Filter dataframe based on condition (using the series as a mask)
         df = df[requests_to_third_parties]
 
-    # Traverse all search_terms (just one for now)
-    for keyword in SEARCH_TERMS_ENCODINGS.search_terms:
-        # Traverse original and lowercase
-        for keyword_case in SEARCH_TERMS_ENCODINGS.encodings[keyword].keys():
-            # Traverse all encodings for the current search term and case
-            for encoding_name, encoded_term in SEARCH_TERMS_ENCODINGS.encodings[
-                keyword
-            ][keyword_case].items():
-                for i, column in enumerate(columns):
-                    # Get a series of boolean True values to filter only for the rows that contain the search term with the actual evaluated encoding
-                    leakages_indexes = pd.Series(
-                        df[column].str.contains(
-                            encoded_term,
-                            na=False,
-                            case=True,  # We are handling the casing in the SEARCH_TERMS_ENCODINGS, so we set this to True to avoid duplicates
-                        ),
-                        index=df.index,
-                    )
-                    # We must also filter out the rows that have already been added to the leakages table, in order to not include duplicates
-                    complete_mask = pd.Series(
-                        leakages_indexes & ~already_added_elements, index=df.index
-                    )
-                    # We update the already_added_elements series to include the new found leakages
-                    already_added_elements = pd.Series(
-                        already_added_elements | leakages_indexes, index=df.index
-                    )
-
-                    leakages = df[complete_mask].copy()
-                    if not leakages.empty:
-                        print(
-                            f"Leakages found in column {column} with search"
-                            f" encoded_term: {encoded_term}"
-                        )
-                        # Add the encoding and site_url to the leakages DataFrame
-                        if keyword_case == "lowercase":
-                            encoding_name = encoding_name + "_lowercase"
-
-                        # Pandas can confuse wether to make this assignment to a copy or to the original leakages table, so better to specify it with .loc
-                        leakages.loc[:, "encoding"] = encoding_name
-                        leakages.loc[:, "original_id"] = df.loc[
-                            complete_mask, "original_id"
-                        ]
-
-                    # (1) Here we can use a list, append leakages and concat at the end (in stead of a DataFrame and concat here directly)
-                    resulting_leakages = pd.concat(
-                        [resulting_leakages, leakages],
-                        ignore_index=True,  # Not sure if ignore_index should be True
-                    )
+    # Scan every cell of the relevant columns once for all the encodings at the same time
+    hits = LEAKAGE_SCANNER.scan(df, columns)
+
+    # Every (column, encoding) hit is saved in the hits table
+    leakage_hits = pd.DataFrame(
+        {
+            "table_name": str(table_name),
+            "original_id": df.loc[hits["row_index"], "original_id"].to_numpy(),
+            "visit_id": df.loc[hits["row_index"], "visit_id"].to_numpy(),
+            "site_url": df.loc[hits["row_index"], "site_url"].to_numpy(),
+            "column_name": hits["column_name"].to_numpy(),
+            "search_term": hits["search_term"].to_numpy(),
+            "encoding": hits["encoding"].to_numpy(),
+        }
+    )
+
+    # The leakages table keeps one row per original_id, with the first search term and encoding found for it
+    # (hits are sorted by row and then by encoding and column order)
+    first_hits = hits.drop_duplicates(subset="row_index", keep="first")
+    resulting_leakages = df.loc[first_hits["row_index"]].copy()
+    resulting_leakages.loc[:, "search_term"] = first_hits["search_term"].to_numpy()
+    resulting_leakages.loc[:, "encoding"] = first_hits["encoding"].to_numpy()
+
+    return resulting_leakages, leakage_hits
+
+
+def save_leakages(
+    resulting_leakages: pd.DataFrame,
+    leakage_hits: pd.DataFrame,
+    table_name: str,
+    conn_leak: sqlite3.Connection,
+) -> None:
+    """Appends the leakages and hits found by find_leakages_in_chunk to the leakage database"""
+    for (column, search_term, encoding_name), hits_count in (
+        leakage_hits.groupby(["column_name", "search_term", "encoding"], sort=False)
+        .size()
+        .items()
+    ):
+        print(
+            f"Leakages of {search_term} found in column {column} with encoding"
+            f" {encoding_name}: {hits_count}"
+        )
+
+    leakage_hits.to_sql(
+        LeakageTableNames.HITS, conn_leak, if_exists="append", index=False
+    )
     resulting_leakages.to_sql(table_name, conn_leak, if_exists="append", index=False)
-    print(f"Finished table {table_name}")
+
+
+def search_leakage(
+    table_df: pd.DataFrame,
+    columns: list,
+    table_name: str,
+    conn_leak: sqlite3.Connection,
+) -> None:
+    """Finds the leakages of table_df and saves them in the leakage database (see find_leakages_in_chunk)"""
+    resulting_leakages, leakage_hits = find_leakages_in_chunk(
+        table_df, columns, table_name
+    )
+    save_leakages(resulting_leakages, leakage_hits, table_name, conn_leak)
+
+
+def split_id_range(min_id: int, max_id: int, partitions: int) -> list:
+    """Splits the id range (min_id, max_id] in at most `partitions` contiguous (min_id, max_id] ranges.
+    Crawled ids are consecutive, so every range gets about the same amount of rows.
+    """
+    if max_id <= min_id:
+        return []
+    step = max(1, -(-(max_id - min_id) // partitions))
+    return [
+        (range_min_id, min(range_min_id + step, max_id))
+        for range_min_id in range(min_id, max_id, step)
+    ]
+
+
+# Connection to the crawl database of each worker process (see _init_worker)
+_worker_conn = None
+
+
+def _init_worker(crawl_data_path: Path) -> None:
+    """Runs once when each worker process starts. The worker keeps its own read connection to the crawl database
+    for all the partitions it searches, and uses the LEAKAGE_SCANNER of its copy of this module, so the matcher is
+    compiled once per worker in stead of being sent with every partition.
+    """
+    global _worker_conn
+    _worker_conn = sqlite3.connect(crawl_data_path)
+
+
+def _search_partition(
+    query: str,
+    columns: list,
+    table_name: str,
+    min_id: int,
+    max_id: int,
+    chunksize: int,
+) -> tuple:
+    """Searches the rows of one table with id in (min_id, max_id] in a worker process.
+    Returns (rows_searched, resulting_leakages, leakage_hits), to be saved by the main process.
+    """
+    leakages_list = []
+    hits_list = []
+    rows_searched = 0
+    for table_chunk in pd.read_sql_query(
+        query,
+        _worker_conn,
+        params={"min_id": min_id, "max_id": max_id},
+        chunksize=chunksize,
+    ):
+        resulting_leakages, leakage_hits = find_leakages_in_chunk(
+            table_chunk, columns, table_name
+        )
+        leakages_list.append(resulting_leakages)
+        hits_list.append(leakage_hits)
+        rows_searched += len(table_chunk)
+
+    if rows_searched == 0:
+        return 0, None, None
+    return (
+        rows_searched,
+        pd.concat(leakages_list, ignore_index=True),
+        pd.concat(hits_list, ignore_index=True),
+    )
+
+
+def get_last_analysed_id(conn_leak: sqlite3.Connection, table_name: str) -> int:
+    """Returns the last crawled id (original_id) that was analysed for table_name, or 0 if it was never analysed"""
+    row = conn_leak.execute(
+        LeakageProgressQuery.GET_LAST_ORIGINAL_ID, (str(table_name),)
+    ).fetchone()
+    return row[0] if row is not None else 0
+
+
+def discard_leakages_after_id(
+    conn_leak: sqlite3.Connection, table_name: str, last_original_id: int
+) -> None:
+    """Deletes the leakages found after last_original_id, which can only be there if a previous run was interrupted
+    before updating its progress. This way rows are never added twice to the leakage tables.
+    """
+    conn_leak.execute(
+        f"DELETE FROM {table_name} WHERE original_id > ?;", (last_original_id,)
+    )
+    conn_leak.execute(
+        f"DELETE FROM {LeakageTableNames.HITS} WHERE table_name = ? AND original_id > ?;",
+        (str(table_name), last_original_id),
+    )
+    conn_leak.commit()
+
+
+def save_progress(
+    conn_leak: sqlite3.Connection, table_name: str, last_original_id: int
+) -> None:
+    """Saves last_original_id as the last crawled id analysed for table_name"""
+    conn_leak.execute(
+        LeakageProgressQuery.SET_LAST_ORIGINAL_ID,
+        (str(table_name), last_original_id),
+    )
+    conn_leak.commit()
+
+
+def search_in_parallel(
+    CRAWL_DATA_PATH: Path,
+    conn_leak: sqlite3.Connection,
+    crawled_data_dict: dict,
+    id_ranges: list,
+    chunksize: int,
+    workers: int,
+) -> None:
+    """Searches the id_ranges of the three tables at the same time in a pool of worker processes.
+    Every table range is split in PARTITIONS_PER_WORKER * workers smaller id ranges, so the workers are kept busy
+    until the end even if some partitions take longer than others. The workers only read the crawl database and
+    scan it; the leakages they find are written here by the main process, which is the only writer of conn_leak.
+    """
+    # Amount of partitions of each table that have not been saved yet
+    pending_partitions = [0, 0, 0]
+    rows_searched = [0, 0, 0]
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(CRAWL_DATA_PATH,)
+    ) as executor:
+        # Future of every partition -> index of its table in crawled_data_dict
+        futures = {}
+        for i in range(3):
+            table_name = crawled_data_dict["table_names"][i]
+            partitions = split_id_range(
+                *id_ranges[i], partitions=PARTITIONS_PER_WORKER * workers
+            )
+            for min_id, max_id in partitions:
+                future = executor.submit(
+                    _search_partition,
+                    crawled_data_dict["queries"][i],
+                    crawled_data_dict["columns"][i],
+                    table_name,
+                    min_id,
+                    max_id,
+                    chunksize,
+                )
+                futures[future] = i
+            pending_partitions[i] = len(partitions)
+            print(f"Starting table {table_name} in {len(partitions)} partitions...\n")
+
+            # Nothing to search in this table
+            if not partitions:
+                save_progress(conn_leak, table_name, id_ranges[i][1])
+                print(f"Finished table {table_name}")
+
+        for future in as_completed(futures):
+            i = futures[future]
+            table_name = crawled_data_dict["table_names"][i]
+            partition_rows, resulting_leakages, leakage_hits = future.result()
+            if partition_rows > 0:
+                save_leakages(resulting_leakages, leakage_hits, table_name, conn_leak)
+                conn_leak.commit()
+            rows_searched[i] += partition_rows
+            pending_partitions[i] -= 1
+            print(f"Searched {rows_searched[i]} rows of {table_name}")
+
+            # Save the progress only once every partition of the table has been searched
+            if pending_partitions[i] == 0:
+                save_progress(conn_leak, table_name, id_ranges[i][1])
+                print(f"Finished table {table_name}")
 
 
 def find_leakages(
-    CRAWL_DATA_PATH: Path, LEAKAGE_DATA_PATH: Path, OVERALL_OUTPUT_PATH: Path
+    CRAWL_DATA_PATH: Path,
+    LEAKAGE_DATA_PATH: Path,
+    OVERALL_OUTPUT_PATH: Path,
+    chunksize: int = CHUNK_SIZE,
+    incremental: bool = False,
+    workers: int = 1,
 ):
+    """Searches the leakages of the crawled data in CRAWL_DATA_PATH and saves them in LEAKAGE_DATA_PATH.
+    If incremental is True, the leakage tables are kept and only the crawled rows added after the last analysed
+    id of each table (saved in the leakage_analysis_progress table) are searched. Otherwise everything is searched again.
+    If workers is greater than 1, the search runs in that many processes (see search_in_parallel).
+    """
     # Connect to the SQLite database
     conn = sqlite3.connect(CRAWL_DATA_PATH)
 
-    # Read the data into separate pandas DataFrames
-    http_requests_data = pd.read_sql_query(CrawledDataQuery.HTTP_REQUESTS, conn)
-    javascript_data = pd.read_sql_query(CrawledDataQuery.JS, conn)
-    javascript_cookies_data = pd.read_sql_query(CrawledDataQuery.COOKIES, conn)
-
     # New encodings:
     # We could use Ciphey as  paper suggests, but we will add them manually for now
 
     # Connect to the SQLite database for leakage data
     conn_leak = sqlite3.connect(LEAKAGE_DATA_PATH)
 
-    # Drop previous leakage tables
-    conn_leak.execute(LeakageDropTableCommand.HTTP_REQUESTS)
-    conn_leak.execute(LeakageDropTableCommand.JS)
-    conn_leak.execute(LeakageDropTableCommand.COOKIES)
+    # Drop previous leakage tables (unless we are only adding the new crawled data to them)
+    if not incremental:
+        conn_leak.execute(LeakageDropTableCommand.HTTP_REQUESTS)
+        conn_leak.execute(LeakageDropTableCommand.JS)
+        conn_leak.execute(LeakageDropTableCommand.COOKIES)
+        conn_leak.execute(LeakageDropTableCommand.HITS)
+        conn_leak.execute(LeakageDropTableCommand.PROGRESS)
 
     # Create leakage tables
     conn_leak.execute(LeakageTableCreationCommand.HTTP_REQUESTS)
     conn_leak.execute(LeakageTableCreationCommand.JS)
     conn_leak.execute(LeakageTableCreationCommand.COOKIES)
+    conn_leak.execute(LeakageTableCreationCommand.HITS)
+    conn_leak.execute(LeakageTableCreationCommand.PROGRESS)
+
+    # Leakage databases analysed before the search terms were saved get the (empty) column, so they can be extended
+    for leakage_table in (
+        LeakageTableNames.HTTP_REQUESTS,
+        LeakageTableNames.JS,
+        LeakageTableNames.COOKIES,
+        LeakageTableNames.HITS,
+    ):
+        table_columns = {
+            row[1] for row in conn_leak.execute(f"PRAGMA table_info({leakage_table})")
+        }
+        if "search_term" not in table_columns:
+            conn_leak.execute(
+                f"ALTER TABLE {leakage_table} ADD COLUMN search_term TEXT"
+            )
 
     conn_leak.commit()
 
     # Search for leakage in relevant columns
     crawled_data_dict = {
-        "tables": [http_requests_data, javascript_data, javascript_cookies_data],
+        "queries": [
+            CrawledDataQueryByIdRange.HTTP_REQUESTS,
+            CrawledDataQueryByIdRange.JS,
+            CrawledDataQueryByIdRange.COOKIES,
+        ],
+        "max_id_queries": [
+            CrawledDataMaxIdQuery.HTTP_REQUESTS,
+            CrawledDataMaxIdQuery.JS,
+            CrawledDataMaxIdQuery.COOKIES,
+        ],
         "columns": [
             ColumnsToSearch.HTTP_REQUESTS.value,
             ColumnsToSearch.JS.value,
@@ -202,12 +420,50 @@ def find_leakages(
 
     print("Starting leakage search... \n")
 
+    # Only the rows in (last_original_id, max_original_id] of each table are searched. max_original_id is fixed
+    # before starting, so rows added to the crawl database while we search are left for the next run
+    id_ranges = []
     for i in range(3):
-        table = crawled_data_dict["tables"][i]
-        columns = crawled_data_dict["columns"][i]
         table_name = crawled_data_dict["table_names"][i]
-        print(f"Starting table {table_name}...\n")
-        search_leakage(table, columns, table_name, conn_leak)
+        last_original_id = get_last_analysed_id(conn_leak, table_name)
+        max_original_id = conn.execute(
+            crawled_data_dict["max_id_queries"][i]
+        ).fetchone()[0]
+        discard_leakages_after_id(conn_leak, table_name, last_original_id)
+        print(
+            f"Searching {table_name} rows with id in ({last_original_id},"
+            f" {max_original_id}]"
+        )
+        id_ranges.append((last_original_id, max(last_original_id, max_original_id)))
+
+    if workers > 1:
+        search_in_parallel(
+            CRAWL_DATA_PATH, conn_leak, crawled_data_dict, id_ranges, chunksize, workers
+        )
+    else:
+        for i in range(3):
+            query = crawled_data_dict["queries"][i]
+            columns = crawled_data_dict["columns"][i]
+            table_name = crawled_data_dict["table_names"][i]
+            last_original_id, max_original_id = id_ranges[i]
+            print(f"Starting table {table_name}...\n")
+
+            # The crawled data is read in chunks of at most chunksize rows (the cursor is consumed lazily),
+            # and the leakages of each chunk are appended to the leakage tables before reading the next one
+            rows_searched = 0
+            for table_chunk in pd.read_sql_query(
+                query,
+                conn,
+                params={"min_id": last_original_id, "max_id": max_original_id},
+                chunksize=chunksize,
+            ):
+                search_leakage(table_chunk, columns, table_name, conn_leak)
+                rows_searched += len(table_chunk)
+                print(f"Searched {rows_searched} rows of {table_name}")
+
+            # Save the progress only once the whole range has been searched
+            save_progress(conn_leak, table_name, max_original_id)
+            print(f"Finished table {table_name}")
 
     # Write about general crawling results
     queries = LeakageDataQueries.QUERIES
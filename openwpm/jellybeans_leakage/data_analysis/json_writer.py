@@ -0,0 +1,121 @@
+""" Incremental JSON and JSON Lines writers for the reports generated from the SQLite databases.
+
+json.dump needs the whole document in memory before writing anything, which does not scale to the full crawls.
+StreamingJSONWriter writes objects, arrays and values as they are produced (e.g. one row at a time while iterating
+a cursor), so memory stays flat. Unless compact is set, the output is the same json.dump(..., indent=4) would
+produce. JSONLinesWriter writes one JSON document per line, which can also be read back one record at a time.
+Both can compress the output with gzip.
+"""
+
+import gzip
+import json
+from pathlib import Path
+
+INDENT = 4
+
+
+def open_output(OUTPUT_PATH: Path, compress: bool = False):
+    """Opens OUTPUT_PATH for writing text, compressed with gzip if compress is True"""
+    if compress:
+        return gzip.open(OUTPUT_PATH, "wt", encoding="utf-8")
+    return open(OUTPUT_PATH, "w")
+
+
+class StreamingJSONWriter:
+    """Writes a JSON document piece by piece. Every begin_object/begin_array has to be closed with
+    end_object/end_array, and keys are given only to the values written inside an object, e.g.
+
+        with StreamingJSONWriter(path) as writer:
+            writer.begin_object()
+            writer.begin_array("rows")
+            for row in cursor:
+                writer.write_value(row)
+            writer.end_array()
+            writer.end_object()
+    """
+
+    def __init__(
+        self, OUTPUT_PATH: Path, compact: bool = False, compress: bool = False
+    ):
+        self.output_file = open_output(OUTPUT_PATH, compress)
+        self.compact = compact
+        # One entry for each open container: whether anything has been written in it yet
+        self._has_items = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.output_file.close()
+
+    def _newline(self, depth: int) -> str:
+        return "" if self.compact else "\n" + " " * (INDENT * depth)
+
+    def _write_prefix(self, key):
+        """Writes the separator, indentation and key that go before a new item of the current container"""
+        if not self._has_items:
+            return
+        prefix = "," if self._has_items[-1] else ""
+        self._has_items[-1] = True
+        prefix += self._newline(len(self._has_items))
+        if key is not None:
+            prefix += json.dumps(key) + (":" if self.compact else ": ")
+        self.output_file.write(prefix)
+
+    def _begin(self, key, opening: str):
+        self._write_prefix(key)
+        self.output_file.write(opening)
+        self._has_items.append(False)
+
+    def _end(self, closing: str):
+        has_items = self._has_items.pop()
+        if has_items:
+            self.output_file.write(self._newline(len(self._has_items)))
+        self.output_file.write(closing)
+
+    def begin_object(self, key=None):
+        self._begin(key, "{")
+
+    def end_object(self):
+        self._end("}")
+
+    def begin_array(self, key=None):
+        self._begin(key, "[")
+
+    def end_array(self):
+        self._end("]")
+
+    def write_value(self, value, key=None):
+        """Writes a whole value (anything json.dumps can serialize) as the next item"""
+        self._write_prefix(key)
+        if self.compact:
+            self.output_file.write(json.dumps(value, separators=(",", ":")))
+        else:
+            # Nested lines have to be indented as deep as the value is
+            self.output_file.write(
+                json.dumps(value, indent=INDENT).replace(
+                    "\n", self._newline(len(self._has_items))
+                )
+            )
+
+
+class JSONLinesWriter:
+    """Writes one compact JSON document (record) per line"""
+
+    def __init__(self, OUTPUT_PATH: Path, compress: bool = False):
+        self.output_file = open_output(OUTPUT_PATH, compress)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.output_file.close()
+
+    def write(self, record):
+        self.output_file.write(json.dumps(record, separators=(",", ":")) + "\n")
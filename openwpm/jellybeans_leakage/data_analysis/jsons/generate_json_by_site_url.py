@@ -2,9 +2,11 @@
 from pathlib import Path
 import sqlite3
 import json
-from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
 
-from sqlite import DetailsQueryBySiteURL
+from sqlite import DetailsQueryGroupedBySiteURL, DetailsIndexCreationCommand
+from json_writer import StreamingJSONWriter, JSONLinesWriter
 
 import utils as utils
 
@@ -28,59 +30,109 @@ SITES = [
 ]
 
 
-def prepare_dictionary():
-    """Return an empty dictionary with the correct keys for data by site_url and then by type"""
-    # Organize the data by search engine
-    return {
-        search_engine_name: {
-            "search_url": search_url,
-            "cookies": 0,
-            "javascripts": 0,
-            "http_requests": 0,
-            "data": {
-                "cookies": [],
-                "javascripts": [],
-                "http_requests": [],
-            },
-        }
-        for search_engine_name, search_url in SITES
-    }
-
-
-def generate_overall_details_json(DATA_PATH: Path, OUTPUT_PATH: Path):
+def generate_overall_details_json(
+    DATA_PATH: Path,
+    OUTPUT_PATH: Path,
+    json_lines: bool = False,
+    compact: bool = False,
+    compress: bool = False,
+):
+    """Writes the crawled data organized by search engine and then by type to OUTPUT_PATH.
+    Every row is written as soon as it is read from the database, so memory does not grow with the crawl.
+    If json_lines is True, each row is written as one line ({"search_engine", "search_url", "type", "data"}) in stead
+    of a single JSON document. compact removes the indentation of the JSON document, and compress gzips the output.
+    Search engines are written ordered by search_url, and the amount of rows of each type after their data.
+    """
     # Connect to the SQLite database
     conn = sqlite3.connect(DATA_PATH)
 
-    data_details = prepare_dictionary()
+    # Indexes to get the rows of each site_url without scanning the whole tables
+    for index_command in DetailsIndexCreationCommand:
+        conn.execute(index_command)
+    conn.commit()
 
-    for site_name, site_url in SITES:
-        SITE_QUERIES = DetailsQueryBySiteURL(site_url)
-        site = data_details[site_name]
+    sites_param = (json.dumps([site_url for _, site_url in SITES]),)
 
+    # One query per table gets the rows of every site, ordered by site_url.
+    # The three cursors are read at the same time, one site after another
+    data_queries = [
         # First Cookies
-        cookies = conn.execute(SITE_QUERIES.COOKIES).fetchall()
-        site["cookies"] = len(cookies)
-        for row in cookies:
-            row_element = utils.get_processed_cookie_row(row)
-            site["data"]["cookies"].append(row_element)
-
+        (
+            "cookies",
+            DetailsQueryGroupedBySiteURL.COOKIES,
+            utils.get_processed_cookie_row,
+        ),
         # Then Javascript
-        javascripts = conn.execute(SITE_QUERIES.JS).fetchall()
-        site["javascripts"] = len(javascripts)
-        for row in javascripts:
-            row_element = utils.get_processed_javascript_row(row)
-            site["data"]["javascripts"].append(row_element)
-
+        (
+            "javascripts",
+            DetailsQueryGroupedBySiteURL.JS,
+            utils.get_processed_javascript_row,
+        ),
         # Lastly HTTP Requests
-        http_requests = conn.execute(SITE_QUERIES.HTTPRequests).fetchall()
-        site["http_requests"] = len(http_requests)
-        for row in http_requests:
-            row_element = utils.get_processed_http_request_row(row)
-            site["data"]["http_requests"].append(row_element)
-
-    # Save the leakage details in JSON format
-    with open(OUTPUT_PATH, "w") as outfile:
-        json.dump(data_details, outfile, indent=4, sort_keys=False)
+        (
+            "http_requests",
+            DetailsQueryGroupedBySiteURL.HTTP_REQUESTS,
+            utils.get_processed_http_request_row,
+        ),
+    ]
+    site_groups = {
+        data_type: groupby(conn.execute(query, sites_param), key=itemgetter(0))
+        for data_type, query, _ in data_queries
+    }
+    # Next (site_url, site_rows) group of each cursor
+    current_groups = {
+        data_type: next(groups, None) for data_type, groups in site_groups.items()
+    }
+
+    def iter_site_rows(site_url, data_type, process_row):
+        """Yields the processed rows of data_type for site_url, and moves its cursor to the next site"""
+        current_group = current_groups[data_type]
+        if current_group is None or current_group[0] != site_url:
+            return
+        for row in current_group[1]:
+            # The first column (site_url) is only used to group the rows
+            yield process_row(row[1:])
+        current_groups[data_type] = next(site_groups[data_type], None)
+
+    if json_lines:
+        writer = JSONLinesWriter(OUTPUT_PATH, compress=compress)
+    else:
+        writer = StreamingJSONWriter(OUTPUT_PATH, compact=compact, compress=compress)
+        writer.begin_object()
+
+    for site_name, site_url in sorted(SITES, key=itemgetter(1)):
+        if json_lines:
+            for data_type, _, process_row in data_queries:
+                for row_element in iter_site_rows(site_url, data_type, process_row):
+                    writer.write(
+                        {
+                            "search_engine": site_name,
+                            "search_url": site_url,
+                            "type": data_type,
+                            "data": row_element,
+                        }
+                    )
+            continue
+
+        writer.begin_object(site_name)
+        writer.write_value(site_url, "search_url")
+        writer.begin_object("data")
+        amounts = dict()
+        for data_type, _, process_row in data_queries:
+            amounts[data_type] = 0
+            writer.begin_array(data_type)
+            for row_element in iter_site_rows(site_url, data_type, process_row):
+                writer.write_value(row_element)
+                amounts[data_type] += 1
+            writer.end_array()
+        writer.end_object()
+        for data_type, amount in amounts.items():
+            writer.write_value(amount, data_type)
+        writer.end_object()
+
+    if not json_lines:
+        writer.end_object()
+    writer.close()
     print("Document saved in: ", OUTPUT_PATH)
 
     # Close the database connection
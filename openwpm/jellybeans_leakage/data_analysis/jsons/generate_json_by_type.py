@@ -4,9 +4,11 @@ import base64
 from pathlib import Path
 import sqlite3
 import json
-from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
 
-from sqlite import DetailsQueryBySiteURL
+from sqlite import DetailsQueryGroupedBySiteURL, DetailsIndexCreationCommand
+from json_writer import StreamingJSONWriter, JSONLinesWriter
 
 import utils as utils
 
@@ -30,51 +32,85 @@ SITES = [
 ]
 
 
-def generate_overall_details_json(DATA_PATH: Path, OUTPUT_PATH: Path):
+def generate_overall_details_json(
+    DATA_PATH: Path,
+    OUTPUT_PATH: Path,
+    json_lines: bool = False,
+    compact: bool = False,
+    compress: bool = False,
+):
+    """Writes the crawled data organized by type and then by site URL to OUTPUT_PATH.
+    Every row is written as soon as it is read from the database, so memory does not grow with the crawl.
+    If json_lines is True, each row is written as one line ({"type", "site_url", "data"}) in stead of a single
+    JSON document. compact removes the indentation of the JSON document, and compress gzips the output.
+    Sites are written ordered by site_url.
+    """
     # Connect to the SQLite database
     conn = sqlite3.connect(DATA_PATH)
 
-    # Organize the leakage data by leakage_type and site_url
-    data_details = {
-        "cookies": defaultdict(lambda: defaultdict(list)),
-        "javascripts": defaultdict(lambda: defaultdict(list)),
-        "http_requests": defaultdict(lambda: defaultdict(list)),
-    }
+    # Indexes to get the rows of each site_url without scanning the whole tables
+    for index_command in DetailsIndexCreationCommand:
+        conn.execute(index_command)
+    conn.commit()
 
-    cookies_amount = 0
-    javascripts_amount = 0
-    http_requests_amount = 0
-
-    for site_url in SITES:
-        SITE_QUERIES = DetailsQueryBySiteURL(site_url)
+    sites_param = (json.dumps(SITES),)
 
+    # One query per table gets the rows of every site, ordered by site_url
+    data_queries = [
         # First Cookies Leakages (least frequent)
-        cookies = conn.execute(SITE_QUERIES.COOKIES).fetchall()
-        cookies_amount += len(cookies)
-        for row in cookies:
-            row_element = utils.get_processed_cookie_row(row)
-            data_details["cookies"]["data"][site_url].append(row_element)
-
+        (
+            "cookies",
+            DetailsQueryGroupedBySiteURL.COOKIES,
+            utils.get_processed_cookie_row,
+        ),
         # Then Javascript Leakages (more frequent)
-        javascripts = conn.execute(SITE_QUERIES.JS).fetchall()
-        javascripts_amount += len(javascripts)
-        for row in javascripts:
-            row_element = utils.get_processed_javascript_row(row)
-            data_details["javascripts"]["data"][site_url].append(row_element)
-
+        (
+            "javascripts",
+            DetailsQueryGroupedBySiteURL.JS,
+            utils.get_processed_javascript_row,
+        ),
         # Lastly HTTP Requests Leakages (most frequent)
-        http_requests = conn.execute(SITE_QUERIES.HTTPRequests).fetchall()
-        http_requests_amount += len(http_requests)
-        for row in http_requests:
-            row_element = utils.get_processed_http_request_row(row)
-            data_details["http_requests"]["data"][site_url].append(row_element)
-    data_details["cookies"]["amount"] = cookies_amount
-    data_details["javascripts"]["amount"] = javascripts_amount
-    data_details["http_requests"]["amount"] = http_requests_amount
-
-    # Save the leakage details in JSON format
-    with open(OUTPUT_PATH, "w") as outfile:
-        json.dump(data_details, outfile, indent=4, sort_keys=False)
+        (
+            "http_requests",
+            DetailsQueryGroupedBySiteURL.HTTP_REQUESTS,
+            utils.get_processed_http_request_row,
+        ),
+    ]
+    if json_lines:
+        with JSONLinesWriter(OUTPUT_PATH, compress=compress) as writer:
+            for data_type, query, process_row in data_queries:
+                cursor = conn.execute(query, sites_param)
+                for row in cursor:
+                    # The first column is the site_url
+                    writer.write(
+                        {
+                            "type": data_type,
+                            "site_url": row[0],
+                            "data": process_row(row[1:]),
+                        }
+                    )
+    else:
+        # Organize the data by type and site_url
+        with StreamingJSONWriter(
+            OUTPUT_PATH, compact=compact, compress=compress
+        ) as writer:
+            writer.begin_object()
+            for data_type, query, process_row in data_queries:
+                amount = 0
+                writer.begin_object(data_type)
+                writer.begin_object("data")
+                cursor = conn.execute(query, sites_param)
+                for site_url, site_rows in groupby(cursor, key=itemgetter(0)):
+                    writer.begin_array(site_url)
+                    for row in site_rows:
+                        # The first column (site_url) is only used to group the rows
+                        writer.write_value(process_row(row[1:]))
+                        amount += 1
+                    writer.end_array()
+                writer.end_object()
+                writer.write_value(amount, "amount")
+                writer.end_object()
+            writer.end_object()
     print("Document saved in: ", OUTPUT_PATH)
 
     # Close the database connection
@@ -0,0 +1,147 @@
+""" Registry of the encoders applied to the search terms before looking for them in the crawled data.
+
+Every encoder is a function that receives a keyword and returns its encoded form as a string. New encodings are
+added by decorating a function with register_encoder, e.g.
+
+    @register_encoder("base85")
+    def _base85(keyword):
+        return base64.b85encode(keyword.encode()).decode()
+
+Encoders are applied in registration order, which is also the order in which the encodings of a keyword are
+reported. If the output of an encoder changes, its version has to be increased so the cached catalogue
+(see keyword_encodings.py) does not keep serving the old encodings.
+"""
+
+import base64
+import codecs
+import hashlib
+import json
+import zlib
+from functools import partial
+
+import base58
+from crccheck.crc import Crc16
+from Crypto.Hash import RIPEMD160
+
+# Encoding name -> (encoder function, version)
+ENCODERS = dict()
+
+
+def register_encoder(name: str, version: int = 1):
+    """Decorator to add an encoder to the registry under the given name"""
+
+    def decorator(encoder):
+        ENCODERS[name] = (encoder, version)
+        return encoder
+
+    return decorator
+
+
+def get_encoder_set_key(encoder_names: list) -> str:
+    """Returns a key that identifies the given encoders (and their versions), used to cache their encodings"""
+    encoder_set = [[name, ENCODERS[name][1]] for name in encoder_names]
+    return hashlib.sha1(json.dumps(encoder_set).encode()).hexdigest()
+
+
+# Encodings: base16, base32, base32hex, base58, base64, gz, bzip2, deflate, md2, md4, md5, sha1, sha224, sha256, sha384, sha512, crc16, crc32, sha3_224, sh3_256, sh3_384, sh3_512, ripemd_128, ripemd_169, ripemd_256, ripemd_320,  whirlpool,  rot13, snefru128, snefru256,  adler32, blake2s, blake2b.
+# Bear in mind that there are some encodings that are not reversible, so the original keyword cannot be recovered.
+# Also, some encodings used here produce outputs that don't resemble the original keyword which may lead to false positives when searching for the keyword.
+
+
+# Original keyword
+@register_encoder("original")
+def _original(keyword):
+    return keyword
+
+
+# Base encodings
+@register_encoder("base16")
+def _base16(keyword):
+    return codecs.encode(keyword.encode(), "hex").decode()
+
+
+@register_encoder("base32")
+def _base32(keyword):
+    return base64.b32encode(keyword.encode()).decode()
+
+
+@register_encoder("base32hex")
+def _base32hex(keyword):
+    # Kept as it has always been computed (uppercase base16), so the results stay comparable with previous analyses
+    return base64.b16encode(keyword.encode()).decode()
+
+
+@register_encoder("base58")
+def _base58(keyword):
+    return base58.b58encode(keyword.encode()).decode()
+
+
+@register_encoder("base64")
+def _base64(keyword):
+    return base64.b64encode(keyword.encode()).decode()
+
+
+# Compression algorithms (false-positive risky)
+# gzip and bzip2 are not registered because they are giving trouble
+@register_encoder("deflate")
+def _deflate(keyword):
+    compressed_data = zlib.compress(keyword.encode())
+    deflated_data = compressed_data[2:-4]  # Remove zlib header and footer
+    return base64.b64encode(deflated_data).decode(errors="ignore")
+
+
+# Hash functions (false-positive risky)
+def _hash(hash_function, keyword):
+    hasher = hash_function()
+    hasher.update(keyword.encode())
+    return hasher.hexdigest()
+
+
+for hash_name, hash_function in [
+    ("md5", hashlib.md5),
+    ("sha1", hashlib.sha1),
+    ("sha224", hashlib.sha224),
+    ("sha256", hashlib.sha256),
+    ("sha384", hashlib.sha384),
+    ("sha512", hashlib.sha512),
+    ("sha3_224", hashlib.sha3_224),
+    ("sha3_256", hashlib.sha3_256),
+    ("sha3_384", hashlib.sha3_384),
+    ("sha3_512", hashlib.sha3_512),
+    ("blake2s", hashlib.blake2s),
+    ("blake2b", hashlib.blake2b),
+]:
+    register_encoder(hash_name)(partial(_hash, hash_function))
+
+
+# RIPEMD hash functions (false-positive risky)
+@register_encoder("ripemd_160")
+def _ripemd_160(keyword):
+    # Most common and the only one with a working library found yet, missing 128, 250 and 320
+    hasher = RIPEMD160.new()
+    hasher.update(keyword.encode())
+    return hasher.hexdigest()
+
+
+# Checksums (false-positive risky)
+@register_encoder("crc16")
+def _crc16(keyword):
+    return str(Crc16.calc(keyword.encode()))  # Not sure about this one
+
+
+@register_encoder("crc32")
+def _crc32(keyword):
+    # According to the official zlib docs, from 3.0, the result is always unsigned
+    return str(zlib.crc32(keyword.encode()))
+
+
+@register_encoder("adler32")
+def _adler32(keyword):
+    # According to the official zlib docs, from 3.0, the result is always unsigned
+    return str(zlib.adler32(keyword.encode()))
+
+
+# Other encodings
+@register_encoder("rot13")
+def _rot13(keyword):
+    return codecs.encode(keyword, "rot_13")  # Not sure about this one
@@ -4,11 +4,17 @@ import base64
 from pathlib import Path
 import sqlite3
 import json
-from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
 
 
-from data_analysis.leakages.sqlite import LeakagesDetailsQueryBySiteURL
+from data_analysis.json_writer import StreamingJSONWriter, JSONLinesWriter
+from data_analysis.leakages.sqlite import (
+    LeakagesDetailsQueryGroupedBySiteURL,
+    LeakagesIndexCreationCommand,
+)
 from data_analysis.leakages.keyword_encodings import Encodings
+from data_analysis.leakages.leakage_scanner import LeakageScanner
 import data_analysis.leakages.utils as utils
 
 # TODO: Move this to a setting variable for the whole project
@@ -33,51 +39,95 @@ SITES = [
 # Search Terms Object
 SEARCH_TERMS = ["JELLYBEANS"]
 SEARCH_TERMS_ENCODINGS = Encodings(SEARCH_TERMS)
+LEAKAGE_SCANNER = LeakageScanner(SEARCH_TERMS_ENCODINGS)
 
 
-def generate_leakage_details_json(LEAKAGE_DATA_PATH: Path, OUTPUT_PATH: Path):
-    # Connect to the SQLite database
-    conn = sqlite3.connect(LEAKAGE_DATA_PATH)
+def iter_leakage_details(conn: sqlite3.Connection):
+    """Yields (leakage_type, sites) for each leakages table, where sites lazily yields (site_url, leakage_elements)
+    for each site with leakages, and leakage_elements lazily yields the processed rows of that site.
+    Rows are fetched from the cursor as they are consumed, so they are never all in memory.
+    """
+    # One query per table gets the rows of every site, ordered by site_url
+    sites_param = (json.dumps(SITES),)
+    leakage_queries = [
+        # First Cookies Leakages (least frequent)
+        (
+            "cookies_leakages",
+            LeakagesDetailsQueryGroupedBySiteURL.COOKIES,
+            utils.get_processed_cookie_leakage,
+        ),
+        # Then Javascript Leakages (more frequent)
+        (
+            "javascript_leakages",
+            LeakagesDetailsQueryGroupedBySiteURL.JS,
+            utils.get_processed_javascript_leakage,
+        ),
+        # Lastly HTTP Requests Leakages (most frequent)
+        (
+            "http_requests_leakages",
+            LeakagesDetailsQueryGroupedBySiteURL.HTTP_REQUESTS,
+            lambda row: utils.get_processed_http_leakage(row, LEAKAGE_SCANNER),
+        ),
+    ]
 
-    # Organize the leakage data by leakage_type
-    # Really useful defaultdict(lambda: defaultdict(list)),
-    leakage_details = {
-        "cookies_leakages": defaultdict(list),
-        "javascript_leakages": defaultdict(list),
-        "http_requests_leakages": defaultdict(list),
-    }
+    def iter_sites(query, process_row):
+        cursor = conn.execute(query, sites_param)
+        for site_url, site_rows in groupby(cursor, key=itemgetter(0)):
+            # The first column (site_url) is only used to group the rows
+            yield site_url, (process_row(row[1:]) for row in site_rows)
 
-    for site_url in SITES:
-        SITE_QUERIES = LeakagesDetailsQueryBySiteURL(site_url)
+    for leakage_type, query, process_row in leakage_queries:
+        yield leakage_type, iter_sites(query, process_row)
 
-        # First Cookies Leakages (least frequent)
-        cookies_leakages = conn.execute(SITE_QUERIES.COOKIES).fetchall()
-        for row in cookies_leakages:
-            leakage_list_element = utils.get_processed_cookie_leakage(row)
-            leakage_details["cookies_leakages"][site_url].append(leakage_list_element)
 
-        # Then Javascript Leakages (more frequent)
-        javascript_leakages = conn.execute(SITE_QUERIES.JS).fetchall()
-
-        for row in javascript_leakages:
-            leakage_list_element = utils.get_processed_javascript_leakage(row)
-            leakage_details["javascript_leakages"][site_url].append(
-                leakage_list_element
-            )
+def generate_leakage_details_json(
+    LEAKAGE_DATA_PATH: Path,
+    OUTPUT_PATH: Path,
+    json_lines: bool = False,
+    compact: bool = False,
+    compress: bool = False,
+):
+    """Writes the details of the leakages organized by leakage type and site URL to OUTPUT_PATH.
+    Every leakage is written as soon as it is read from the database, so memory does not grow with the crawl.
+    If json_lines is True, each leakage is written as one line ({"leakage_type", "site_url", "leakage"}) in stead
+    of a single JSON document. compact removes the indentation of the JSON document, and compress gzips the output.
+    Sites are written ordered by site_url.
+    """
+    # Connect to the SQLite database
+    conn = sqlite3.connect(LEAKAGE_DATA_PATH)
 
-        # Lastly HTTP Requests Leakages (most frequent)
-        http_requests_leakages = conn.execute(SITE_QUERIES.HTTPRequests).fetchall()
-        for row in http_requests_leakages:
-            leakage_list_element = utils.get_processed_http_leakage(
-                row, SEARCH_TERMS_ENCODINGS
-            )
-            leakage_details["http_requests_leakages"][site_url].append(
-                leakage_list_element
-            )
+    # Indexes to get the rows of each site_url without scanning the whole tables
+    for index_command in LeakagesIndexCreationCommand:
+        conn.execute(index_command)
+    conn.commit()
 
-    # Save the leakage details in JSON format
-    with open(OUTPUT_PATH, "w") as outfile:
-        json.dump(leakage_details, outfile, indent=4, sort_keys=False)
+    # Save the leakage details organized by leakage_type and site_url
+    if json_lines:
+        with JSONLinesWriter(OUTPUT_PATH, compress=compress) as writer:
+            for leakage_type, sites in iter_leakage_details(conn):
+                for site_url, leakage_elements in sites:
+                    for leakage_list_element in leakage_elements:
+                        writer.write(
+                            {
+                                "leakage_type": leakage_type,
+                                "site_url": site_url,
+                                "leakage": leakage_list_element,
+                            }
+                        )
+    else:
+        with StreamingJSONWriter(
+            OUTPUT_PATH, compact=compact, compress=compress
+        ) as writer:
+            writer.begin_object()
+            for leakage_type, sites in iter_leakage_details(conn):
+                writer.begin_object(leakage_type)
+                for site_url, leakage_elements in sites:
+                    writer.begin_array(site_url)
+                    for leakage_list_element in leakage_elements:
+                        writer.write_value(leakage_list_element)
+                    writer.end_array()
+                writer.end_object()
+            writer.end_object()
     print("Document saved in: ", OUTPUT_PATH)
 
     # Close the database connection
@@ -1,20 +1,84 @@
-import base64
-import base58
-import codecs
-import hashlib
-import bz2
-import gzip
-import zlib
-from crccheck.crc import Crc16, Crc32
-from Crypto.Hash import RIPEMD160
+""" Encoded forms of the search terms, built with the encoders of leakages/encoders.py.
+
+Computing every hash, checksum and compression of every keyword is not free, and with thousands of search terms it
+becomes the slowest part of the setup. The encodings are therefore computed lazily (the first time they are used) and
+saved in an on-disk catalogue keyed by (keyword, encoder set), so each keyword is only encoded once per set of encoders.
+"""
+
+import json
+import sqlite3
+from pathlib import Path
+
+from data_analysis.leakages.encoders import ENCODERS, get_encoder_set_key
+from data_analysis.sqlite import EncodingsCatalogueQuery
+
+# Scripts are run from different directories, so the catalogue path is relative to this file
+CATALOGUE_PATH = Path(__file__).parent / "sqlite" / "encodings_catalogue.sqlite"
 
 
 class Encodings:
-    def __init__(self, search_terms):
-        self.encodings = dict()
-        self.search_terms = search_terms
-        for keyword in search_terms:
-            self.encodings[keyword] = self.get_original_and_lowercase_encodings(keyword)
+    """Encodings of every search term, in its original case and lowercase.
+    encodings[keyword][keyword_case][encoding_name] is the encoded term, with keyword_case being "original" or
+    "lowercase" and the encoding names in the order of encoder_names (every registered encoder by default).
+    Set catalogue_path to None to compute the encodings without reading or saving the catalogue.
+    """
+
+    def __init__(
+        self,
+        search_terms,
+        encoder_names: list = None,
+        catalogue_path: Path = CATALOGUE_PATH,
+    ):
+        # Repeated search terms would only be searched twice for nothing
+        self.search_terms = list(dict.fromkeys(search_terms))
+        self.encoder_names = (
+            list(encoder_names) if encoder_names is not None else list(ENCODERS.keys())
+        )
+        self.encoder_set_key = get_encoder_set_key(self.encoder_names)
+        self.catalogue_path = catalogue_path
+        self._encodings = None
+
+    @property
+    def encodings(self) -> dict:
+        if self._encodings is None:
+            self._encodings = self._load_encodings()
+        return self._encodings
+
+    def _load_encodings(self) -> dict:
+        """Returns the encodings of all the search terms, reading the ones already in the catalogue
+        and computing (and saving) only the missing ones
+        """
+        if self.catalogue_path is None:
+            return {
+                keyword: self.get_original_and_lowercase_encodings(keyword)
+                for keyword in self.search_terms
+            }
+
+        conn = sqlite3.connect(self.catalogue_path)
+        conn.execute(EncodingsCatalogueQuery.CREATE_TABLE)
+        cached_encodings = {
+            keyword: encodings_json
+            for keyword, encodings_json in conn.execute(
+                EncodingsCatalogueQuery.GET_ENCODINGS, (self.encoder_set_key,)
+            )
+        }
+
+        encodings = dict()
+        new_rows = []
+        for keyword in self.search_terms:
+            if keyword in cached_encodings:
+                encodings[keyword] = json.loads(cached_encodings[keyword])
+            else:
+                encodings[keyword] = self.get_original_and_lowercase_encodings(keyword)
+                new_rows.append(
+                    (self.encoder_set_key, keyword, json.dumps(encodings[keyword]))
+                )
+
+        if new_rows:
+            conn.executemany(EncodingsCatalogueQuery.INSERT_ENCODINGS, new_rows)
+            conn.commit()
+        conn.close()
+        return encodings
 
     def get_original_and_lowercase_encodings(self, keyword):
         keyword_encodings = dict()
@@ -23,92 +87,14 @@ class Encodings:
         return keyword_encodings
 
     def _get_keyword_encodings(self, keyword):
-        """Returns a list of encodings for a given keyword.
+        """Returns a dict with the encodings of a given keyword (encoding name -> encoded keyword).
         Bear in mind that there are some encodings that are not reversible, so the original keyword cannot be recovered.
         Also, some encodings used here produce outputs that don't resemble the original keyword which may lead to false positives when searching for the keyword.
         """
-
-        def process_hash_function(hash_function, utf_8_encoded_keyword):
-            hasher = hash_function()
-            hasher.update(utf_8_encoded_keyword)
-            return hasher.hexdigest()
-
-        def process_ripemd_hash_function(ripemd_hash, utf_8_encoded_keyword):
-            hasher = ripemd_hash.new()
-            hasher.update(utf_8_encoded_keyword)
-            return hasher.hexdigest()
-
-        def _deflate(utf_8_encoded_keyword):
-            """Separate function because takes more than 1 line."""
-            compressed_data = zlib.compress(utf_8_encoded_keyword)
-            deflated_data = compressed_data[2:-4]  # Remove zlib header and footer
-            encoded_deflated_data = base64.b64encode(deflated_data).decode(
-                errors="ignore"
-            )
-            return encoded_deflated_data
-
-        # Encodings: base16, base32, base32hex, base58, base64, gz, bzip2, deflate, md2, md4, md5, sha1, sha224, sha256, sha384, sha512, crc16, crc32, sha3_224, sh3_256, sh3_384, sh3_512, ripemd_128, ripemd_169, ripemd_256, ripemd_320,  whirlpool,  rot13, snefru128, snefru256,  adler32, blake2s, blake2b.
-        utf_8_encoded_keyword = keyword.encode()
         encodings = dict()
-
-        # Original keyword
-        encodings["original"] = keyword
-
-        # Base encodings
-        encodings["base16"] = codecs.encode(utf_8_encoded_keyword, "hex").decode()
-        encodings["base32"] = base64.b32encode(utf_8_encoded_keyword).decode()
-        encodings["base32hex"] = base64.b16encode(utf_8_encoded_keyword).decode()
-        encodings["base58"] = base58.b58encode(utf_8_encoded_keyword).decode()
-        encodings["base64"] = base64.b64encode(utf_8_encoded_keyword).decode()
-
-        # Compression algorithms (false-positive risky)
-        # Disabled because they are giving trouble
-        # encodings["gzip"] = gzip.compress(utf_8_encoded_keyword).decode(errors="ignore")
-        # encodings["bzip2"] = bz2.compress(utf_8_encoded_keyword).decode(errors="ignore")
-        encodings["deflate"] = _deflate(utf_8_encoded_keyword)
-
-        # Hash functions (false-positive risky)
-        hash_functions = [
-            ("md5", hashlib.md5),
-            ("sha1", hashlib.sha1),
-            ("sha224", hashlib.sha224),
-            ("sha256", hashlib.sha256),
-            ("sha384", hashlib.sha384),
-            ("sha512", hashlib.sha512),
-            ("sha3_224", hashlib.sha3_224),
-            ("sha3_256", hashlib.sha3_256),
-            ("sha3_384", hashlib.sha3_384),
-            ("sha3_512", hashlib.sha3_512),
-            ("blake2s", hashlib.blake2s),
-            ("blake2b", hashlib.blake2b),
-        ]
-
-        for hash_name, hash_function in hash_functions:
-            encodings[hash_name] = process_hash_function(
-                hash_function, utf_8_encoded_keyword
-            )
-
-        # RIPEMD hash functions (false-positive risky)
-        encodings["ripemd_160"] = process_ripemd_hash_function(
-            RIPEMD160, utf_8_encoded_keyword
-        )  # Most common and the only one with a working library found yet, missing 128, 250 and 320
-
-        # Checksums (false-positive risky)
-        encodings["crc16"] = str(
-            Crc16.calc(utf_8_encoded_keyword)
-        )  # Not sure about this one
-
-        encodings["crc32"] = str(
-            zlib.crc32(utf_8_encoded_keyword)
-        )  # According to the official zlib docs, from 3.0, the result is always unsigned
-        # encodings.append(str(Crc32.calc(utf_8_encoded_keyword))) # Another way to calculate CRC32
-
-        encodings["adler32"] = str(
-            zlib.adler32(utf_8_encoded_keyword)
-        )  # According to the official zlib docs, from 3.0, the result is always unsigned
-
-        # Other encodings
-        encodings["rot13"] = codecs.encode(keyword, "rot_13")  # Not sure about this one
+        for encoding_name in self.encoder_names:
+            encoder, _ = ENCODERS[encoding_name]
+            encodings[encoding_name] = encoder(keyword)
         return encodings
 
 
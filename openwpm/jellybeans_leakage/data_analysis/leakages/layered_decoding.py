@@ -0,0 +1,196 @@
+""" Decoding-side search of the search terms hidden under several layers of encoding.
+
+The encodings of keyword_encodings.py are computed forward from the keyword, so they only find the term under one
+direct transform. Trackers often stack them (e.g. URL-encode the base64 of a JSON blob that contains the term),
+and computing every chain forward is not feasible. In stead, the values are decoded here layer by layer:
+percent-decoding, base64/base64url-decoding (followed by inflate when the decoded bytes are compressed) and
+JSON parsing, up to max_depth layers. Every decoded layer is scanned for all the encoded terms at once with the
+LeakageScanner, so a chain like percent > base64 > sha256 is found too.
+
+The same substrings (e.g. the same base64 cookie value) show up in many rows, so the decoding of each one is memoized.
+"""
+
+import base64
+import binascii
+import json
+import re
+import zlib
+from functools import lru_cache
+from urllib.parse import unquote
+
+# Maximum amount of decoded strings kept in the cache
+CACHE_SIZE = 2**14
+
+# Default maximum amount of stacked layers decoded
+MAX_DEPTH = 3
+
+# Decoded layers longer than this are cut, so compressed data can't make us inflate huge payloads
+MAX_DECODED_LENGTH = 2**20
+
+# Shorter runs of base64 characters decode to less than 9 bytes, which is too short to hide a search term
+# (and would make us decode lots of plain words)
+BASE64_RUN = re.compile(r"[A-Za-z0-9+/_-]{12,}={0,2}")
+
+# Only the values with a percent escape or a base64 run have a layer to decode (a JSON document with the terms in it
+# is found without decoding it), so the scanner doesn't decode anything else
+DECODABLE = re.compile(r"%|" + BASE64_RUN.pattern)
+
+# Checksums are too short to be told apart from the random bytes of decoded ids and JSON numbers, so they are not
+# looked for in decoded layers
+SHORT_CHECKSUM_ENCODINGS = {"crc16", "crc32", "adler32"}
+
+
+def _percent_decode(text: str) -> list:
+    if "%" not in text:
+        return []
+    decoded_text = unquote(text)
+    return [("percent", decoded_text)] if decoded_text != text else []
+
+
+def _inflate(data: bytes):
+    """Returns the decompressed data if it is zlib, gzip or raw deflate data, or None otherwise"""
+    # wbits: 47 detects zlib and gzip headers, -15 is raw deflate
+    for wbits in (47, -15):
+        try:
+            decompressor = zlib.decompressobj(wbits)
+            inflated_data = decompressor.decompress(data, MAX_DECODED_LENGTH)
+        except zlib.error:
+            continue
+        if inflated_data and decompressor.eof:
+            return inflated_data
+    return None
+
+
+def _to_text(data: bytes):
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+def _base64_decode(text: str) -> list:
+    layers = []
+    for base64_match in BASE64_RUN.finditer(text):
+        run = base64_match.group().rstrip("=")
+        # base64url uses - and _ in stead of + and /
+        run = run.replace("-", "+").replace("_", "/")
+        # A single character left over can't be valid base64
+        if len(run) % 4 == 1:
+            continue
+        try:
+            data = base64.b64decode(run + "=" * (-len(run) % 4), validate=True)
+        except (binascii.Error, ValueError):
+            continue
+
+        inflated_data = _inflate(data)
+        if inflated_data is not None:
+            inflated_text = _to_text(inflated_data)
+            if inflated_text is not None:
+                layers.append(("base64>inflate", inflated_text))
+                continue
+
+        decoded_text = _to_text(data)
+        if decoded_text is not None:
+            layers.append(("base64", decoded_text))
+    return layers
+
+
+def _json_strings(parsed_json):
+    """Yields every key and string value of a parsed JSON document"""
+    if isinstance(parsed_json, dict):
+        for key, value in parsed_json.items():
+            yield key
+            yield from _json_strings(value)
+    elif isinstance(parsed_json, list):
+        for value in parsed_json:
+            yield from _json_strings(value)
+    elif isinstance(parsed_json, str):
+        yield parsed_json
+
+
+def _json_decode(text: str) -> list:
+    stripped_text = text.strip()
+    if not stripped_text.startswith(("{", "[")):
+        return []
+    try:
+        parsed_json = json.loads(stripped_text)
+    except ValueError:
+        return []
+    # The strings are joined so the next layers (and the scanner) see them unescaped and in one place
+    return [("json", "\n".join(_json_strings(parsed_json)))]
+
+
+DECODERS = [_base64_decode, _json_decode]
+
+
+class LayeredDecoder:
+    """Finds the encodings of a LeakageScanner under up to max_depth decoded layers of a value.
+    The found encodings are named after the chain of decoders applied, outermost first, and the encoding of the term
+    found in the last layer, e.g. "percent>base64>original".
+    """
+
+    def __init__(
+        self, leakage_scanner, max_depth: int = MAX_DEPTH, cache_size=CACHE_SIZE
+    ):
+        self.leakage_scanner = leakage_scanner
+        self.max_depth = max_depth
+        self._decode_layer = lru_cache(maxsize=cache_size)(self._decode_layer_uncached)
+
+    @staticmethod
+    def _decode_layer_uncached(text: str) -> tuple:
+        """Returns every (decoder_name, decoded_text) that can be obtained from text with one decoder"""
+        # Percent-encoded text is only percent-decoded, so the other decoders run on the next layer and the chain
+        # reports the percent layer (the base64 runs between the escapes would be decoded from this one otherwise)
+        percent_layers = _percent_decode(text)
+        if percent_layers:
+            return tuple(
+                (decoder_name, decoded_text[:MAX_DECODED_LENGTH])
+                for decoder_name, decoded_text in percent_layers
+            )
+        layers = []
+        for decoder in DECODERS:
+            for decoder_name, decoded_text in decoder(text):
+                layers.append((decoder_name, decoded_text[:MAX_DECODED_LENGTH]))
+        return tuple(layers)
+
+    def _next_layers(self, current_layers: list, seen_texts: set) -> list:
+        """Returns the layers obtained decoding each of current_layers once more"""
+        next_layers = []
+        for chain, text in current_layers:
+            for decoder_name, decoded_text in self._decode_layer(text):
+                # Decoding the same text again would only repeat what we already found
+                if decoded_text in seen_texts:
+                    continue
+                seen_texts.add(decoded_text)
+                next_layers.append((chain + (decoder_name,), decoded_text))
+        return next_layers
+
+    def find_encodings(self, value) -> list:
+        """Returns the (search_term, chained encoding name) of every encoding found in the decoded layers of value.
+        Layers where some encoding is found are not decoded any further, so only the shortest chains are reported.
+        """
+        if not isinstance(value, str):
+            return []
+        encodings = dict()
+        current_layers = [((), value)]
+        seen_texts = {value}
+        for _ in range(self.max_depth):
+            layers_to_decode = []
+            for chain, decoded_text in self._next_layers(current_layers, seen_texts):
+                found_encodings = [
+                    (search_term, encoding_name)
+                    for search_term, encoding_name in self.leakage_scanner.find_encodings(
+                        decoded_text
+                    )
+                    if encoding_name.removesuffix("_lowercase")
+                    not in SHORT_CHECKSUM_ENCODINGS
+                ]
+                for search_term, encoding_name in found_encodings:
+                    encodings[(search_term, ">".join(chain + (encoding_name,)))] = None
+                if not found_encodings:
+                    layers_to_decode.append((chain, decoded_text))
+            current_layers = layers_to_decode
+        return list(encodings)
+
+    def cache_info(self):
+        return self._decode_layer.cache_info()
@@ -0,0 +1,183 @@
+""" Single-pass scanner that looks for every encoded form of the search terms at once.
+
+In stead of running one str.contains per search term, case, encoding and column, all the encoded
+terms are compiled into one regex. Each cell is scanned once with it, and only the cells
+that contain at least one encoded term are checked again to know exactly which encodings appear in them.
+
+To scan thousands of search terms at once, the regex only has the first PREFIX_LENGTH characters of each term,
+nested as in a trie (terms sharing a prefix share the same branch), so it stays small and fast to compile.
+Where the prefix of some term matches, the terms with each length are looked up in a set, so the cost of
+finding the exact terms does not grow with their amount either.
+"""
+
+import re
+from collections import defaultdict
+
+import pandas as pd
+
+from data_analysis.leakages.keyword_encodings import Encodings
+from data_analysis.leakages.layered_decoding import DECODABLE, LayeredDecoder
+
+# Amount of characters of each term used in the regex
+PREFIX_LENGTH = 6
+
+
+class LeakageScanner:
+    """Compiles all the encodings of an Encodings object into a single matcher"""
+
+    def __init__(self, search_terms_encodings: Encodings, max_decoding_depth: int = 0):
+        """If max_decoding_depth is greater than 0, the values where no encoding is found directly are also decoded
+        up to that many layers to look for the encodings inside them (see layered_decoding.py)
+        """
+        # (encoded_term, search_term, encoding_name) in the same order the old per-encoding loop used,
+        # so the first hit of a row is the same encoding that was reported before
+        self.patterns = []
+        for keyword in search_terms_encodings.search_terms:
+            for keyword_case in search_terms_encodings.encodings[keyword].keys():
+                for encoding_name, encoded_term in search_terms_encodings.encodings[
+                    keyword
+                ][keyword_case].items():
+                    if not encoded_term:
+                        continue
+                    if keyword_case == "lowercase":
+                        encoding_name = encoding_name + "_lowercase"
+                    self.patterns.append((encoded_term, keyword, encoding_name))
+
+        # Several encodings (or search terms) can produce the same term, so we keep the position
+        # in self.patterns of every pattern that has each one
+        self._patterns_by_term = defaultdict(list)
+        for pattern_index, (encoded_term, _, _) in enumerate(self.patterns):
+            self._patterns_by_term[encoded_term].append(pattern_index)
+
+        # Position of the first pattern of each (search_term, encoding_name), used to sort the hits
+        self._encoding_order = dict()
+        for pattern_index, (_, keyword, encoding_name) in enumerate(self.patterns):
+            self._encoding_order.setdefault((keyword, encoding_name), pattern_index)
+
+        # Terms grouped by length, to check which ones start at a given position of a value
+        self._terms_by_length = defaultdict(set)
+        for encoded_term in self._patterns_by_term.keys():
+            self._terms_by_length[len(encoded_term)].add(encoded_term)
+
+        trie_pattern = _build_trie_pattern(
+            encoded_term[:PREFIX_LENGTH] for encoded_term in self._patterns_by_term
+        )
+        # Matches wherever a term may start, used to discard the values without any term
+        self._regex = re.compile(trie_pattern)
+        # Zero-width version, that finds every position where a term may start (even if they overlap)
+        self._start_regex = re.compile(f"(?=(?:{trie_pattern}))")
+
+        self.decoder = (
+            LayeredDecoder(self, max_depth=max_decoding_depth)
+            if max_decoding_depth > 0
+            else None
+        )
+
+    def _find_terms(self, value):
+        """Yields every encoded term found in value (once per occurrence)"""
+        if not isinstance(value, str):
+            return
+        for match in self._start_regex.finditer(value):
+            start = match.start()
+            for length, terms in self._terms_by_length.items():
+                encoded_term = value[start : start + length]
+                if encoded_term in terms:
+                    yield encoded_term
+
+    def contains(self, value) -> bool:
+        """Returns True if any encoded term is in value"""
+        return next(self._find_terms(value), None) is not None
+
+    def find_encodings(self, value) -> list:
+        """Returns the (search_term, encoding_name) of every encoding found in value (in pattern order)"""
+        found_patterns = set()
+        for encoded_term in self._find_terms(value):
+            found_patterns.update(self._patterns_by_term[encoded_term])
+
+        # Different encodings of a search term can produce the same term, but each one is only reported once
+        encodings = dict.fromkeys(
+            self.patterns[pattern_index][1:] for pattern_index in sorted(found_patterns)
+        )
+        return list(encodings)
+
+    def scan(self, df: pd.DataFrame, columns: list) -> pd.DataFrame:
+        """Scans the given columns of df and returns one row per (row, column, encoding) hit.
+        The returned DataFrame has the index of the matched row in df (row_index), the column, the search term and
+        the encoding, sorted by row, pattern order (chained encodings go last) and column order.
+        """
+        hits = []
+        for column_order, column in enumerate(columns):
+            # One regex search per cell to discard (almost) everything that does not leak
+            candidates = df[column].str.contains(self._regex, na=False)
+            if self.decoder is not None:
+                # The values with something to decode can have the terms in a decoded layer too
+                candidates |= df[column].str.contains(DECODABLE, na=False)
+            for row_index, value in df.loc[candidates, column].items():
+                encodings = self.find_encodings(value)
+                if not encodings and self.decoder is not None:
+                    # Chained encodings are only looked for where there is no direct one
+                    encodings = self.decoder.find_encodings(value)
+                for search_term, encoding_name in encodings:
+                    hits.append(
+                        (
+                            row_index,
+                            column,
+                            search_term,
+                            encoding_name,
+                            self._encoding_order.get(
+                                (search_term, encoding_name), len(self.patterns)
+                            ),
+                            column_order,
+                        )
+                    )
+
+        hits_df = pd.DataFrame(
+            hits,
+            columns=[
+                "row_index",
+                "column_name",
+                "search_term",
+                "encoding",
+                "pattern_order",
+                "column_order",
+            ],
+        )
+        hits_df = hits_df.sort_values(
+            ["row_index", "pattern_order", "column_order"], kind="stable"
+        )
+        return hits_df.drop(columns=["pattern_order", "column_order"]).reset_index(
+            drop=True
+        )
+
+
+def _build_trie_pattern(terms) -> str:
+    """Returns a regex that matches any of the given terms, with the alternatives nested as in a trie
+    (e.g. ["abc", "abd", "b"] becomes "(?:ab(?:c|d)|b)")
+    """
+    trie = dict()
+    for term in terms:
+        if not term:
+            continue
+        node = trie
+        for char in term:
+            node = node.setdefault(char, dict())
+        # Empty key marks the end of a term
+        node[""] = dict()
+
+    def node_pattern(node) -> str:
+        is_end_of_term = "" in node
+        alternatives = [
+            re.escape(char) + node_pattern(child)
+            for char, child in node.items()
+            if char != ""
+        ]
+        if not alternatives:
+            return ""
+        if len(alternatives) == 1 and not is_end_of_term:
+            return alternatives[0]
+        pattern = "(?:" + "|".join(alternatives) + ")"
+        # A term ends here, so the rest of the branch is optional
+        return pattern + "?" if is_end_of_term else pattern
+
+    # A regex that never matches when there are no terms
+    return node_pattern(trie) or "(?!)"
@@ -1 +1,5 @@
-from .enums import GeneralAnalysis, LeakagesDetailsQueryBySiteURL
+from .enums import (
+    GeneralAnalysis,
+    LeakagesDetailsQueryGroupedBySiteURL,
+    LeakagesIndexCreationCommand,
+)
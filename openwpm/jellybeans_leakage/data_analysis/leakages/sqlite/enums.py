@@ -1,3 +1,6 @@
+from enum import StrEnum
+
+
 class GeneralAnalysis:
     QUERIES = [
         {
@@ -58,90 +61,129 @@ class GeneralAnalysis:
             ],
         },
         {
-            "explanation": "3. Number of leakages per encoding type in each table:",
+            "explanation": (
+                "3. Number of leakages per search term and encoding type in each"
+                " table:"
+            ),
             "queries": [
                 {
                     "table_name": "http_requests_leakage_data",
                     "query": """
-                SELECT encoding, COUNT(*) as num_leakages
+                SELECT search_term, encoding, COUNT(*) as num_leakages
                 FROM http_requests_leakage_data
-                GROUP BY encoding
+                GROUP BY search_term, encoding
                 ORDER BY num_leakages DESC;
                 """,
                 },
                 {
                     "table_name": "javascript_leakage_data",
                     "query": """
-                SELECT encoding, COUNT(*) as num_leakages
+                SELECT search_term, encoding, COUNT(*) as num_leakages
                 FROM javascript_leakage_data
-                GROUP BY encoding
+                GROUP BY search_term, encoding
                 ORDER BY num_leakages DESC;
                 """,
                 },
                 {
                     "table_name": "javascript_cookies_leakage_data",
                     "query": """
-                SELECT encoding, COUNT(*) as num_leakages
+                SELECT search_term, encoding, COUNT(*) as num_leakages
                 FROM javascript_cookies_leakage_data
-                GROUP BY encoding
+                GROUP BY search_term, encoding
                 ORDER BY num_leakages DESC;
                 """,
                 },
             ],
         },
+        {
+            "explanation": (
+                "4. Number of hits per column, search term and encoding in each table"
+                " (every hit, not only the first one of each entry):"
+            ),
+            "queries": [
+                {
+                    "table_name": "leakage_hits",
+                    "query": """
+                SELECT table_name, column_name, search_term, encoding, COUNT(*) as num_hits, COUNT(DISTINCT original_id) as num_entries
+                FROM leakage_hits
+                GROUP BY table_name, column_name, search_term, encoding
+                ORDER BY table_name, num_hits DESC;
+                """,
+                },
+            ],
+        },
     ]
 
 
-# Queries to get the details of each leakages table
-class LeakagesDetailsQueryBySiteURL:
-    # TODO: 1. Add a column that is only the domain name of the search engine (e.g. google.com) so we can group by that and decouple from the search term
-    #       2. Refactor this class
-    def __init__(self, site_url) -> None:
-        self.site_url = site_url
-        self.HTTPRequests = self._get_http_leakages_query_by_url()
-        self.JS = self._get_javascript_leakages_query_by_url()
-        self.COOKIES = self._get_cookies_leakages_query_by_url()
+class LeakagesDetailsQueryGroupedBySiteURL(StrEnum):
+    """Enum class to store SQL queries to get the details of each leakages table for every site_url in a JSON array
+    (the only parameter), in one query per table.
+    Rows come ordered by site_url (the first column), so they can be split by site in a single pass,
+    using the site_url indexes of LeakagesIndexCreationCommand.
+    """
+
+    HTTP_REQUESTS = """
+    SELECT leakages.site_url,
+        leakages.url,
+        leakages.top_level_url,
+        leakages.referrer,
+        leakages.headers,
+        leakages.post_body,
+        leakages.post_body_raw,
+        leakages.encoding,
+        leakages.is_third_party_channel,
+        leakages.is_third_party_to_top_window,
+        leakages.top_level_url_second_level_domain,
+        leakages.request_url_second_level_domain
+    FROM http_requests_leakage_data leakages
+    WHERE leakages.site_url IN (SELECT value FROM json_each(?))
+    ORDER BY leakages.site_url, leakages.rowid;
+    """
+
+    JS = """
+    SELECT leakages.site_url,
+        leakages.value,
+        leakages.func_name,
+        leakages.script_url,
+        leakages.document_url,
+        leakages.top_level_url,
+        leakages.arguments,
+        leakages.encoding
+    FROM javascript_leakage_data leakages
+    WHERE leakages.site_url IN (SELECT value FROM json_each(?))
+    ORDER BY leakages.site_url, leakages.rowid;
+    """
+
+    COOKIES = """
+    SELECT leakages.site_url,
+        leakages.name,
+        leakages.path,
+        leakages.value,
+        leakages.same_site,
+        leakages.first_party_domain,
+        leakages.host,
+        leakages.is_secure,
+        leakages.encoding
+    FROM javascript_cookies_leakage_data leakages
+    WHERE leakages.site_url IN (SELECT value FROM json_each(?))
+    ORDER BY leakages.site_url, leakages.rowid;
+    """
+
+
+class LeakagesIndexCreationCommand(StrEnum):
+    """Enum class to store SQL commands to create the indexes used by LeakagesDetailsQueryGroupedBySiteURL"""
 
-    def _get_http_leakages_query_by_url(self):
-        return (
-            "SELECT  url, "
-            "        top_level_url, "
-            "        referrer, "
-            "        headers, "
-            "        post_body, "
-            "        post_body_raw, "
-            "        encoding, "
-            "        is_third_party_channel, "
-            "        is_third_party_to_top_window, "
-            "        top_level_url_second_level_domain, "
-            "        request_url_second_level_domain "
-            "FROM http_requests_leakage_data "
-            f"WHERE site_url = '{self.site_url}'; "
-        )
+    HTTP_REQUESTS = """
+    CREATE INDEX IF NOT EXISTS http_requests_leakage_data_site_url_index
+    ON http_requests_leakage_data (site_url);
+    """
 
-    def _get_javascript_leakages_query_by_url(self):
-        return (
-            "SELECT value, "
-            "        func_name, "
-            "        script_url, "
-            "        document_url, "
-            "        top_level_url, "
-            "        arguments, "
-            "        encoding "
-            "FROM javascript_leakage_data "
-            f"WHERE site_url = '{self.site_url}';"
-        )
+    JS = """
+    CREATE INDEX IF NOT EXISTS javascript_leakage_data_site_url_index
+    ON javascript_leakage_data (site_url);
+    """
 
-    def _get_cookies_leakages_query_by_url(self):
-        return (
-            "SELECT name, "
-            "        path, "
-            "        value, "
-            "        same_site, "
-            "        first_party_domain, "
-            "        host, "
-            "        is_secure, "
-            "        encoding "
-            "FROM javascript_cookies_leakage_data "
-            f"WHERE site_url = '{self.site_url}';"
-        )
+    COOKIES = """
+    CREATE INDEX IF NOT EXISTS javascript_cookies_leakage_data_site_url_index
+    ON javascript_cookies_leakage_data (site_url);
+    """
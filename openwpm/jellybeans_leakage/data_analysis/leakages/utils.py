@@ -1,7 +1,7 @@
 """ Some utility functions to have tidier code """
 
 
-from data_analysis.leakages.keyword_encodings import Encodings
+from data_analysis.leakages.leakage_scanner import LeakageScanner
 
 
 def get_processed_cookie_leakage(row):
@@ -61,7 +61,7 @@ def get_processed_javascript_leakage(row):
     return javascript_list_element
 
 
-def get_processed_http_leakage(row, search_terms_object: Encodings):
+def get_processed_http_leakage(row, leakage_scanner: LeakageScanner):
     # First unpack the row from the table
     (
         url,
@@ -97,18 +97,14 @@ def get_processed_http_leakage(row, search_terms_object: Encodings):
     }
 
     # Complete the explicit leakage info only where it appears
-    for keyword in search_terms_object.search_terms:
-        for case in search_terms_object.encodings[keyword].keys():
-            for term in search_terms_object.encodings[keyword][case].values():
-                if term in (referrer or ""):
-                    http_list_element["explicit_leakage"]["referrer"] = referrer
-                if term in (headers or ""):
-                    http_list_element["explicit_leakage"]["headers"] = headers
-                if term in (post_body or ""):
-                    http_list_element["explicit_leakage"]["post_body"] = post_body
-                if term in (post_body_raw or ""):
-                    http_list_element["explicit_leakage"][
-                        "post_body_raw"
-                    ] = post_body_raw
+    # (one scan per column for all the encoded search terms)
+    for column_name, value in [
+        ("referrer", referrer),
+        ("headers", headers),
+        ("post_body", post_body),
+        ("post_body_raw", post_body_raw),
+    ]:
+        if leakage_scanner.contains(value):
+            http_list_element["explicit_leakage"][column_name] = value
 
     return http_list_element
@@ -1,10 +1,15 @@
 from .enums import (
     CrawledDataQuery,
+    CrawledDataQueryByIdRange,
+    CrawledDataMaxIdQuery,
     LeakageTableCreationCommand,
     LeakageDropTableCommand,
     LeakageDataQueries,
     ColumnsToSearch,
     LeakageTableNames,
-    DetailsQueryBySiteURL,
+    LeakageProgressQuery,
+    EncodingsCatalogueQuery,
+    DetailsQueryGroupedBySiteURL,
+    DetailsIndexCreationCommand,
     ThirdPartyTableCreationCommand,
 )
@@ -61,6 +61,85 @@ class CrawledDataQuery(StrEnum):
     """
 
 
+class CrawledDataQueryByIdRange(StrEnum):
+    """Enum class to store SQL queries to retrieve the crawled data whose id is in (:min_id, :max_id].
+    Used to search only the data added to the crawl database since the last leakage analysis.
+    """
+
+    HTTP_REQUESTS = """
+    SELECT sv.visit_id,
+        sv.site_url,
+        hr.request_id,
+        hr.url,
+        hr.top_level_url,
+        hr.method,
+        hr.referrer,
+        hr.headers,
+        hr.post_body,
+        hr.post_body_raw,
+        hr.triggering_origin,
+        hr.loading_origin,
+        hr.loading_href,
+        hr.is_third_party_channel,
+        hr.is_third_party_to_top_window,
+        hr.is_XHR,
+        hr.id as original_id 
+    FROM site_visits sv
+    INNER JOIN http_requests hr ON sv.visit_id = hr.visit_id
+    WHERE hr.id > :min_id AND hr.id <= :max_id;
+    """
+
+    JS = """
+    SELECT sv.visit_id,
+        sv.site_url,
+        js.value,
+        js.func_name,
+        js.script_url,
+        js.document_url,
+        js.top_level_url,
+        js.arguments,
+        js.id as original_id 
+    FROM site_visits sv
+    INNER JOIN javascript js ON sv.visit_id = js.visit_id
+    WHERE js.id > :min_id AND js.id <= :max_id;
+    """
+
+    COOKIES = """
+    SELECT sv.visit_id,
+        sv.site_url,
+        jsc.record_type,
+        jsc.change_cause,
+        jsc.expiry,
+        jsc.host,
+        jsc.is_secure,
+        jsc.name,
+        jsc.path,
+        jsc.value,
+        jsc.same_site,
+        jsc.first_party_domain,
+        jsc.id as original_id 
+    FROM site_visits sv
+    INNER JOIN javascript_cookies jsc ON sv.visit_id = jsc.visit_id
+    WHERE jsc.id > :min_id AND jsc.id <= :max_id;
+    """
+
+
+class CrawledDataMaxIdQuery(StrEnum):
+    """Enum class to store SQL queries to get the last id of each crawled table"""
+
+    HTTP_REQUESTS = """
+    SELECT COALESCE(MAX(id), 0) FROM http_requests;
+    """
+
+    JS = """
+    SELECT COALESCE(MAX(id), 0) FROM javascript;
+    """
+
+    COOKIES = """
+    SELECT COALESCE(MAX(id), 0) FROM javascript_cookies;
+    """
+
+
 class LeakageTableNames(StrEnum):
     """Enum class to store the names of the tables with leakage data.
     Make sure to have the same names here and in the LeakageTableCreationCommand
@@ -69,6 +148,8 @@ class LeakageTableNames(StrEnum):
     HTTP_REQUESTS = "http_requests_leakage_data"
     JS = "javascript_leakage_data"
     COOKIES = "javascript_cookies_leakage_data"
+    HITS = "leakage_hits"
+    PROGRESS = "leakage_analysis_progress"
 
 
 class LeakageDropTableCommand(StrEnum):
@@ -84,6 +165,14 @@ class LeakageDropTableCommand(StrEnum):
     DROP TABLE IF EXISTS javascript_cookies_leakage_data;
     """
 
+    HITS = """
+    DROP TABLE IF EXISTS leakage_hits;
+    """
+
+    PROGRESS = """
+    DROP TABLE IF EXISTS leakage_analysis_progress;
+    """
+
 
 class LeakageTableCreationCommand(StrEnum):
     """Enum class to store SQL commands to create leakage tables"""
@@ -107,6 +196,7 @@ class LeakageTableCreationCommand(StrEnum):
         is_third_party_channel INTEGER,
         is_third_party_to_top_window INTEGER,
         is_XHR INTEGER,
+        search_term TEXT,
         encoding TEXT,
         top_level_url_second_level_domain TEXT,
         request_url_second_level_domain TEXT
@@ -124,6 +214,7 @@ class LeakageTableCreationCommand(StrEnum):
         document_url TEXT,
         top_level_url TEXT,
         arguments TEXT,
+        search_term TEXT,
         encoding TEXT,
         top_level_url_second_level_domain TEXT,
         script_url_second_level_domain TEXT,
@@ -146,12 +237,73 @@ class LeakageTableCreationCommand(StrEnum):
         value TEXT,
         same_site TEXT,
         first_party_domain TEXT,
+        search_term TEXT,
         encoding TEXT,
         site_url_second_level_domain TEXT,
         host_second_level_domain TEXT
     );
     """
 
+    HITS = """
+    CREATE TABLE IF NOT EXISTS leakage_hits (
+        table_name TEXT,
+        original_id INTEGER,
+        visit_id INTEGER,
+        site_url TEXT,
+        column_name TEXT,
+        search_term TEXT,
+        encoding TEXT
+    );
+    """
+
+    PROGRESS = """
+    CREATE TABLE IF NOT EXISTS leakage_analysis_progress (
+        table_name TEXT PRIMARY KEY,
+        last_original_id INTEGER NOT NULL,
+        analysed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+
+
+class LeakageProgressQuery(StrEnum):
+    """Enum class to store SQL queries to read and update the last crawled id analysed for each leakage table"""
+
+    GET_LAST_ORIGINAL_ID = """
+    SELECT last_original_id FROM leakage_analysis_progress WHERE table_name = ?;
+    """
+
+    SET_LAST_ORIGINAL_ID = """
+    INSERT INTO leakage_analysis_progress (table_name, last_original_id)
+    VALUES (?, ?)
+    ON CONFLICT(table_name) DO UPDATE SET
+        last_original_id = excluded.last_original_id,
+        analysed_at = CURRENT_TIMESTAMP;
+    """
+
+
+class EncodingsCatalogueQuery(StrEnum):
+    """Enum class to store SQL queries of the on-disk catalogue of search term encodings.
+    There is one row for each (encoder_set, keyword) with all its encodings saved as JSON.
+    """
+
+    CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS encodings_catalogue (
+        encoder_set TEXT NOT NULL,
+        keyword TEXT NOT NULL,
+        encodings TEXT NOT NULL,
+        PRIMARY KEY (encoder_set, keyword)
+    );
+    """
+
+    GET_ENCODINGS = """
+    SELECT keyword, encodings FROM encodings_catalogue WHERE encoder_set = ?;
+    """
+
+    INSERT_ENCODINGS = """
+    INSERT OR REPLACE INTO encodings_catalogue (encoder_set, keyword, encodings)
+    VALUES (?, ?, ?);
+    """
+
 
 class ThirdPartyTableCreationCommand(StrEnum):
     """Enum class to store SQL commands to create leakage tables"""
@@ -315,52 +467,73 @@ class ColumnsToSearch(Enum):
         return self.value[index]
 
 
-# Queries to get the data for the overall web resources captured by OpenWPM by site_url
-class DetailsQueryBySiteURL:
-    # TODO: 1. Add a column that is only the domain name of the search engine (e.g. google.com) so we can group by that and decouple from the search term
-    #       2. Refactor this class
-    def __init__(self, site_url) -> None:
-        self.site_url = site_url
-        self.HTTPRequests = self._get_http_data_query_by_url()
-        self.JS = self._get_javascript_data_query_by_url()
-        self.COOKIES = self._get_cookies_data_query_by_url()
-
-    def _get_http_data_query_by_url(self):
-        return (
-            "SELECT  hr.url, "
-            "        hr.top_level_url, "
-            "        hr.referrer, "
-            "        hr.headers, "
-            "        hr.post_body, "
-            "        hr.post_body_raw "
-            "FROM http_requests hr "
-            "INNER JOIN site_visits sv ON hr.visit_id = sv.visit_id "
-            f"WHERE sv.site_url = '{self.site_url}'; "
-        )
-
-    def _get_javascript_data_query_by_url(self):
-        return (
-            "SELECT  js.value, "
-            "        js.func_name, "
-            "        js.script_url, "
-            "        js.document_url, "
-            "        js.top_level_url, "
-            "        js.arguments "
-            "FROM javascript js "
-            "INNER JOIN site_visits sv ON js.visit_id = sv.visit_id "
-            f"WHERE sv.site_url = '{self.site_url}';"
-        )
-
-    def _get_cookies_data_query_by_url(self):
-        return (
-            "SELECT  jsc.name, "
-            "        jsc.path, "
-            "        jsc.value, "
-            "        jsc.same_site, "
-            "        jsc.first_party_domain, "
-            "        jsc.host, "
-            "        jsc.is_secure "
-            "FROM javascript_cookies jsc "
-            "INNER JOIN site_visits sv ON jsc.visit_id = sv.visit_id "
-            f"WHERE sv.site_url = '{self.site_url}';"
-        )
+class DetailsQueryGroupedBySiteURL(StrEnum):
+    """Enum class to store SQL queries to get the data for the overall web resources captured by OpenWPM
+    for every site_url in a JSON array (the only parameter), in one query per table.
+    Rows come ordered by site_url (the first column), so they can be split by site in a single pass.
+    The site_visits and visit_id indexes of DetailsIndexCreationCommand make it an index lookup per site
+    in stead of a full scan.
+    """
+
+    HTTP_REQUESTS = """
+    SELECT sv.site_url,
+        hr.url,
+        hr.top_level_url,
+        hr.referrer,
+        hr.headers,
+        hr.post_body,
+        hr.post_body_raw
+    FROM site_visits sv
+    INNER JOIN http_requests hr ON hr.visit_id = sv.visit_id
+    WHERE sv.site_url IN (SELECT value FROM json_each(?))
+    ORDER BY sv.site_url, hr.id;
+    """
+
+    JS = """
+    SELECT sv.site_url,
+        js.value,
+        js.func_name,
+        js.script_url,
+        js.document_url,
+        js.top_level_url,
+        js.arguments
+    FROM site_visits sv
+    INNER JOIN javascript js ON js.visit_id = sv.visit_id
+    WHERE sv.site_url IN (SELECT value FROM json_each(?))
+    ORDER BY sv.site_url, js.id;
+    """
+
+    COOKIES = """
+    SELECT sv.site_url,
+        jsc.name,
+        jsc.path,
+        jsc.value,
+        jsc.same_site,
+        jsc.first_party_domain,
+        jsc.host,
+        jsc.is_secure
+    FROM site_visits sv
+    INNER JOIN javascript_cookies jsc ON jsc.visit_id = sv.visit_id
+    WHERE sv.site_url IN (SELECT value FROM json_each(?))
+    ORDER BY sv.site_url, jsc.id;
+    """
+
+
+class DetailsIndexCreationCommand(StrEnum):
+    """Enum class to store SQL commands to create the indexes used by DetailsQueryGroupedBySiteURL"""
+
+    SITE_VISITS = """
+    CREATE INDEX IF NOT EXISTS site_visits_site_url_index ON site_visits (site_url, visit_id);
+    """
+
+    HTTP_REQUESTS = """
+    CREATE INDEX IF NOT EXISTS http_requests_visit_id_index ON http_requests (visit_id);
+    """
+
+    JS = """
+    CREATE INDEX IF NOT EXISTS javascript_visit_id_index ON javascript (visit_id);
+    """
+
+    COOKIES = """
+    CREATE INDEX IF NOT EXISTS javascript_cookies_visit_id_index ON javascript_cookies (visit_id);
+    """
@@ -3,7 +3,6 @@
 import sqlite3
 import pandas as pd
 from pathlib import Path
-import tldextract
 
 # Add the project's root directory to the system path
 import os
@@ -14,6 +13,7 @@ project_root = os.path.abspath(os.path.join(current_dir, "../../"))
 sys.path.append(project_root)
 
 from data_analysis.sqlite import CrawledDataQuery, ThirdPartyTableCreationCommand
+from data_analysis.domain_resolver import DOMAIN_RESOLVER
 
 
 def search_third_party(
@@ -29,11 +29,11 @@ def search_third_party(
 
     if table_name == "http_requests":
         # http_requests the leakage criteria is strict Second Level Domain matching
-        df.loc[:, "top_level_url_second_level_domain"] = df["top_level_url"].apply(
-            lambda url: tldextract.extract(url).domain
+        df.loc[:, "top_level_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["top_level_url"]
         )
-        df.loc[:, "request_url_second_level_domain"] = df["url"].apply(
-            lambda url: tldextract.extract(url).domain
+        df.loc[:, "request_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["url"]
         )
 
         # Get a series of boolean values that indicate whether the request is to a third party
@@ -48,14 +48,14 @@ def search_third_party(
     elif table_name == "javascripts":
         # javascripts leakage criteria is Second Level Domain between top_level_url and
         # script_url or top_level_url and document_url
-        df.loc[:, "top_level_url_second_level_domain"] = df["top_level_url"].apply(
-            lambda url: tldextract.extract(url).domain
+        df.loc[:, "top_level_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["top_level_url"]
         )
-        df.loc[:, "script_url_second_level_domain"] = df["script_url"].apply(
-            lambda url: tldextract.extract(url).domain
+        df.loc[:, "script_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["script_url"]
         )
-        df.loc[:, "document_url_second_level_domain"] = df["document_url"].apply(
-            lambda url: tldextract.extract(url).domain
+        df.loc[:, "document_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["document_url"]
         )
 
         # Get a series of boolean values that indicate whether the request is to a third party for both cases
@@ -71,12 +71,10 @@ def search_third_party(
 
     elif table_name == "cookies":
         # cookies leakage criteria is Second Level Domain between site_url and host
-        df["site_url_second_level_domain"] = df["site_url"].apply(
-            lambda url: tldextract.extract(url).domain
-        )
-        df["host_second_level_domain"] = df["host"].apply(
-            lambda url: tldextract.extract(url).domain
+        df["site_url_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(
+            df["site_url"]
         )
+        df["host_second_level_domain"] = DOMAIN_RESOLVER.resolve_column(df["host"])
 
         # Get a series of boolean values that indicate whether the request is to a third party
         requests_to_third_parties = (
@@ -1,6 +1,11 @@
 from pathlib import Path
 import sqlite3
-from sqlite.enums import ABQueriesBySiteURL, ABQueriesGeneral
+from itertools import groupby
+from sqlite.enums import (
+    ABQueriesGroupedBySiteURL,
+    ABIndexCreationCommand,
+    ABQueriesGeneral,
+)
 import json
 import pandas as pd
 from pathlib import Path
@@ -25,38 +30,41 @@ SITES = [
 ]
 
 
-def query_to_dict(query_cursor):
+def query_to_dicts_by_site_url(query_cursor):
+    """Yields (site_url, list of row dicts) for each site of a query ordered by site_url"""
     columns = [column[0] for column in query_cursor.description]
-    rows = query_cursor.fetchall()
-    return [dict(zip(columns, row)) for row in rows]
+    site_url_index = columns.index("site_url")
+    for site_url, rows in groupby(query_cursor, key=lambda row: row[site_url_index]):
+        yield site_url, [dict(zip(columns, row)) for row in rows]
 
 
 def generate_json(conn, OUTPUT_PATH: Path):
-    # Connect to the SQLite database
-
-    result_json = {}
-
-    for search_engine_name, site_url in SITES:
-        SITE_QUERIES = ABQueriesBySiteURL(site_url)
-
-        # First HTTP Requests
-        cursor = conn.execute(SITE_QUERIES.HTTPRequests)
-        http_requests = query_to_dict(cursor)
-        if http_requests:
-            # Create the dict for this search engine
-            result_json[search_engine_name] = {}
-            # Only add keys if there is data
-            result_json[search_engine_name]["http_requests"] = http_requests
-
-        # Then Javascripts
-        cursor = conn.execute(SITE_QUERIES.JS)
-        javascripts = query_to_dict(cursor)
-        if javascripts:
-            # If it has not been created yet
-            if search_engine_name not in result_json:
-                result_json[search_engine_name] = {}
-            # Only add keys if there is data
-            result_json[search_engine_name]["javascripts"] = javascripts
+    # Indexes to get the rows of each site_url without scanning the whole tables
+    for index_command in ABIndexCreationCommand:
+        conn.execute(index_command)
+    conn.commit()
+
+    site_names = {
+        site_url: search_engine_name for search_engine_name, site_url in SITES
+    }
+    sites_param = (json.dumps([site_url for _, site_url in SITES]),)
+
+    # One query per table gets the matches of every site, ordered by site_url
+    data_by_site = {search_engine_name: {} for search_engine_name, _ in SITES}
+    for data_type, query in [
+        ("http_requests", ABQueriesGroupedBySiteURL.HTTP_REQUESTS),
+        ("javascripts", ABQueriesGroupedBySiteURL.JS),
+    ]:
+        cursor = conn.execute(query, sites_param)
+        for site_url, rows in query_to_dicts_by_site_url(cursor):
+            data_by_site[site_names[site_url]][data_type] = rows
+
+    # Only the search engines with data are added, in the same order as SITES
+    result_json = {
+        search_engine_name: site_data
+        for search_engine_name, site_data in data_by_site.items()
+        if site_data
+    }
 
     # Save the leakage details in JSON format
     with open(OUTPUT_PATH, "w") as outfile:
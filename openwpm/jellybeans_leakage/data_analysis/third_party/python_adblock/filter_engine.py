@@ -0,0 +1,278 @@
+""" Token-indexed matching of AdBlock Plus filter lists, in the style of uBlock Origin and adblock-rust.
+
+adblockparser.AdblockRules joins every rule without options into one huge regex alternation, and checks the rules
+with options one by one, so every URL is compared against the whole list. Here every rule is indexed by one token
+(a run of letters, digits and %) that any URL it matches must contain as a whole token, e.g. ||doubleclick.net^ is
+indexed by "doubleclick" and /banner/ads/* by "banner" or "ads" (the least common of the list). A lookup tokenizes
+the URL and only checks the rules indexed by its tokens, plus the few rules that have no usable token
+(regex rules, rules like -ad- or $script,domain=...).
+
+The candidate rules are still checked with the adblockparser rules themselves, so TokenIndexedRules gives the same
+results as AdblockRules and can be used in its place.
+"""
+
+import re
+import time
+from collections import Counter, defaultdict
+
+from adblockparser import AdblockRule
+
+# Characters that make up the tokens of URLs and rules
+TOKEN_RE = re.compile(r"[a-z0-9%]+")
+
+
+def _is_token_boundary(character: str) -> bool:
+    """Whether a character of a rule next to a token guarantees the token ends there in the matched URL.
+    ^ (separator) never matches a token character, and neither does any literal ASCII character which is not one.
+    * (wildcard) can match anything, and non-ASCII characters could match an ASCII letter ignoring case.
+    """
+    return character.isascii() and character != "*"
+
+
+def get_rule_tokens(rule: AdblockRule) -> list:
+    """Returns the tokens that every URL matched by rule contains as whole (lowercase) tokens"""
+    pattern = rule.rule_text.lower()
+    # Regex rules can match anything, and adblockparser drops the character after a | in the middle of a rule
+    if not pattern or (pattern.startswith("/") and pattern.endswith("/")):
+        return []
+
+    # The | and || anchors mean the start of the address (or domain), so the token starts there
+    start_anchored = pattern.startswith("|")
+    pattern = pattern.lstrip("|")
+    # A trailing | means the end of the address, so the token ends there
+    end_anchored = pattern.endswith("|")
+    pattern = pattern.rstrip("|")
+    if "|" in pattern:
+        return []
+
+    tokens = []
+    for token_match in TOKEN_RE.finditer(pattern):
+        start, end = token_match.span()
+        if start == 0:
+            starts_token = start_anchored
+        else:
+            starts_token = _is_token_boundary(pattern[start - 1])
+        if end == len(pattern):
+            ends_token = end_anchored
+        else:
+            ends_token = _is_token_boundary(pattern[end])
+        if starts_token and ends_token:
+            tokens.append(token_match.group())
+    return tokens
+
+
+def get_url_tokens(url: str) -> set:
+    return set(TOKEN_RE.findall(url.lower()))
+
+
+def _group_by_required_option(rules: list) -> dict:
+    """Groups the rules by one of the binary options (e.g. script, third-party) they require to be True.
+    Such a rule can only match when that option is True, so the other groups can be skipped (see get_candidates).
+    The rules that don't require any option to be True are grouped under None.
+    """
+    rule_groups = defaultdict(list)
+    for rule in rules:
+        required_options = [
+            option
+            for option, value in rule.options.items()
+            if value is True and option != "match-case"
+        ]
+        # Request types split the rules in smaller groups than third-party
+        required_options.sort(key=lambda option: option == "third-party")
+        rule_groups[required_options[0] if required_options else None].append(rule)
+    return dict(rule_groups)
+
+
+class _RuleIndex:
+    """Rules indexed by their least common token.
+    Only the text of the rules is kept in the index, so it can be pickled and loaded quickly (see ruleset_cache.py),
+    and the rules indexed by a token are parsed (and grouped by required option) the first time a URL has that token.
+    """
+
+    def __init__(self, rules: list):
+        rule_tokens = [get_rule_tokens(rule) for rule in rules]
+        token_counts = Counter(token for tokens in rule_tokens for token in set(tokens))
+
+        token_index = defaultdict(list)
+        self.untokenized_rule_texts = []
+        for rule, tokens in zip(rules, rule_tokens):
+            if not tokens:
+                self.untokenized_rule_texts.append(rule.raw_rule_text)
+                continue
+            # The least common token keeps the lists of candidates short, longer tokens are usually more specific
+            rule_token = min(
+                tokens, key=lambda token: (token_counts[token], -len(token))
+            )
+            token_index[rule_token].append(rule.raw_rule_text)
+        self.token_index = dict(token_index)
+        self._init_parsed_rules()
+
+    def _init_parsed_rules(self):
+        self.untokenized_rules = _group_by_required_option(
+            [AdblockRule(rule_text) for rule_text in self.untokenized_rule_texts]
+        )
+        self._parsed_rules = dict()
+
+    def __getstate__(self):
+        return {
+            "untokenized_rule_texts": self.untokenized_rule_texts,
+            "token_index": self.token_index,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_parsed_rules()
+
+    def _get_rule_groups(self, url_tokens: set):
+        yield self.untokenized_rules
+        # Sorted, so the same rule decides the verdict of a URL on every run (see RuleStats)
+        for token in sorted(url_tokens):
+            rule_groups = self._parsed_rules.get(token)
+            if rule_groups is None:
+                rule_texts = self.token_index.get(token)
+                if rule_texts is None:
+                    continue
+                rule_groups = _group_by_required_option(
+                    [AdblockRule(rule_text) for rule_text in rule_texts]
+                )
+                self._parsed_rules[token] = rule_groups
+            yield rule_groups
+
+    def get_candidates(self, url_tokens: set, options: dict):
+        """Yields the only rules that can match a URL with the given tokens and options"""
+        true_options = [option for option, value in options.items() if value is True]
+        for rule_groups in self._get_rule_groups(url_tokens):
+            yield from rule_groups.get(None, ())
+            for option in true_options:
+                yield from rule_groups.get(option, ())
+
+
+class RuleStats:
+    """Statistics of each rule of a TokenIndexedRules: how many times it was evaluated and for how long, how many
+    requests it matched (hits) and the distinct third party hosts of those requests.
+    The evaluation of the rules stops at the first match, so only the rule that decides a verdict gets the hit.
+    """
+
+    def __init__(self):
+        self.evaluations = Counter()
+        self.evaluation_time = defaultdict(float)
+        self.hits = Counter()
+        self.third_party_hosts = defaultdict(set)
+        # Of the request being matched, see set_request
+        self._weight = 1
+        self._third_party_host = None
+
+    def set_request(self, weight: int = 1, third_party_host=None):
+        """Sets the amount of rows (weight) and the host (only if it is third party) of the next request matched"""
+        self._weight = weight
+        self._third_party_host = third_party_host
+
+    def record_evaluation(self, rule_text: str, elapsed_time: float, matched: bool):
+        self.evaluations[rule_text] += 1
+        self.evaluation_time[rule_text] += elapsed_time
+        if matched:
+            self.hits[rule_text] += self._weight
+            if self._third_party_host:
+                self.third_party_hosts[rule_text].add(self._third_party_host)
+
+    def merge(self, other: "RuleStats"):
+        """Adds the statistics of other (e.g. of another worker process) to these"""
+        self.evaluations.update(other.evaluations)
+        for rule_text, elapsed_time in other.evaluation_time.items():
+            self.evaluation_time[rule_text] += elapsed_time
+        self.hits.update(other.hits)
+        for rule_text, hosts in other.third_party_hosts.items():
+            self.third_party_hosts[rule_text].update(hosts)
+
+
+class TokenIndexedRules:
+    """Drop-in replacement for adblockparser.AdblockRules that indexes the rules by token.
+    should_block gives the same results as AdblockRules.should_block, and match_any tells whether any rule
+    (blocking or exception) matches the URL, as checking every rule of .rules with rule.match_url does.
+    """
+
+    def __init__(self, rules, supported_options=None):
+        if supported_options is None:
+            supported_options = AdblockRule.BINARY_OPTIONS + ["domain"]
+        params = {option: True for option in supported_options}
+
+        # The same rules AdblockRules keeps
+        rules = [
+            rule
+            for rule in (
+                rule if isinstance(rule, AdblockRule) else AdblockRule(rule)
+                for rule in rules
+            )
+            if (rule.regex or rule.options) and rule.matching_supported(params)
+        ]
+        self.rule_texts = [rule.raw_rule_text for rule in rules]
+        self.blacklist = _RuleIndex([rule for rule in rules if not rule.is_exception])
+        self.whitelist = _RuleIndex([rule for rule in rules if rule.is_exception])
+
+        # AdblockRules matches the rules without options ignoring case, compiled on first use
+        self._ignore_case_regexes = dict()
+        # Set to a RuleStats to collect statistics of the rules while matching
+        self.rule_stats = None
+
+    def __getstate__(self):
+        # The compiled regexes are not worth pickling, they would be compiled again when unpickling
+        state = self.__dict__.copy()
+        state["_ignore_case_regexes"] = dict()
+        state["rule_stats"] = None
+        return state
+
+    @property
+    def rules(self) -> list:
+        """All the rules, as AdblockRules.rules (parsed again on every call)"""
+        return [AdblockRule(rule_text) for rule_text in self.rule_texts]
+
+    def _get_ignore_case_regex(self, rule: AdblockRule):
+        regex = self._ignore_case_regexes.get(rule)
+        if regex is None:
+            regex = re.compile(rule.regex, re.IGNORECASE)
+            self._ignore_case_regexes[rule] = regex
+        return regex
+
+    def _rule_matches(self, rule: AdblockRule, url: str, options: dict) -> bool:
+        """Whether the rule matches as it does in AdblockRules"""
+        if not rule.options:
+            return bool(self._get_ignore_case_regex(rule).search(url))
+        return rule.matching_supported(options) and rule.match_url(url, options)
+
+    @staticmethod
+    def _rule_matches_url(rule: AdblockRule, url: str, options: dict) -> bool:
+        return rule.match_url(url, options)
+
+    def _evaluate(self, match_rule, rule: AdblockRule, url: str, options: dict) -> bool:
+        if self.rule_stats is None:
+            return match_rule(rule, url, options)
+        start_time = time.perf_counter()
+        matched = match_rule(rule, url, options)
+        self.rule_stats.record_evaluation(
+            rule.raw_rule_text, time.perf_counter() - start_time, matched
+        )
+        return matched
+
+    def _matches(
+        self, rule_index: _RuleIndex, url: str, url_tokens: set, options: dict
+    ) -> bool:
+        for rule in rule_index.get_candidates(url_tokens, options):
+            if self._evaluate(self._rule_matches, rule, url, options):
+                return True
+        return False
+
+    def should_block(self, url: str, options=None) -> bool:
+        options = options or {}
+        url_tokens = get_url_tokens(url)
+        if self._matches(self.whitelist, url, url_tokens, options):
+            return False
+        return self._matches(self.blacklist, url, url_tokens, options)
+
+    def match_any(self, url: str, options: dict) -> bool:
+        """Whether any rule matches the URL with the given options, using rule.match_url as is"""
+        url_tokens = get_url_tokens(url)
+        for rule_index in (self.blacklist, self.whitelist):
+            for rule in rule_index.get_candidates(url_tokens, options):
+                if self._evaluate(self._rule_matches_url, rule, url, options):
+                    return True
+        return False
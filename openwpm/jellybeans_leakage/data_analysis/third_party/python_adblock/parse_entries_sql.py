@@ -1,24 +1,38 @@
-from adblockparser import AdblockRules
 import json
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 import sqlite3
 from pathlib import Path
+from ruleset_cache import load_rules
+from rust_backend import RustMatchingFunctions
 from utils import MatchingFunctions
 
-from sqlite.enums import CrawledDataQueryForABP, CreateABPTablesCommands
+from sqlite.enums import (
+    ABPRuleStatsCommands,
+    CrawledDataQueryForABP,
+    CrawledDataQueryForABPByIdRange,
+    CrawledDataMaxIdQueryForABP,
+    CreateABPTablesCommands,
+)
 
-# Start timer
-start_time = time.time()
-print("Starting rule parsing...")
+# Files of the rulesets (in the working directory)
+RULESET_FILES = {
+    "easylist": "easylist.txt",
+    "easyprivacy": "easyprivacy.txt",
+    "exception": "exceptionrules.txt",
+}
+
+# When matching in parallel, each table is split in this many id ranges (shards) per worker
+SHARDS_PER_WORKER = 4
 
 # ------------------ Functions ------------------
 
 
 def parse_list_file(filename):
-    with open(filename, "r") as f:
-        raw_rules = f.readlines()
-    rules = AdblockRules(raw_rules)
+    # Same results as adblockparser.AdblockRules, but only the rules sharing a token with the URL are checked.
+    # The rules are only parsed the first time (or after the list changes), then loaded from the cache
+    rules = load_rules([filename])
     print(f"Parsed {filename}")
     return rules
 
@@ -29,15 +43,27 @@ def json_to_dictionary(filename):
     return data
 
 
-def match_http_requests_and_filter(data: pd.DataFrame, http_matching_function):
+def match_http_requests_and_filter(
+    data: pd.DataFrame, matching_functions: MatchingFunctions
+):
     """Function to get the matching info of all the http_requests with different rulesets"""
     print("Applying rulesets to http_requests...")
     http_requests_df = data.copy()
 
     # We apply the ruleset to the data
-    http_requests_df[["easylist", "easyprivacy", "exceptionlist"]] = http_requests_df[
-        ["url", "id", "top_level_url"]
-    ].apply(http_matching_function, axis=1, result_type="expand")
+    # Each distinct (url, top_level_url, resource_type, is_third_party_channel) is matched only once
+    http_requests_df[
+        ["easylist", "easyprivacy", "exceptionlist"]
+    ] = matching_functions.classify_http_requests(
+        http_requests_df["url"],
+        http_requests_df["top_level_url"],
+        http_requests_df["resource_type"],
+        http_requests_df["is_third_party_channel"],
+    )
+    # The request type and party are only needed for matching the exception rules
+    http_requests_df = http_requests_df.drop(
+        columns=["resource_type", "is_third_party_channel"]
+    )
 
     http_requests_df = http_requests_df[
         (http_requests_df["easylist"] == 1)
@@ -49,15 +75,20 @@ def match_http_requests_and_filter(data: pd.DataFrame, http_matching_function):
     return http_requests_df
 
 
-def match_javascripts_and_filter(data: pd.DataFrame, javascript_matching_function):
+def match_javascripts_and_filter(
+    data: pd.DataFrame, matching_functions: MatchingFunctions
+):
     """Function to get the matching info of all the javascripts with different rulesets"""
     print("Applying rulesets to javascripts...")
     javascripts_df = data.copy()
 
     # We apply the ruleset to the data
-    javascripts_df[["easylist", "easyprivacy", "exceptionlist"]] = javascripts_df[
-        ["script_url", "id", "top_level_url"]
-    ].apply(javascript_matching_function, axis=1, result_type="expand")
+    # Each distinct (script_url, top_level_url) is matched only once
+    javascripts_df[
+        ["easylist", "easyprivacy", "exceptionlist"]
+    ] = matching_functions.classify_javascripts(
+        javascripts_df["script_url"], javascripts_df["top_level_url"]
+    )
 
     javascripts_df = javascripts_df[
         (javascripts_df["easylist"] == 1)
@@ -69,20 +100,168 @@ def match_javascripts_and_filter(data: pd.DataFrame, javascript_matching_functio
     return javascripts_df
 
 
-def run_matching_and_save(CRAWL_DATA_PATH, OUTPUT_PATH):
-    """Global function to connect to the database and make the corresponding calls to get the matching results"""
+def save_rule_stats(abp_conn, rule_stats: dict):
+    """Saves the RuleStats of each ruleset (ruleset name -> RuleStats) in the rule_stats table.
+    Only the rules that were evaluated at least once are saved
+    """
+    abp_conn.execute(ABPRuleStatsCommands.CREATE_TABLE)
+    rows = []
+    for ruleset_name, ruleset_stats in rule_stats.items():
+        for rule_text, evaluations in ruleset_stats.evaluations.items():
+            third_party_hosts = sorted(
+                ruleset_stats.third_party_hosts.get(rule_text, ())
+            )
+            rows.append(
+                (
+                    ruleset_name,
+                    rule_text,
+                    ruleset_stats.hits[rule_text],
+                    len(third_party_hosts),
+                    json.dumps(third_party_hosts),
+                    evaluations,
+                    ruleset_stats.evaluation_time[rule_text],
+                )
+            )
+    abp_conn.executemany(ABPRuleStatsCommands.INSERT, rows)
+    abp_conn.commit()
+    print(f"Saved the statistics of {len(rows)} rules")
+
+
+def split_id_range(min_id: int, max_id: int, shards: int) -> list:
+    """Splits the id range (min_id, max_id] in at most `shards` contiguous (min_id, max_id] ranges"""
+    if max_id <= min_id:
+        return []
+    step = max(1, -(-(max_id - min_id) // shards))
+    return [
+        (shard_min_id, min(shard_min_id + step, max_id))
+        for shard_min_id in range(min_id, max_id, step)
+    ]
+
+
+# Connection to the crawl database and matching functions of each worker process (see _init_worker)
+_worker_conn = None
+_worker_matching_functions = None
+
+
+def _init_worker(CRAWL_DATA_PATH, ruleset_dict, collect_rule_stats):
+    """Runs once when each worker process starts. The rulesets are loaded once by the main process and given here:
+    forked workers share them with the main process without copying anything, and otherwise they are pickled
+    (only the text of the rules, see ruleset_cache.py) once per worker in stead of once per shard.
+    """
+    global _worker_conn, _worker_matching_functions
+    _worker_conn = sqlite3.connect(CRAWL_DATA_PATH)
+    _worker_matching_functions = MatchingFunctions(
+        ruleset_dict, collect_rule_stats=collect_rule_stats
+    )
+
+
+def _match_shard(query, match_and_filter, min_id, max_id) -> tuple:
+    """Matches the rows of one table with id in (min_id, max_id] in a worker process.
+    Returns the matched rows and the rule statistics of the shard (None if not collected), to be saved by the
+    main process
+    """
+    data = pd.read_sql_query(
+        query, _worker_conn, params={"min_id": min_id, "max_id": max_id}
+    )
+    matched_data = match_and_filter(data, _worker_matching_functions)
+    rule_stats = None
+    if _worker_matching_functions.collect_rule_stats:
+        rule_stats = _worker_matching_functions.pop_rule_stats()
+    return matched_data, rule_stats
+
+
+def run_sharded_matching_and_save(
+    CRAWL_DATA_PATH, OUTPUT_PATH, ruleset_dict, workers, rule_stats=False
+):
+    """Matches the crawled data in a pool of worker processes. Every table is split in SHARDS_PER_WORKER * workers
+    id ranges, and the matched rows of each shard are saved in the ABP tables as soon as it finishes.
+    The workers only read the crawl database; the main process is the only writer of the ABP database.
+    """
+    # Query by id range, last id query, matching function and output table of each table
+    tables = [
+        (
+            CrawledDataQueryForABPByIdRange.HTTP_REQUESTS,
+            CrawledDataMaxIdQueryForABP.HTTP_REQUESTS,
+            match_http_requests_and_filter,
+            "http_requests_abp",
+        ),
+        (
+            CrawledDataQueryForABPByIdRange.JS,
+            CrawledDataMaxIdQueryForABP.JS,
+            match_javascripts_and_filter,
+            "javascripts_abp",
+        ),
+    ]
+
+    crawl_conn = sqlite3.connect(CRAWL_DATA_PATH)
+    max_ids = [crawl_conn.execute(table[1]).fetchone()[0] for table in tables]
+    crawl_conn.close()
+
+    abp_conn = sqlite3.connect(OUTPUT_PATH)
+    abp_conn.execute(CreateABPTablesCommands.HTTP_REQUESTS)
+    abp_conn.execute(CreateABPTablesCommands.JS)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(CRAWL_DATA_PATH, ruleset_dict, rule_stats),
+    ) as executor:
+        # Future of every shard -> output table
+        futures = {}
+        # Ruleset name -> RuleStats of all the shards
+        all_rule_stats = dict()
+        for (query, _, match_and_filter, output_table), max_id in zip(tables, max_ids):
+            shards = split_id_range(0, max_id, SHARDS_PER_WORKER * workers)
+            for min_id, shard_max_id in shards:
+                future = executor.submit(
+                    _match_shard, query, match_and_filter, min_id, shard_max_id
+                )
+                futures[future] = output_table
+            print(f"Matching {output_table} in {len(shards)} shards...")
+
+        for shards_done, future in enumerate(as_completed(futures), start=1):
+            output_table = futures[future]
+            matched_data, shard_rule_stats = future.result()
+            # We save the results of the shard
+            if not matched_data.empty:
+                matched_data.to_sql(
+                    output_table, abp_conn, if_exists="append", index=False
+                )
+                abp_conn.commit()
+            print(f"Saved shard {shards_done}/{len(futures)} ({output_table})")
+
+            for ruleset_name, ruleset_stats in (shard_rule_stats or {}).items():
+                if ruleset_name in all_rule_stats:
+                    all_rule_stats[ruleset_name].merge(ruleset_stats)
+                else:
+                    all_rule_stats[ruleset_name] = ruleset_stats
+
+    if rule_stats:
+        save_rule_stats(abp_conn, all_rule_stats)
+    abp_conn.close()
+
+
+def run_matching_and_save(CRAWL_DATA_PATH, OUTPUT_PATH, workers=1, rule_stats=False):
+    """Global function to connect to the database and make the corresponding calls to get the matching results.
+    With more than one worker, the tables are matched in shards in parallel (see run_sharded_matching_and_save).
+    If rule_stats is True, the statistics of every rule evaluated (hits, third party hosts matched and evaluation
+    time) are saved in the rule_stats table too.
+    """
 
     # We parse the rulesets
     ruleset_dict = {
-        "easylist": parse_list_file("easylist.txt"),
-        "easyprivacy": parse_list_file("easyprivacy.txt"),
-        "exception": parse_list_file("exceptionrules.txt"),
+        name: parse_list_file(filename) for name, filename in RULESET_FILES.items()
     }
 
+    if workers > 1:
+        run_sharded_matching_and_save(
+            CRAWL_DATA_PATH, OUTPUT_PATH, ruleset_dict, workers, rule_stats
+        )
+        return
+
     # We connect to the databases
     crawl_conn = sqlite3.connect(CRAWL_DATA_PATH)
     abp_conn = sqlite3.connect(OUTPUT_PATH)
-
     # We create the tables for the output
     abp_conn.execute(CreateABPTablesCommands.HTTP_REQUESTS)
     abp_conn.execute(CreateABPTablesCommands.JS)
@@ -93,17 +272,15 @@ def run_matching_and_save(CRAWL_DATA_PATH, OUTPUT_PATH):
     )
     javascript_data = pd.read_sql_query(CrawledDataQueryForABP.JS, crawl_conn)
 
-    # We get the matching functions (we need to pass the length of the data to measure the progress)
-    matching_functions = MatchingFunctions(
-        ruleset_dict, len(http_requests_data), len(javascript_data)
-    )
+    # We get the matching functions
+    matching_functions = MatchingFunctions(ruleset_dict, collect_rule_stats=rule_stats)
 
     # We get the matching results
     matched_http_requests = match_http_requests_and_filter(
-        http_requests_data, matching_functions.get_http_request_matches
+        http_requests_data, matching_functions
     )
     matched_javascripts = match_javascripts_and_filter(
-        javascript_data, matching_functions.get_javascript_matches
+        javascript_data, matching_functions
     )
 
     # We save the results
@@ -113,18 +290,100 @@ def run_matching_and_save(CRAWL_DATA_PATH, OUTPUT_PATH):
     matched_javascripts.to_sql(
         "javascripts_abp", abp_conn, if_exists="append", index=False
     )
+    if rule_stats:
+        save_rule_stats(abp_conn, matching_functions.pop_rule_stats())
 
     # We close the connections
     crawl_conn.close()
     abp_conn.close()
 
 
+def run_engine_comparison_and_save(CRAWL_DATA_PATH, OUTPUT_PATHS):
+    """Matches the crawled data with several engines in one pass, in stead of running each pipeline separately.
+    OUTPUT_PATHS has the ABP database of each engine: "python" (TokenIndexedRules) and/or "rust" (adblock-rust,
+    which gives the results js_adblock/get_matches_rust.js used to give). The crawled data is read only once,
+    and the time each engine takes to match it is printed.
+    The ABP tables of the output databases are replaced, so running the comparison again doesn't add the same ids twice.
+    """
+    engines = {
+        "python": lambda: MatchingFunctions(
+            {
+                name: parse_list_file(filename)
+                for name, filename in RULESET_FILES.items()
+            }
+        ),
+        "rust": lambda: RustMatchingFunctions(RULESET_FILES),
+    }
+
+    # We get the data from the database
+    crawl_conn = sqlite3.connect(CRAWL_DATA_PATH)
+    http_requests_data = pd.read_sql_query(
+        CrawledDataQueryForABP.HTTP_REQUESTS, crawl_conn
+    )
+    javascript_data = pd.read_sql_query(CrawledDataQueryForABP.JS, crawl_conn)
+    crawl_conn.close()
+
+    for engine, output_path in OUTPUT_PATHS.items():
+        engine_start_time = time.perf_counter()
+        matching_functions = engines[engine]()
+        loading_time = time.perf_counter() - engine_start_time
+
+        matched_http_requests = match_http_requests_and_filter(
+            http_requests_data, matching_functions
+        )
+        matched_javascripts = match_javascripts_and_filter(
+            javascript_data, matching_functions
+        )
+        matching_time = time.perf_counter() - engine_start_time - loading_time
+        print(
+            f"{engine} engine: rules loaded in {loading_time:.2f}s, "
+            f"{len(http_requests_data) + len(javascript_data)} rows matched in {matching_time:.2f}s"
+        )
+
+        # We save the results
+        abp_conn = sqlite3.connect(output_path)
+        abp_conn.execute(CreateABPTablesCommands.HTTP_REQUESTS)
+        abp_conn.execute(CreateABPTablesCommands.JS)
+        abp_conn.execute("DELETE FROM http_requests_abp")
+        abp_conn.execute("DELETE FROM javascripts_abp")
+        matched_http_requests.to_sql(
+            "http_requests_abp", abp_conn, if_exists="append", index=False
+        )
+        matched_javascripts.to_sql(
+            "javascripts_abp", abp_conn, if_exists="append", index=False
+        )
+        abp_conn.commit()
+        abp_conn.close()
+
+
 # ------------------ Run ------------------
 
 CRAWL_DATA_PATH = Path("../../sqlite/[vpn_czech]10_crawls_results.sqlite")
 OUTPUT_PATH = Path("sqlite/[vpn_czech]10_crawls_adblock.sqlite")
-
-run_matching_and_save(CRAWL_DATA_PATH, OUTPUT_PATH)
-
-# Print the amount of seconds it took to run the script
-print("Finished in %s seconds" % (time.time() - start_time))
+# Amount of worker processes matching the crawled data in parallel (1 matches everything in this process).
+# Set it to e.g. os.cpu_count() to match in parallel
+WORKERS = 1
+# Save the hits, third party hosts and evaluation time of every rule in the rule_stats table (slower)
+RULE_STATS = False
+# Also match with adblock-rust (needs the adblock package). Its results are saved to their own database, so the ones
+# of the js_adblock pipeline (js_adblock/sqlite) are left as they are
+COMPARE_WITH_RUST = False
+RUST_OUTPUT_PATH = Path("sqlite/[vpn_czech]10_crawls_adblock_rust.sqlite")
+
+# The worker processes import this file (with the spawn start method), so nothing runs on import
+if __name__ == "__main__":
+    # Start timer
+    start_time = time.time()
+    print("Starting rule parsing...")
+
+    if COMPARE_WITH_RUST:
+        run_engine_comparison_and_save(
+            CRAWL_DATA_PATH, {"python": OUTPUT_PATH, "rust": RUST_OUTPUT_PATH}
+        )
+    else:
+        run_matching_and_save(
+            CRAWL_DATA_PATH, OUTPUT_PATH, workers=WORKERS, rule_stats=RULE_STATS
+        )
+
+    # Print the amount of seconds it took to run the script
+    print("Finished in %s seconds" % (time.time() - start_time))
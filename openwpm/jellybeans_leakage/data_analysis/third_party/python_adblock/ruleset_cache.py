@@ -0,0 +1,77 @@
+""" Cache of the parsed and indexed filter lists, so the scripts don't parse the lists from text on every run.
+
+Parsing EasyList and EasyPrivacy into rules takes seconds, which dominates short runs (e.g. re-checking a single
+crawl). The TokenIndexedRules built from a set of lists is pickled next to the first list, in a file named after
+the lists and a hash of their content, e.g. easylist.3f2a9c1d0b7e4a61.rules.pickle. Editing or updating any of the
+lists changes the hash, so the rules are rebuilt (and the outdated cache removed) on the next run.
+"""
+
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+from filter_engine import TokenIndexedRules
+
+# Has to be increased whenever TokenIndexedRules changes, so the old caches are not loaded
+CACHE_FORMAT_VERSION = 2
+CACHE_SUFFIX = ".rules.pickle"
+
+
+def get_lists_hash(list_paths: list) -> str:
+    """Returns a hash of the content of the lists (and the cache format)"""
+    hasher = hashlib.sha256(f"{CACHE_FORMAT_VERSION}\n".encode())
+    for list_path in list_paths:
+        hasher.update(Path(list_path).read_bytes())
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def _get_cache_prefix(list_paths: list) -> Path:
+    first_list_path = Path(list_paths[0])
+    lists_name = "+".join(Path(list_path).stem for list_path in list_paths)
+    return first_list_path.with_name(lists_name)
+
+
+def _read_rules(list_paths: list) -> list:
+    raw_rules = []
+    for list_path in list_paths:
+        with open(list_path, "r") as f:
+            raw_rules.extend(f.read().splitlines())
+    return raw_rules
+
+
+def _save_rules(rules: TokenIndexedRules, cache_path: Path):
+    # Written to a temporary file first, so another run never loads half a cache
+    temporary_path = cache_path.with_name(cache_path.name + ".tmp")
+    with open(temporary_path, "wb") as f:
+        pickle.dump(rules, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, cache_path)
+
+
+def load_rules(list_paths: list) -> TokenIndexedRules:
+    """Returns the TokenIndexedRules of all the rules in the given list files,
+    loaded from the cache if the lists have not changed since it was saved
+    """
+    cache_prefix = _get_cache_prefix(list_paths)
+    cache_path = cache_prefix.with_name(
+        f"{cache_prefix.name}.{get_lists_hash(list_paths)[:16]}{CACHE_SUFFIX}"
+    )
+
+    if cache_path.exists():
+        try:
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            print(f"Could not load {cache_path}, the rules will be parsed again")
+
+    rules = TokenIndexedRules(_read_rules(list_paths))
+    _save_rules(rules, cache_path)
+
+    # The caches of previous versions of the lists won't be loaded anymore
+    for outdated_cache_path in cache_prefix.parent.glob(
+        f"{cache_prefix.name}.*{CACHE_SUFFIX}"
+    ):
+        if outdated_cache_path != cache_path:
+            outdated_cache_path.unlink()
+    return rules
@@ -0,0 +1,76 @@
+""" adblock-rust (Brave's engine) as a MatchingFunctions backend, through the adblock Python bindings (pip install adblock).
+
+It gives the same verdicts js_adblock/get_matches_rust.js gets from adblock-rs in Node: for each list, a request is
+blocked if the engine of the list alone matches it, and it is an exception if the engine of the list plus the
+exception rules finds an exception for it. Like the Node script, every http_request is checked as an xmlhttprequest
+(and every javascript as a script), whatever resource_type the crawl recorded for it. As it has the same interface as MatchingFunctions, both engines can
+classify the same crawled data in one pass (see run_engine_comparison_and_save in parse_entries_sql.py).
+"""
+
+from utils import MEMO_SIZE, MatchingFunctions
+
+try:
+    import adblock
+except ImportError:
+    # Optional, only needed for this backend
+    adblock = None
+
+# adblock-rust request type of every http_request, as get_matches_rust.js sends it
+HTTP_REQUEST_TYPE = "xmlhttprequest"
+
+
+def _build_engine(list_paths: list):
+    filter_set = adblock.FilterSet(debug=False)
+    for list_path in list_paths:
+        with open(list_path, "r") as f:
+            filter_set.add_filter_list(f.read())
+    return adblock.Engine(filter_set=filter_set, optimize=True)
+
+
+class RustMatchingFunctions(MatchingFunctions):
+    """MatchingFunctions on top of adblock-rust engines, built from the ruleset files
+    ({"easylist": ..., "easyprivacy": ..., "exception": ...}, as RULESET_FILES in parse_entries_sql.py)
+    """
+
+    def __init__(self, ruleset_files: dict, memo_size: int = MEMO_SIZE):
+        if adblock is None:
+            raise ImportError(
+                "The adblock-rust backend needs the adblock package (pip install adblock)"
+            )
+        # List name -> (engine of the list alone, engine of the list and the exception rules)
+        engines = {
+            name: (
+                _build_engine([ruleset_files[name]]),
+                _build_engine([ruleset_files[name], ruleset_files["exception"]]),
+            )
+            for name in ("easylist", "easyprivacy")
+        }
+        super().__init__(engines, memo_size)
+
+    def _check(self, url, top_level_url, request_type):
+        matches = []
+        exception = 0
+        for name in ("easylist", "easyprivacy"):
+            blocklist_engine, exceptionlist_engine = self.RULESETS[name]
+            if not blocklist_engine.check_network_urls(
+                url, top_level_url, request_type
+            ).matched:
+                matches.append(0)
+                continue
+            matches.append(1)
+            # Only check for exceptions if the request matches with the list
+            if exceptionlist_engine.check_network_urls(
+                url, top_level_url, request_type
+            ).exception:
+                exception = 1
+        return matches[0], matches[1], exception
+
+    def _classify_http_request_uncached(
+        self, url, top_level_url, resource_type=None, is_third_party_channel=None
+    ):
+        # The recorded resource_type is not used, so the verdicts are the ones of the Node pipeline.
+        # adblock-rust tells third parties apart from the URLs itself
+        return self._check(url, top_level_url, HTTP_REQUEST_TYPE)
+
+    def _classify_javascript_uncached(self, script_url, top_level_url):
+        return self._check(script_url, top_level_url, "script")
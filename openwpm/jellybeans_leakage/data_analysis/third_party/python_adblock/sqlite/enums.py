@@ -9,7 +9,9 @@ class CrawledDataQueryForABP(StrEnum):
         sv.visit_id, 
         sv.site_url, 
         hr.url, 
-        hr.top_level_url
+        hr.top_level_url,
+        hr.resource_type,
+        hr.is_third_party_channel
     FROM site_visits sv 
     INNER JOIN http_requests hr ON sv.visit_id = hr.visit_id;
     """
@@ -26,6 +28,47 @@ class CrawledDataQueryForABP(StrEnum):
     """
 
 
+class CrawledDataQueryForABPByIdRange(StrEnum):
+    """Same queries as CrawledDataQueryForABP, only for the rows with id in (:min_id, :max_id]"""
+
+    HTTP_REQUESTS = """
+    SELECT hr.id,
+        sv.visit_id,
+        sv.site_url,
+        hr.url,
+        hr.top_level_url,
+        hr.resource_type,
+        hr.is_third_party_channel
+    FROM site_visits sv
+    INNER JOIN http_requests hr ON sv.visit_id = hr.visit_id
+    WHERE hr.id > :min_id AND hr.id <= :max_id;
+    """
+
+    JS = """
+    SELECT js.id,
+        sv.visit_id,
+        sv.site_url,
+        js.script_url,
+        js.document_url,
+        js.top_level_url
+    FROM site_visits sv
+    INNER JOIN javascript js ON sv.visit_id = js.visit_id
+    WHERE js.id > :min_id AND js.id <= :max_id;
+    """
+
+
+class CrawledDataMaxIdQueryForABP(StrEnum):
+    """Enum class to store SQL queries to retrieve the last id of the crawled tables matched for ABP"""
+
+    HTTP_REQUESTS = """
+    SELECT COALESCE(MAX(id), 0) FROM http_requests;
+    """
+
+    JS = """
+    SELECT COALESCE(MAX(id), 0) FROM javascript;
+    """
+
+
 class CreateABPTablesCommands(StrEnum):
     """Enum class to store SQL queries to create tables for ABP"""
 
@@ -57,6 +100,29 @@ class CreateABPTablesCommands(StrEnum):
     """
 
 
+class ABPRuleStatsCommands(StrEnum):
+    """Enum class to store SQL queries to save the statistics of the rules evaluated while matching"""
+
+    CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS rule_stats (
+        ruleset TEXT,
+        rule TEXT,
+        hits INTEGER,
+        third_party_hosts INTEGER,
+        third_party_host_list TEXT,
+        evaluations INTEGER,
+        evaluation_time REAL,
+        PRIMARY KEY (ruleset, rule)
+    );
+    """
+
+    INSERT = """
+    INSERT OR REPLACE INTO rule_stats (
+        ruleset, rule, hits, third_party_hosts, third_party_host_list, evaluations, evaluation_time
+    ) VALUES (?, ?, ?, ?, ?, ?, ?);
+    """
+
+
 class ABPQueries:
     """Enum class to store SQL queries to retrieve ABP data"""
 
@@ -1,110 +1,299 @@
-import tldextract
+# Add the project's root directory to the system path
+import os
+import sys
+import time
+from functools import lru_cache
+
+import numpy as np
+from adblockparser import AdblockRule
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, "../../../"))
+sys.path.append(project_root)
+
+from data_analysis.domain_resolver import DOMAIN_RESOLVER
+from filter_engine import RuleStats, TokenIndexedRules
+
+
+# Maximum amount of classified URLs kept in the memo of each table
+MEMO_SIZE = 2**18
+
+# ABP request type option of each http_requests.resource_type recorded by OpenWPM (webRequest.ResourceType).
+# The resource types without an ABP option (font, csp_report, ...) are "other"
+RESOURCE_TYPE_OPTIONS = {
+    "script": "script",
+    "image": "image",
+    "imageset": "image",
+    "stylesheet": "stylesheet",
+    "object": "object",
+    "object_subrequest": "object-subrequest",
+    "xmlhttprequest": "xmlhttprequest",
+    "sub_frame": "subdocument",
+    "main_frame": "document",
+    "media": "media",
+    "ping": "ping",
+    "beacon": "ping",
+    "websocket": "websocket",
+}
+
+
+def _is_missing(value) -> bool:
+    """Whether a value of a nullable column is NULL (read as None or NaN)"""
+    return value is None or value != value
+
+
+def get_request_type_option(resource_type):
+    """Returns the ABP request type option of an OpenWPM resource_type, or None if it was not recorded"""
+    if not isinstance(resource_type, str):
+        return None
+    return RESOURCE_TYPE_OPTIONS.get(resource_type, "other")
+
+
+def _nan_to_none(column):
+    """Returns the column with None in stead of NaN, which is how pandas reads the NULLs of a numeric column
+    (e.g. is_third_party_channel). Every NaN is a different key of a dict, so the rows with one would never be merged
+    """
+    if hasattr(column, "notna"):
+        return column.astype(object).where(column.notna(), None)
+    return column
+
+
+def is_third_party(url, top_level_url, is_third_party_channel=None) -> bool:
+    """Whether the request is third party, as recorded by OpenWPM (is_third_party_channel) or, if it was not
+    recorded, comparing the registered domains (eTLD+1) of the URL and the top level URL
+    """
+    if not _is_missing(is_third_party_channel):
+        return bool(is_third_party_channel)
+    return DOMAIN_RESOLVER.get_registered_domain(
+        url
+    ) != DOMAIN_RESOLVER.get_registered_domain(top_level_url)
+
+
+def get_exception_options(top_level_url, request_type, is_third_party) -> dict:
+    """Returns the options to match the exception rules with. Every binary option is False but the request_type
+    (if known) and third-party (if is_third_party), and the domain is the registered domain of the visited site.
+    """
+    options = dict.fromkeys(AdblockRule.BINARY_OPTIONS, False)
+    if request_type is not None:
+        options[request_type] = True
+    options["third-party"] = bool(is_third_party)
+    options["domain"] = DOMAIN_RESOLVER.get_registered_domain(top_level_url)
+    return options
+
+
+class ProgressCounter:
+    """Prints how many of the total items have been processed, and how fast, at most once every interval seconds"""
+
+    def __init__(self, label: str, total: int, interval: float = 10):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self._start_time = self._last_print_time = time.perf_counter()
+
+    def update(self, amount: int = 1):
+        self.count += amount
+        now = time.perf_counter()
+        if now - self._last_print_time >= self.interval:
+            self._last_print_time = now
+            self._print(now)
+
+    def close(self):
+        self._print(time.perf_counter())
+
+    def _print(self, now: float):
+        elapsed_time = now - self._start_time
+        percentage = self.count * 100 / self.total if self.total else 100
+        throughput = self.count / elapsed_time if elapsed_time else 0
+        print(
+            f"{self.label}: {self.count}/{self.total} ({percentage:.2f}%) "
+            f"in {elapsed_time:.1f}s, {throughput:.1f}/s"
+        )
 
 
 class MatchingFunctions:
-    """Class to store functions to match with the rulesets"""
+    """Class to store functions to match with the rulesets.
+    The rulesets can be adblockparser.AdblockRules or TokenIndexedRules (much faster, with the same results)
+    """
 
-    def __init__(self, ruleset_dict, len_http_requests, len_javascripts):
+    def __init__(
+        self, ruleset_dict, memo_size: int = MEMO_SIZE, collect_rule_stats=False
+    ):
         self.RULESETS = ruleset_dict
-        self.len_http_requests = len_http_requests
-        self.len_javascripts = len_javascripts
-
-    def _show_progress_requests(self, i):
-        if i % 100 == 0:
-            print(f"{round(i * 100 / self.len_http_requests, 2)}%")
-
-    def _show_progress_javascripts(self, i):
-        if i % 100 == 0:
-            print(f"{round(i * 100 / self.len_javascripts, 2)}%")
-
-    def _match_http_request_exceptionlist(self, request):
-        # Bear in mind we might be over counting here
-        # since we are not using the information of the request to comply with the exception rule's options
-        # (e.g. we are not checking if the request is for a script, image, etc.)
-        # This could be done by looking at Content-Type, but this might be too much.
-        options = {
-            "domain": tldextract.extract(request["top_level_url"]).registered_domain,
-            "script": False,
-            "image": False,
-            "stylesheet": False,
-            "object": False,
-            "xmlhttprequest": False,
-            "object-subrequest": False,
-            "subdocument": False,
-            "document": False,
-            "elemhide": False,
-            "other": False,
-            "background": False,
-            "xbl": False,
-            "ping": False,
-            "dtd": False,
-            "media": False,
-            "third-party": False,
-            "match-case": False,
-            "collapse": False,
-            "donottrack": False,
-            "websocket": False,
-        }
-        for rule in self.RULESETS["exception"].rules:
-            if rule.match_url(request["url"], options):
-                return True
-        return False
-
-    def _match_javascript_exceptionlist(self, javascript):
-        options = {
-            "domain": tldextract.extract(javascript["top_level_url"]).domain,
-            "script": True,
-            "image": False,
-            "stylesheet": False,
-            "object": False,
-            "xmlhttprequest": False,
-            "object-subrequest": False,
-            "subdocument": False,
-            "document": False,
-            "elemhide": False,
-            "other": False,
-            "background": False,
-            "xbl": False,
-            "ping": False,
-            "dtd": False,
-            "media": False,
-            "third-party": False,
-            "match-case": False,
-            "collapse": False,
-            "donottrack": False,
-            "websocket": False,
+        # Collecting the statistics of the rules (see RuleStats) needs every match to be evaluated,
+        # so in that case only the distinct rows of each batch are classified once (weighted by their amount of rows)
+        self.collect_rule_stats = collect_rule_stats
+        if collect_rule_stats:
+            self.pop_rule_stats()
+            memo_size = 0
+        self._row_weight = 1
+        # The same tracker URLs show up on every visit, so their classification is memoized
+        self._classify_http_request = lru_cache(maxsize=memo_size)(
+            self._classify_http_request_uncached
+        )
+        self._classify_javascript = lru_cache(maxsize=memo_size)(
+            self._classify_javascript_uncached
+        )
+
+    def _get_rule_stats_rulesets(self) -> dict:
+        # Only the TokenIndexedRules collect statistics
+        return {
+            name: ruleset
+            for name, ruleset in self.RULESETS.items()
+            if isinstance(ruleset, TokenIndexedRules)
         }
-        for rule in self.RULESETS["exception"].rules:
-            if rule.match_url(javascript["script_url"], options):
-                return True
-        return False
 
-    def get_http_request_matches(self, request):
-        """
-        Check if the request matches with any of the rules in the three rulesets.
-        Returns a tuple with three booleans
-        """
-        url = request["url"]
+    def pop_rule_stats(self) -> dict:
+        """Returns the RuleStats collected by each ruleset so far, and starts collecting new ones"""
+        rule_stats = dict()
+        for name, ruleset in self._get_rule_stats_rulesets().items():
+            rule_stats[name] = ruleset.rule_stats
+            ruleset.rule_stats = RuleStats()
+        return rule_stats
+
+    def _set_request_for_rule_stats(
+        self, url, top_level_url, is_third_party_channel=None
+    ):
+        if not self.collect_rule_stats:
+            return
+        third_party_host = None
+        if is_third_party(url, top_level_url, is_third_party_channel):
+            third_party_host = DOMAIN_RESOLVER.get_host(url)
+        for ruleset in self._get_rule_stats_rulesets().values():
+            ruleset.rule_stats.set_request(self._row_weight, third_party_host)
+
+    def _match_exceptionlist(self, url, options):
+        exception_rules = self.RULESETS["exception"]
+        if isinstance(exception_rules, TokenIndexedRules):
+            # Only the rules indexed by the tokens of the URL are checked
+            return exception_rules.match_any(url, options)
+        return any(rule.match_url(url, options) for rule in exception_rules.rules)
+
+    def _match_http_request_exceptionlist(
+        self, url, top_level_url, resource_type, is_third_party_channel
+    ):
+        # The exception rules constrained to other request types (or to third/first party requests) don't apply.
+        # Requests of crawls that didn't record resource_type are matched without any request type, as before
+        options = get_exception_options(
+            top_level_url,
+            get_request_type_option(resource_type),
+            is_third_party(url, top_level_url, is_third_party_channel),
+        )
+        return self._match_exceptionlist(url, options)
+
+    def _match_javascript_exceptionlist(self, script_url, top_level_url):
+        # The javascript table has no third party column, so we compare the registered domains (eTLD+1)
+        options = get_exception_options(
+            top_level_url, "script", is_third_party(script_url, top_level_url)
+        )
+        return self._match_exceptionlist(script_url, options)
+
+    def _classify_http_request_uncached(
+        self, url, top_level_url, resource_type=None, is_third_party_channel=None
+    ):
+        self._set_request_for_rule_stats(url, top_level_url, is_third_party_channel)
         easylist = 1 if self.RULESETS["easylist"].should_block(url) else 0
         easyprivacy = 1 if self.RULESETS["easyprivacy"].should_block(url) else 0
         exception = 0
         if easylist or easyprivacy:
             # Only check for exceptions if the request matches with any of the rules in the rulesets
-            exception = 1 if self._match_http_request_exceptionlist(request) else 0
-        self._show_progress_requests(request["id"])
+            exception = (
+                1
+                if self._match_http_request_exceptionlist(
+                    url, top_level_url, resource_type, is_third_party_channel
+                )
+                else 0
+            )
+        return easylist, easyprivacy, exception
+
+    def _classify_javascript_uncached(self, script_url, top_level_url):
+        self._set_request_for_rule_stats(script_url, top_level_url)
+        easylist = 1 if self.RULESETS["easylist"].should_block(script_url) else 0
+        easyprivacy = 1 if self.RULESETS["easyprivacy"].should_block(script_url) else 0
+        exception = 0
+        if easylist or easyprivacy:
+            # Only check for exceptions if the javascript matches with any of the rules in the rulesets
+            exception = (
+                1
+                if self._match_javascript_exceptionlist(script_url, top_level_url)
+                else 0
+            )
         return easylist, easyprivacy, exception
 
+    def get_http_request_matches(self, request):
+        """
+        Check if the request matches with any of the rules in the three rulesets.
+        Returns a tuple with three booleans
+        """
+        return self._classify_http_request(
+            request["url"],
+            request["top_level_url"],
+            request.get("resource_type"),
+            request.get("is_third_party_channel"),
+        )
+
     def get_javascript_matches(self, javascript):
         """
         Check if the javascript matches with any of the rules in the three rulesets.
         Returns a tuple with three booleans
         """
-        url = javascript["script_url"]
-        easylist = 1 if self.RULESETS["easylist"].should_block(url) else 0
-        easyprivacy = 1 if self.RULESETS["easyprivacy"].should_block(url) else 0
-        exception = 0
-        if easylist or easyprivacy:
-            # Only check for exceptions if the request matches with any of the rules in the rulesets
-            exception = 1 if self._match_javascript_exceptionlist(javascript) else 0
-        self._show_progress_javascripts(javascript["id"])
-        return easylist, easyprivacy, exception
+        return self._classify_javascript(
+            javascript["script_url"], javascript["top_level_url"]
+        )
+
+    def _classify_batch(self, classify, columns: list, label: str) -> np.ndarray:
+        """Classifies the rows given by the columns (of the same length) with classify, each distinct row only once.
+        Returns an array with one (easylist, easyprivacy, exception) row for each row
+        """
+        columns = [_nan_to_none(column) for column in columns]
+        # Position of each distinct row in unique_rows, and of the distinct row of each row in row_codes
+        unique_rows = dict()
+        row_codes = np.fromiter(
+            (unique_rows.setdefault(row, len(unique_rows)) for row in zip(*columns)),
+            dtype=np.int64,
+            count=len(columns[0]),
+        )
+
+        # Amount of rows of each distinct row, for the rule statistics
+        row_weights = np.bincount(row_codes, minlength=len(unique_rows))
+
+        progress = ProgressCounter(f"{label} (distinct)", len(unique_rows))
+        unique_matches = np.zeros((len(unique_rows), 3), dtype=np.int64)
+        for i, row in enumerate(unique_rows):
+            self._row_weight = int(row_weights[i])
+            unique_matches[i] = classify(*row)
+            progress.update()
+        self._row_weight = 1
+        progress.close()
+
+        # Every row gets the matches of its distinct row
+        return unique_matches[row_codes]
+
+    def classify_http_requests(
+        self, urls, top_level_urls, resource_types=None, third_party_channels=None
+    ) -> np.ndarray:
+        """Batch version of get_http_request_matches for whole columns.
+        resource_types and third_party_channels (http_requests.is_third_party_channel) are optional.
+        Returns an array with one (easylist, easyprivacy, exception) row for each request
+        """
+        columns = [urls, top_level_urls, resource_types, third_party_channels]
+        columns = [
+            [None] * len(urls) if column is None else column for column in columns
+        ]
+        return self._classify_batch(
+            self._classify_http_request, columns, "http_requests"
+        )
+
+    def classify_javascripts(self, script_urls, top_level_urls) -> np.ndarray:
+        """Batch version of get_javascript_matches for whole columns.
+        Returns an array with one (easylist, easyprivacy, exception) row for each javascript
+        """
+        return self._classify_batch(
+            self._classify_javascript, [script_urls, top_level_urls], "javascripts"
+        )
+
+    def cache_info(self):
+        return {
+            "http_requests": self._classify_http_request.cache_info(),
+            "javascripts": self._classify_javascript.cache_info(),
+        }
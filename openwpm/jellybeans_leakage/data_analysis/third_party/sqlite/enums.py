@@ -1,33 +1,44 @@
 from enum import StrEnum, Enum
 
 
-class ABQueriesBySiteURL:
-    # TODO: 1. Add a column that is only the domain name of the search engine (e.g. google.com) so we can group by that and decouple from the search term
-    #       2. Refactor this class
-    def __init__(self, site_url) -> None:
-        self.site_url = site_url
-        self.HTTPRequests = self._get_http_abp_matches()
-        self.JS = self._get_javascript_abp_matches()
+class ABQueriesGroupedBySiteURL(StrEnum):
+    """Enum class to store SQL queries to get the ABP matches of the third party tables for every site_url in a
+    JSON array (the only parameter), in one query per table.
+    Rows come ordered by site_url, so they can be split by site in a single pass,
+    using the site_url indexes of ABIndexCreationCommand.
+    """
 
-    def _get_http_abp_matches(self):
-        return (
-            "SELECT * "
-            "FROM http_requests_third_party as third_party "
-            "INNER JOIN adblock.http_requests_abp AS abp "
-            "ON third_party.original_id = abp.id "
-            f"WHERE third_party.site_url = '{self.site_url}' "
-            f"AND abp.site_url = '{self.site_url}' ;"
-        )
+    HTTP_REQUESTS = """
+    SELECT third_party.*, abp.*
+    FROM http_requests_third_party AS third_party
+    INNER JOIN adblock.http_requests_abp AS abp ON third_party.original_id = abp.id
+    WHERE third_party.site_url IN (SELECT value FROM json_each(?))
+    AND abp.site_url = third_party.site_url
+    ORDER BY third_party.site_url, third_party.original_id;
+    """
 
-    def _get_javascript_abp_matches(self):
-        return (
-            "SELECT * "
-            "FROM javascript_third_party as third_party "
-            "INNER JOIN adblock.javascripts_abp AS abp "
-            "ON third_party.original_id = abp.id "
-            f"WHERE third_party.site_url = '{self.site_url}' "
-            f"AND abp.site_url = '{self.site_url}' ;"
-        )
+    JS = """
+    SELECT third_party.*, abp.*
+    FROM javascript_third_party AS third_party
+    INNER JOIN adblock.javascripts_abp AS abp ON third_party.original_id = abp.id
+    WHERE third_party.site_url IN (SELECT value FROM json_each(?))
+    AND abp.site_url = third_party.site_url
+    ORDER BY third_party.site_url, third_party.original_id;
+    """
+
+
+class ABIndexCreationCommand(StrEnum):
+    """Enum class to store SQL commands to create the indexes used by ABQueriesGroupedBySiteURL"""
+
+    HTTP_REQUESTS = """
+    CREATE INDEX IF NOT EXISTS http_requests_third_party_site_url_index
+    ON http_requests_third_party (site_url);
+    """
+
+    JS = """
+    CREATE INDEX IF NOT EXISTS javascript_third_party_site_url_index
+    ON javascript_third_party (site_url);
+    """
 
 
 class ABQueriesGeneral:
@@ -1,13 +1,41 @@
 from pathlib import Path
+from collections import OrderedDict
+from html.parser import HTMLParser
+from multiprocessing import Pool
+import os
 import re
 import json
 import gzip
+import sqlite3
 import argparse
-from bs4 import BeautifulSoup
-from adblockparser import AdblockRules
 
 import sys
 
+# Optional: the frames are read from the dump while it is decompressed, in stead of loading the whole JSON
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Optional: faster HTML parsers for the links, in order of preference (html.parser is used if none is installed)
+try:
+    from selectolax.parser import HTMLParser as SelectolaxHTMLParser
+except ImportError:
+    SelectolaxHTMLParser = None
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# The filter lists are matched with the token-indexed rules of the python_adblock pipeline
+sys.path.append(
+    str(
+        Path(__file__).resolve().parent.parent
+        / "jellybeans_leakage/data_analysis/third_party/python_adblock"
+    )
+)
+from ruleset_cache import load_rules
+
 
 from urllib.parse import urlparse
 
@@ -17,103 +45,256 @@ from urllib.parse import urlparse
 regex_s = r"(?i)\b(adurl|redirect)=((?:https?:(?:/{1,3}|[a-z0-9%])|[a-z0-9\.\-]+[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)/)(?:[^\s()<>{}\[\]]+|\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\))+(?:\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\)|[^\s`!()\[\]{};:\'\".,<>?«»“”‘’])|(?:(?<!@)[a-z0-9]+(?:[.\-][a-z0-9]+)*[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)\b/?(?!@)))"
 
 
-def get_data_l_from_link(href_url):
-    print("get_data_l_from_link: start")
-
-    # href_url = link.get('href')
-
-    # print("get_data_l_from_link: href_url: ", href_url)
-
-    landing_page_url_l = re.findall(regex_s, href_url)
-
-    # print("get_data_l_from_link: landing_page_url_l: %s" %
-    #       (str(landing_page_url_l)))
-    # print(iframe_d.keys())
-
-    current_data_l = [(href_url, landing_page_url[0], landing_page_url[1])
-                      for landing_page_url in landing_page_url_l]
-
-    print("get_data_l_from_link: %d landing page data found" % (len(current_data_l)))
-
-    print("get_data_l_from_link: end")
-
-    return current_data_l
-
-
-def check_source_string(ad_block_rules, iframe_key, data_d):
-    print("check_source_string: start")
-
-    # doc_url_s = data_d["doc_url"]
-    source_s = data_d["source"]
-    iframe_d = data_d["iframes"]
-
-    print("check_source_string: iframe_key: ", iframe_key)
-    # print("doc_url_s: ",doc_url_s)
-    # print("source_s: ",source_s)
-
-    # https://stackoverflow.com/questions/3075550/how-can-i-get-href-links-from-html-using-python
-    soup = BeautifulSoup(source_s, "html.parser")
+# Compiled once, as it is run on every ad link
+landing_page_re = re.compile(regex_s)
+# Every landing page found by regex_s follows one of its keywords, so the links without them are skipped
+landing_page_keyword_re = re.compile(r"(?i)(adurl|redirect)=")
+# Links checked with the filter lists (the href filter BeautifulSoup used before)
+href_re = re.compile("^http?s://")
+
+DUMP_SUFFIX = ".json.gz"
+TOP_FRAME_KEY = "init"
+LANDING_PAGES_DATABASE = "landing_pages.sqlite"
+
+CREATE_LANDING_PAGES_TABLE = """
+CREATE TABLE IF NOT EXISTS landing_pages (
+    dump_file TEXT NOT NULL,
+    visit_id INTEGER,
+    iframe_key TEXT NOT NULL,
+    href_url TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    landing_page_url TEXT NOT NULL,
+    link_count INTEGER NOT NULL
+)
+"""
+CREATE_LANDING_PAGES_INDEX = """
+CREATE INDEX IF NOT EXISTS landing_pages_dump_file ON landing_pages (dump_file)
+"""
+INSERT_LANDING_PAGE = """
+INSERT INTO landing_pages (dump_file, visit_id, iframe_key, href_url, keyword, landing_page_url, link_count)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Maximum amount of distinct links whose landing page data is kept, so the memory used doesn't grow with the
+# amount of dumps
+LINK_CACHE_SIZE = 2**16
+
+
+class LinkDataCache:
+    """Landing page data of the last checked links, the least recently used ones are dropped"""
+
+    def __init__(self, max_size=LINK_CACHE_SIZE):
+        self.max_size = max_size
+        self._data_d = OrderedDict()
+
+    def get(self, link):
+        """Returns the landing page data of the link, or None if it is not in the cache"""
+        data_l = self._data_d.get(link)
+        if data_l is not None:
+            self._data_d.move_to_end(link)
+        return data_l
+
+    def put(self, link, data_l):
+        self._data_d[link] = data_l
+        self._data_d.move_to_end(link)
+        if len(self._data_d) > self.max_size:
+            self._data_d.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data_d)
+
+
+# Rules of the worker processes (see init_worker), and the landing page data of the links they checked last
+worker_ad_block_rules = None
+worker_link_data_d = LinkDataCache()
 
-    link_data_l = soup.findAll('a', attrs={'href': re.compile("^http?s://")})
-    link_l = [link_data.get('href') for link_data in link_data_l]
-    print("check_source_string: %d link(s) found" % (len(link_l)))
 
-    # print("check_source_string: link_l: %s" % (str(link_l)))
-
-    ad_link_l = [
-        link for link in link_l
-        if ad_block_rules.should_block(link, {'script': False})
-    ]
-    print("check_source_string: %d ad link(s) found" % (len(ad_link_l)))
-
-    current_data_l_l_tmp = [get_data_l_from_link(link) for link in ad_link_l]
-    current_data_l_tmp = [
-        item for sublist in current_data_l_l_tmp for item in sublist
-    ]
-    current_data_l = [(iframe_key, href_url, keyword, landing_page_url)
-                      for (href_url, keyword,
-                           landing_page_url) in current_data_l_tmp]
-
-    data_l_l = [
-        check_source_string(ad_block_rules, k, v)
-        for (k, v) in iframe_d.items()
-    ]
-    data_l = [item for sublist in data_l_l for item in sublist]
-
-    print("check_source_string: end")
-
-    return current_data_l + data_l
-
-
-def process(filter_file_path, input_json_gz_path, output_directory_path):
+def get_data_l_from_link(href_url):
+    if not landing_page_keyword_re.search(href_url):
+        return []
+
+    landing_page_url_l = landing_page_re.findall(href_url)
+
+    return [(href_url, landing_page_url[0], landing_page_url[1])
+            for landing_page_url in landing_page_url_l]
+
+
+class LinkParser(HTMLParser):
+    """Collects the href of the links (a elements), without building the tree as BeautifulSoup does"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.link_l = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            # The last one if the attribute is repeated, as BeautifulSoup does
+            href = dict(attrs).get("href")
+            if href is not None:
+                self.link_l.append(href)
+
+
+def get_links_html_parser(source_s):
+    parser = LinkParser()
+    parser.feed(source_s)
+    parser.close()
+    return parser.link_l
+
+
+def get_links(source_s):
+    """Returns the links (href of the a elements) of the HTML source that go to http(s) URLs,
+    using the fastest HTML parser installed
+    """
+    if SelectolaxHTMLParser is not None:
+        href_l = [
+            node.attributes.get("href")
+            for node in SelectolaxHTMLParser(source_s).css("a[href]")
+        ]
+    elif lxml is not None and source_s.strip():
+        try:
+            href_l = [
+                element.get("href")
+                for element in lxml.html.fromstring(source_s).iter("a")
+            ]
+        except (ValueError, lxml.etree.ParserError):
+            # e.g. sources with an XML encoding declaration
+            href_l = get_links_html_parser(source_s)
+    else:
+        href_l = get_links_html_parser(source_s)
+    return [href for href in href_l if href is not None and href_re.search(href)]
+
+
+def iter_frame_dict(iframe_key, data_d):
+    yield iframe_key, data_d["source"]
+    for (k, v) in data_d["iframes"].items():
+        yield from iter_frame_dict(k, v)
+
+
+def iter_frame_sources(f):
+    """Yields (iframe_key, source) for each frame of a RecursiveDumpPageSourceCommand dump, each frame before
+    its iframes. The top frame is "init", and the iframes are keyed by their frame id as in the dump
+    """
+    if ijson is None:
+        yield from iter_frame_dict(TOP_FRAME_KEY, json.load(f))
+        return
+
+    # Only one source is in memory at a time. Its prefix is "source" for the top frame,
+    # and "iframes.<frame id>.source", "iframes.<frame id>.iframes.<frame id>.source", ... for the iframes
+    for prefix, event, value in ijson.parse(f):
+        if event == "string" and (prefix == "source" or prefix.endswith(".source")):
+            path = prefix.split(".")
+            yield path[-2] if len(path) > 1 else TOP_FRAME_KEY, value
+
+
+def check_frame_sources(ad_block_rules, frame_sources, link_data_d):
+    """Returns (iframe_key, href_url, keyword, landing_page_url, link_count) for each landing page of the ad
+    links of the frames. link_count is the amount of times the link is in the frame.
+    Each distinct link is only checked once while its landing page data is in link_data_d (a LinkDataCache)
+    """
+    data_l = []
+    for iframe_key, source_s in frame_sources:
+        link_count_d = dict()
+        for link in get_links(source_s):
+            link_count_d[link] = link_count_d.get(link, 0) + 1
+
+        for link, link_count in link_count_d.items():
+            link_data_l = link_data_d.get(link)
+            if link_data_l is None:
+                link_data_l = (
+                    get_data_l_from_link(link)
+                    if ad_block_rules.should_block(link, {'script': False})
+                    else []
+                )
+                link_data_d.put(link, link_data_l)
+            data_l.extend(
+                (iframe_key, href_url, keyword, landing_page_url, link_count)
+                for (href_url, keyword, landing_page_url) in link_data_l
+            )
+    return data_l
+
+
+def get_visit_id(input_json_gz_path):
+    # The dumps are named <visit_id>-<md5 of the URL><suffix>.json.gz
+    visit_id_s = Path(input_json_gz_path).name.split("-", 1)[0]
+    return int(visit_id_s) if visit_id_s.isdigit() else None
+
+
+def process_dump(ad_block_rules, input_json_gz_path, link_data_d):
+    """Returns the landing_pages rows of the dump"""
+    with gzip.open(input_json_gz_path, 'rb') as f:
+        data_l = check_frame_sources(ad_block_rules, iter_frame_sources(f),
+                                     link_data_d)
+
+    dump_file = Path(input_json_gz_path).name
+    visit_id = get_visit_id(input_json_gz_path)
+    return [(dump_file, visit_id) + data for data in data_l]
+
+
+def init_worker(filter_file_path):
+    global worker_ad_block_rules
+    worker_ad_block_rules = load_rules(filter_file_path)
+
+
+def process_dump_in_worker(input_json_gz_path):
+    return input_json_gz_path, process_dump(worker_ad_block_rules,
+                                            input_json_gz_path,
+                                            worker_link_data_d)
+
+
+def save_landing_pages(conn, input_json_gz_path, row_l):
+    # The rows of a dump processed before are replaced
+    conn.execute("DELETE FROM landing_pages WHERE dump_file = ?",
+                 (Path(input_json_gz_path).name, ))
+    conn.executemany(INSERT_LANDING_PAGE, row_l)
+    conn.commit()
+
+
+def process(filter_file_path,
+            input_json_gz_path,
+            output_directory_path,
+            workers=1):
     print("process: start")
 
-    print("process: reading blocking list")
-    # f = open(easylist_file_path)
-    # filter_l = f.read().splitlines()
-    filter_l_l = [open(path).read().splitlines() for path in filter_file_path]
-    filter_l = [item for sublist in filter_l_l for item in sublist]
-
-    ad_block_rules = AdblockRules(filter_l)
-
-    print("process: reading crawled iframe JSON gz")
-    f = gzip.open(input_json_gz_path, 'rb')
-
-    # file_content=f.read()
-
-    # json_path = "datadir/sources/tete.json"
-    # f = open(json_path)
-
-    print("process: loading JSON")
-    data_d = json.load(f)
-
-    print("process: checking URL")
-    data_l = check_source_string(ad_block_rules, "init", data_d)
-
-    print(data_l)
+    # A single dump, or every dump of a directory
+    input_path = Path(input_json_gz_path)
+    if input_path.is_dir():
+        dump_path_l = sorted(input_path.glob("*" + DUMP_SUFFIX))
+    else:
+        dump_path_l = [input_path]
+    print("process: %d dump(s) to check" % (len(dump_path_l)))
+
+    os.makedirs(output_directory_path, exist_ok=True)
+    output_path = Path(output_directory_path) / LANDING_PAGES_DATABASE
+    conn = sqlite3.connect(output_path)
+    conn.execute(CREATE_LANDING_PAGES_TABLE)
+    conn.execute(CREATE_LANDING_PAGES_INDEX)
+
+    if workers > 1 and len(dump_path_l) > 1:
+        # Each worker loads the rules (from the cache next to the lists) and checks whole dumps
+        with Pool(workers, initializer=init_worker,
+                  initargs=(filter_file_path, )) as pool:
+            results = pool.imap_unordered(process_dump_in_worker, dump_path_l)
+            for i, (dump_path, row_l) in enumerate(results, start=1):
+                save_landing_pages(conn, dump_path, row_l)
+                print("process: %d/%d %s: %d landing page(s)" %
+                      (i, len(dump_path_l), dump_path.name, len(row_l)))
+    else:
+        print("process: reading blocking list")
+        # Parsed only the first time (or after a list changes), then loaded from the cache next to the lists
+        ad_block_rules = load_rules(filter_file_path)
+        link_data_d = LinkDataCache()
+        for i, dump_path in enumerate(dump_path_l, start=1):
+            row_l = process_dump(ad_block_rules, dump_path, link_data_d)
+            save_landing_pages(conn, dump_path, row_l)
+            print("process: %d/%d %s: %d landing page(s)" %
+                  (i, len(dump_path_l), dump_path.name, len(row_l)))
+
+    conn.close()
+    print("process: landing pages saved in %s" % (output_path))
 
     print("process: end")
 
+
 def main():
     print("main: start")
 
@@ -133,12 +314,18 @@ def main():
                         "--input-json-gz-path",
                         type=str,
                         required=True,
-                        help="Input JSON gz path")
+                        help="Input JSON gz path, or directory of JSON gz")
     parser.add_argument("-o",
                         "--output-directory-path",
                         type=str,
                         required=True,
-                        help="Output directory path")
+                        help="Output directory path (of %s)" %
+                        (LANDING_PAGES_DATABASE))
+    parser.add_argument("-w",
+                        "--workers",
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help="Nb of processes checking the dumps of a directory")
     # parser.add_argument("-n",
     #                     "--url-nb",
     #                     type=int,
@@ -155,12 +342,14 @@ def main():
     filter_file_path = args.filter_file_path
     input_json_gz_path = args.input_json_gz_path
     output_directory_path = args.output_directory_path
+    workers = args.workers
     # url_nb = args.url_nb
     # exponential_law_mean = args.exponential_law_mean
 
     print("main: filter_file_path: %s" % (filter_file_path))
     print("main: input_json_gz_path: %s" % (input_json_gz_path))
     print("main: output_directory_path: %s" % (output_directory_path))
+    print("main: workers: %d" % (workers))
     # print("main: url_nb: %s" % (url_nb))
     # print("main: exponential_law_mean: %s" % (exponential_law_mean))
 
@@ -168,6 +357,7 @@ def main():
         filter_file_path,
         input_json_gz_path,
         output_directory_path,
+        workers,
     )
 
     print("main: end")
@@ -4,18 +4,57 @@ import random
 from abc import abstractmethod
 from asyncio import Task
 from collections import defaultdict
-from typing import Any, DefaultDict, Dict, List, Optional
+from dataclasses import dataclass
+from typing import Any, DefaultDict, Dict, List, Optional, Union
 
-import pandas as pd
 import pyarrow as pa
 from pyarrow import Table
 
 from openwpm.types import VisitId
 
+from .derived_columns import add_etld1_columns
 from .parquet_schema import PQ_SCHEMAS
 from .storage_providers import INCOMPLETE_VISITS, StructuredStorageProvider, TableName
 
 CACHE_SIZE = 500
+CACHE_BYTES = 64 * 2**20
+ROW_GROUP_SIZE = 128 * 1024
+
+
+@dataclass
+class FlushPolicy:
+    """When the ArrowProvider writes out its buffered record batches:
+    as soon as a table holds more batches, bytes or rows than allowed.
+    A limit of None is never reached.
+    """
+
+    max_batches: Optional[int] = CACHE_SIZE
+    max_bytes: Optional[int] = CACHE_BYTES
+    max_rows: Optional[int] = None
+
+
+@dataclass
+class ParquetOptions:
+    """How the Parquet files are written"""
+
+    row_group_size: Optional[int] = ROW_GROUP_SIZE
+    """Maximum rows per row group"""
+    compression: str = "zstd"
+    compression_level: Optional[int] = None
+    use_dictionary: Union[bool, List[str]] = True
+    """Dictionary encode all the columns, none of them or the listed ones"""
+
+    def write_options(self) -> Dict[str, Any]:
+        """Keyword arguments for pq.write_to_dataset and pq.write_table"""
+        options: Dict[str, Any] = {
+            "compression": self.compression,
+            "use_dictionary": self.use_dictionary,
+        }
+        if self.row_group_size is not None:
+            options["row_group_size"] = self.row_group_size
+        if self.compression_level is not None:
+            options["compression_level"] = self.compression_level
+        return options
 
 
 class ArrowProvider(StructuredStorageProvider):
@@ -25,20 +64,33 @@ class ArrowProvider(StructuredStorageProvider):
 
     storing_lock: asyncio.Lock
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        store_etld1: bool = False,
+        flush_policy: Optional[FlushPolicy] = None,
+        parquet_options: Optional[ParquetOptions] = None,
+    ) -> None:
         super().__init__()
         self.logger = logging.getLogger("openwpm")
+        self.store_etld1 = store_etld1
+        """Also store the eTLD+1 columns listed in derived_columns.ETLD1_COLUMNS"""
+        self.flush_policy = flush_policy or FlushPolicy()
+        self.parquet_options = parquet_options or ParquetOptions()
 
-        def factory_function() -> DefaultDict[TableName, List[Dict[str, Any]]]:
-            return defaultdict(list)
+        def factory_function() -> DefaultDict[TableName, Dict[str, List[Any]]]:
+            return defaultdict(dict)
 
-        # Raw records per VisitId and Table
+        # Columns of the records per VisitId and Table, with a list of
+        # values for every column of the table's schema
         self._records: DefaultDict[
-            VisitId, DefaultDict[TableName, List[Dict[str, Any]]]
+            VisitId, DefaultDict[TableName, Dict[str, List[Any]]]
         ] = defaultdict(factory_function)
 
         # Record batches by TableName
         self._batches: DefaultDict[TableName, List[pa.RecordBatch]] = defaultdict(list)
+        # Size of the record batches by TableName
+        self._batch_bytes: DefaultDict[TableName, int] = defaultdict(int)
+        self._batch_rows: DefaultDict[TableName, int] = defaultdict(int)
         self._instance_id = random.getrandbits(32)
 
         self.flush_events: List[asyncio.Event] = list()
@@ -50,14 +102,28 @@ class ArrowProvider(StructuredStorageProvider):
     async def store_record(
         self, table: TableName, visit_id: VisitId, record: Dict[str, Any]
     ) -> None:
-        records = self._records[visit_id]
-        # Add nulls
-        for item in PQ_SCHEMAS[table].names:
-            if item not in record:
-                record[item] = None
-        # Add instance_id (for partitioning)
-        record["instance_id"] = self._instance_id
-        records[table].append(record)
+        if self.store_etld1:
+            add_etld1_columns(table, record)
+        columns = self._records[visit_id][table]
+        if not columns:
+            columns.update((name, []) for name in PQ_SCHEMAS[table].names)
+        # The columns missing from the record are null
+        for name, values in columns.items():
+            values.append(record.get(name))
+
+    @staticmethod
+    def _to_array(values: List[Any], field: pa.Field) -> pa.Array:
+        """Converts the values of a column to the type of its schema field.
+        Like the conversion from pandas, numbers are cast (safely) to numeric
+        and bool fields, e.g. the 0/1 the extension sends for the bool
+        columns, but nothing is converted to a string
+        """
+        try:
+            return pa.array(values, type=field.type, from_pandas=True)
+        except (pa.lib.ArrowInvalid, pa.lib.ArrowTypeError):
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                raise
+            return pa.array(values, from_pandas=True).cast(field.type)
 
     def _create_batch(self, visit_id: VisitId) -> None:
         """Create record batches for all records from `visit_id`"""
@@ -68,18 +134,24 @@ class ArrowProvider(StructuredStorageProvider):
                 visit_id,
             )
             return
-        for table_name, data in self._records[visit_id].items():
+        for table_name, columns in self._records[visit_id].items():
+            # Add instance_id (for partitioning)
+            columns["instance_id"] = [self._instance_id] * len(columns["instance_id"])
             try:
-                df = pd.DataFrame(data)
-                batch = pa.RecordBatch.from_pandas(
-                    df, schema=PQ_SCHEMAS[table_name], preserve_index=False
+                # Straight from the column lists, without a pandas DataFrame
+                schema = PQ_SCHEMAS[table_name]
+                batch = pa.RecordBatch.from_arrays(
+                    [self._to_array(columns[field.name], field) for field in schema],
+                    schema=schema,
                 )
                 self._batches[table_name].append(batch)
+                self._batch_bytes[table_name] += batch.nbytes
+                self._batch_rows[table_name] += batch.num_rows
                 self.logger.debug(
                     "Successfully created batch for table %s and "
                     "visit_id %s" % (table_name, visit_id)
                 )
-            except pa.lib.ArrowInvalid:
+            except (pa.lib.ArrowInvalid, pa.lib.ArrowTypeError):
                 self.logger.error(
                     "Error while creating record batch for table %s\n" % table_name,
                     exc_info=True,
@@ -89,8 +161,19 @@ class ArrowProvider(StructuredStorageProvider):
         del self._records[visit_id]
 
     def _is_cache_full(self) -> bool:
-        for batches in self._batches.values():
-            if len(batches) > CACHE_SIZE:
+        policy = self.flush_policy
+        for table_name, batches in self._batches.items():
+            if policy.max_batches is not None and len(batches) > policy.max_batches:
+                return True
+            if (
+                policy.max_bytes is not None
+                and self._batch_bytes[table_name] > policy.max_bytes
+            ):
+                return True
+            if (
+                policy.max_rows is not None
+                and self._batch_rows[table_name] > policy.max_rows
+            ):
                 return True
         return False
 
@@ -151,9 +234,13 @@ class ArrowProvider(StructuredStorageProvider):
         assert lock == self.storing_lock and lock.locked()
 
         for table_name, batches in self._batches.items():
-            table = pa.Table.from_batches(batches)
+            # The small batches of each visit are coalesced, so they are
+            # written out as big row groups
+            table = pa.Table.from_batches(batches).combine_chunks()
             await self.write_table(table_name, table)
         self._batches.clear()
+        self._batch_bytes.clear()
+        self._batch_rows.clear()
 
         for event in self.flush_events:
             event.set()
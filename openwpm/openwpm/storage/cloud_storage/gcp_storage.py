@@ -1,11 +1,11 @@
 import logging
-from typing import Set
+from typing import Optional, Set
 
 import pyarrow.parquet as pq
 from gcsfs import GCSFileSystem
 from pyarrow.lib import Table
 
-from ..arrow_storage import ArrowProvider
+from ..arrow_storage import ArrowProvider, FlushPolicy, ParquetOptions
 from ..storage_providers import TableName, UnstructuredStorageProvider
 
 
@@ -31,8 +31,15 @@ class GcsStructuredProvider(ArrowProvider):
         base_path: str,
         token: str = None,
         sub_dir: str = "visits",
+        store_etld1: bool = False,
+        flush_policy: Optional[FlushPolicy] = None,
+        parquet_options: Optional[ParquetOptions] = None,
     ) -> None:
-        super().__init__()
+        super().__init__(
+            store_etld1=store_etld1,
+            flush_policy=flush_policy,
+            parquet_options=parquet_options,
+        )
         self.project = project
         self.token = token
         self.base_path = f"{bucket_name}/{base_path}/{sub_dir}/{{table_name}}"
@@ -51,6 +58,7 @@ class GcsStructuredProvider(ArrowProvider):
             table,
             self.base_path.format(table_name=table_name),
             filesystem=self.file_system,
+            **self.parquet_options.write_options(),
         )
 
     async def shutdown(self) -> None:
@@ -1,11 +1,11 @@
 import logging
-from typing import Any, Set
+from typing import Any, Optional, Set
 
 import pyarrow.parquet as pq
 from pyarrow.lib import Table
 from s3fs import S3FileSystem
 
-from ..arrow_storage import ArrowProvider
+from ..arrow_storage import ArrowProvider, FlushPolicy, ParquetOptions
 from ..storage_providers import TableName, UnstructuredStorageProvider
 
 
@@ -24,9 +24,20 @@ class S3StructuredProvider(ArrowProvider):
     file_system: S3FileSystem
 
     def __init__(
-        self, bucket_name: str, base_path: str, sub_dir: str = "visits", **kwargs: Any
+        self,
+        bucket_name: str,
+        base_path: str,
+        sub_dir: str = "visits",
+        store_etld1: bool = False,
+        flush_policy: Optional[FlushPolicy] = None,
+        parquet_options: Optional[ParquetOptions] = None,
+        **kwargs: Any,
     ) -> None:
-        super().__init__()
+        super().__init__(
+            store_etld1=store_etld1,
+            flush_policy=flush_policy,
+            parquet_options=parquet_options,
+        )
         self.kwargs = kwargs
         self.base_path = f"{bucket_name}/{base_path}/{sub_dir}/{{table_name}}"
 
@@ -43,6 +54,7 @@ class S3StructuredProvider(ArrowProvider):
             table,
             self.base_path.format(table_name=table_name),
             filesystem=self.file_system,
+            **self.parquet_options.write_options(),
         )
         self.file_system.end_transaction()
 
@@ -0,0 +1,53 @@
+"""
+Columns that are not sent by the instrumentation but derived from other
+columns of a record while it gets stored.
+
+Currently these are the eTLD+1s of the URL columns analysis scripts use to
+tell first and third parties apart. Having them in the database allows
+filtering third parties in SQL (e.g. WHERE url_etld1 != top_level_url_etld1)
+"""
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import domain_utils as du
+
+from .storage_providers import TableName
+
+ETLD1_CACHE_SIZE = 2**16
+
+ETLD1_COLUMNS: Dict[TableName, Dict[str, str]] = {
+    TableName("http_requests"): {
+        "url_etld1": "url",
+        "top_level_url_etld1": "top_level_url",
+    },
+    TableName("javascript"): {
+        "script_url_etld1": "script_url",
+        "document_url_etld1": "document_url",
+        "top_level_url_etld1": "top_level_url",
+    },
+    TableName("javascript_cookies"): {
+        "host_etld1": "host",
+    },
+}
+"""Derived eTLD+1 column -> source column for every table that has them"""
+
+
+@lru_cache(maxsize=ETLD1_CACHE_SIZE)
+def get_etld1(url: str) -> Optional[str]:
+    """Returns the eTLD+1 of `url` or None if it can't be determined
+
+    The same few hosts show up over and over again during a crawl,
+    so results are cached.
+    """
+    try:
+        etld1 = du.get_ps_plus_1(url)
+    except Exception:
+        return None
+    return etld1 if etld1 else None
+
+
+def add_etld1_columns(table: TableName, record: Dict[str, Any]) -> None:
+    """Adds the eTLD+1 columns of `table` to `record` in place"""
+    for derived_column, source_column in ETLD1_COLUMNS.get(table, {}).items():
+        value = record.get(source_column)
+        record[derived_column] = get_etld1(value) if isinstance(value, str) else None
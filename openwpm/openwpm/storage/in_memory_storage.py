@@ -10,14 +10,14 @@ import asyncio
 import logging
 from asyncio import Event, Lock, Task
 from collections import defaultdict
-from typing import Any, DefaultDict, Dict, List
+from typing import Any, DefaultDict, Dict, List, Optional
 
 from multiprocess import Queue
 from pyarrow import Table
 
 from openwpm.types import VisitId
 
-from .arrow_storage import ArrowProvider
+from .arrow_storage import ArrowProvider, FlushPolicy
 from .storage_providers import (
     StructuredStorageProvider,
     TableName,
@@ -151,8 +151,10 @@ class MemoryUnstructuredProvider(UnstructuredStorageProvider):
 
 
 class MemoryArrowProvider(ArrowProvider):
-    def __init__(self) -> None:
-        super().__init__()
+    def __init__(
+        self, store_etld1: bool = False, flush_policy: Optional[FlushPolicy] = None
+    ) -> None:
+        super().__init__(store_etld1=store_etld1, flush_policy=flush_policy)
         self.queue = Queue()
         self.handle = MemoryProviderHandle(self.queue)
 
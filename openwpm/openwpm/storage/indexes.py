@@ -0,0 +1,111 @@
+"""
+Secondary indexes of the SQLite columns analysis queries join and filter on.
+
+None of them is part of schema.sql, as every index slows down the inserts
+of the crawl. They are created once the crawl is over, either by
+SQLiteStorageProvider(create_indexes=True) on shutdown or on demand:
+
+    python -m openwpm.storage.indexes crawl-data.sqlite
+"""
+import argparse
+import sqlite3
+import time
+from typing import Dict, List, Set, Tuple
+
+from .derived_columns import ETLD1_COLUMNS
+from .storage_providers import TableName
+
+INDEXES: Dict[str, Tuple[TableName, Tuple[str, ...]]] = {
+    # Visits of a site, and of a crawl (browser)
+    "site_visits_site_url_index": (TableName("site_visits"), ("site_url", "visit_id")),
+    "site_visits_browser_id_index": (
+        TableName("site_visits"),
+        ("browser_id", "site_url"),
+    ),
+    # Records of a visit
+    "http_requests_visit_id_index": (TableName("http_requests"), ("visit_id",)),
+    "http_responses_visit_id_index": (TableName("http_responses"), ("visit_id",)),
+    "http_redirects_visit_id_index": (TableName("http_redirects"), ("visit_id",)),
+    "javascript_visit_id_index": (TableName("javascript"), ("visit_id",)),
+    "javascript_cookies_visit_id_index": (
+        TableName("javascript_cookies"),
+        ("visit_id",),
+    ),
+    "navigations_visit_id_index": (TableName("navigations"), ("visit_id",)),
+    "callstacks_visit_id_index": (TableName("callstacks"), ("visit_id",)),
+    "dns_responses_visit_id_index": (TableName("dns_responses"), ("visit_id",)),
+    # URLs requested by a crawl (browser), e.g. to compare two crawls
+    "http_requests_browser_id_url_index": (
+        TableName("http_requests"),
+        ("browser_id", "url"),
+    ),
+}
+"""Index name -> table and indexed columns"""
+
+ETLD1_INDEXES: Dict[str, Tuple[TableName, Tuple[str, ...]]] = {
+    f"{table}_{column}_index": (table, (column,))
+    for table, derived_columns in ETLD1_COLUMNS.items()
+    for column in derived_columns
+}
+"""Indexes of the derived eTLD+1 columns (see derived_columns.py)"""
+
+
+def _get_columns(db: sqlite3.Connection, table: TableName) -> Set[str]:
+    return {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+
+
+def create_indexes(
+    db: sqlite3.Connection,
+    indexes: Dict[str, Tuple[TableName, Tuple[str, ...]]] = INDEXES,
+    analyze: bool = True,
+) -> List[str]:
+    """Creates the indexes (with IF NOT EXISTS) whose table and columns exist
+    in the database, and runs ANALYZE so the query planner uses them.
+    Returns the names of the indexes created or already there
+    """
+    columns: Dict[TableName, Set[str]] = {}
+    created = []
+    for name, (table, indexed_columns) in indexes.items():
+        if table not in columns:
+            columns[table] = _get_columns(db, table)
+        if not set(indexed_columns) <= columns[table]:
+            continue
+        db.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} "
+            f"ON {table}({', '.join(indexed_columns)})"
+        )
+        created.append(name)
+    if analyze:
+        db.execute("ANALYZE")
+    db.commit()
+    return created
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Create the indexes analysis queries use in OpenWPM "
+        "SQLite databases, once the crawl is over"
+    )
+    parser.add_argument("databases", nargs="+", help="SQLite database paths")
+    parser.add_argument(
+        "--no-analyze",
+        action="store_true",
+        help="don't run ANALYZE after creating the indexes",
+    )
+    args = parser.parse_args()
+
+    for db_path in args.databases:
+        start_time = time.time()
+        with sqlite3.connect(db_path) as db:
+            created = create_indexes(
+                db, {**INDEXES, **ETLD1_INDEXES}, analyze=not args.no_analyze
+            )
+        db.close()
+        print(
+            "%s: %d indexes in %.1fs"
+            % (db_path, len(created), time.time() - start_time)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,37 @@
 import logging
 from pathlib import Path
+from typing import Optional
 
 import pyarrow.parquet as pq
 from pyarrow.lib import Table
 
-from .arrow_storage import ArrowProvider
+from .arrow_storage import ArrowProvider, FlushPolicy, ParquetOptions
 from .storage_providers import TableName, UnstructuredStorageProvider
 
 
 class LocalArrowProvider(ArrowProvider):
     """Stores Parquet files under storage_path/table_name/n.parquet"""
 
-    def __init__(self, storage_path: Path) -> None:
-        super().__init__()
+    def __init__(
+        self,
+        storage_path: Path,
+        store_etld1: bool = False,
+        flush_policy: Optional[FlushPolicy] = None,
+        parquet_options: Optional[ParquetOptions] = None,
+    ) -> None:
+        super().__init__(
+            store_etld1=store_etld1,
+            flush_policy=flush_policy,
+            parquet_options=parquet_options,
+        )
         self.storage_path = storage_path
 
     async def write_table(self, table_name: TableName, table: Table) -> None:
-        pq.write_to_dataset(table, str(self.storage_path / table_name))
+        pq.write_to_dataset(
+            table,
+            str(self.storage_path / table_name),
+            **self.parquet_options.write_options(),
+        )
 
 
 class LocalGzipProvider(UnstructuredStorageProvider):
@@ -0,0 +1,144 @@
+"""
+Compaction of the Parquet files written by the ArrowProviders.
+
+Every flush of an ArrowProvider writes a new file for each table, so a
+crawl leaves many small files behind and scanning the data is dominated
+by opening them. Once the crawl is over, the files of each directory
+(e.g. storage_path/http_requests of a LocalArrowProvider) can be merged
+into a few large files with large row groups:
+
+    python -m openwpm.storage.parquet_compaction datadir/parquet
+
+The new files are moved next to the old ones before these are removed, so
+don't compact the files of a crawl that is still running.
+"""
+import argparse
+import shutil
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import DefaultDict, List, Optional, Tuple
+
+import pyarrow.dataset as ds
+
+from .arrow_storage import ParquetOptions
+
+MAX_ROWS_PER_FILE = 2**22
+
+
+def _get_parquet_files(root: Path) -> DefaultDict[Path, List[Path]]:
+    """Parquet files by directory, skipping hidden directories"""
+    files: DefaultDict[Path, List[Path]] = defaultdict(list)
+    for path in sorted(root.rglob("*.parquet")):
+        if any(part.startswith(".") for part in path.relative_to(root).parts):
+            continue
+        files[path.parent].append(path)
+    return files
+
+
+def compact_directory(
+    directory: Path,
+    files: List[Path],
+    options: ParquetOptions,
+    max_rows_per_file: int = MAX_ROWS_PER_FILE,
+) -> List[Path]:
+    """Rewrites the Parquet files (of the same table) of the directory into
+    files of at most max_rows_per_file rows, and removes them.
+    Returns the new files
+    """
+    write_options = options.write_options()
+    row_group_size = min(
+        write_options.pop("row_group_size", max_rows_per_file), max_rows_per_file
+    )
+    file_format = ds.ParquetFileFormat()
+
+    temporary_directory = directory / f".compaction-{uuid.uuid4().hex}"
+    ds.write_dataset(
+        ds.dataset([str(path) for path in files], format=file_format),
+        str(temporary_directory),
+        format=file_format,
+        file_options=file_format.make_write_options(**write_options),
+        basename_template=f"compacted-{uuid.uuid4().hex}-{{i}}.parquet",
+        max_rows_per_file=max_rows_per_file,
+        min_rows_per_group=row_group_size,
+        max_rows_per_group=row_group_size,
+    )
+
+    compacted_files = []
+    for path in sorted(temporary_directory.glob("*.parquet")):
+        compacted_files.append(path.rename(directory / path.name))
+    shutil.rmtree(temporary_directory)
+    for path in files:
+        path.unlink()
+    return compacted_files
+
+
+def compact_dataset(
+    root: Path,
+    options: Optional[ParquetOptions] = None,
+    max_rows_per_file: int = MAX_ROWS_PER_FILE,
+) -> Tuple[int, int]:
+    """Compacts the Parquet files of every directory under root that has
+    more than one of them. Returns the amount of files before and after
+    """
+    options = options or ParquetOptions()
+    files_before = 0
+    files_after = 0
+    for directory, files in _get_parquet_files(root).items():
+        files_before += len(files)
+        if len(files) == 1:
+            files_after += 1
+            continue
+        files_after += len(
+            compact_directory(directory, files, options, max_rows_per_file)
+        )
+    return files_before, files_after
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Merge the small Parquet files of a finished OpenWPM crawl "
+        "into large ones"
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="directories with the Parquet files of the crawl"
+    )
+    parser.add_argument(
+        "--max-rows-per-file",
+        type=int,
+        default=MAX_ROWS_PER_FILE,
+        help="maximum rows of each new file",
+    )
+    parser.add_argument(
+        "--row-group-size",
+        type=int,
+        default=ParquetOptions.row_group_size,
+        help="maximum rows of each row group",
+    )
+    parser.add_argument(
+        "--compression",
+        default=ParquetOptions.compression,
+        help="compression codec of the new files",
+    )
+    parser.add_argument("--compression-level", type=int, default=None)
+    args = parser.parse_args()
+
+    options = ParquetOptions(
+        row_group_size=args.row_group_size,
+        compression=args.compression,
+        compression_level=args.compression_level,
+    )
+    for path in args.paths:
+        start_time = time.time()
+        files_before, files_after = compact_dataset(
+            Path(path), options, args.max_rows_per_file
+        )
+        print(
+            "%s: %d files compacted into %d in %.1fs"
+            % (path, files_before, files_after, time.time() - start_time)
+        )
+
+
+if __name__ == "__main__":
+    main()
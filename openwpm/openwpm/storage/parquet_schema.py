@@ -82,6 +82,8 @@ fields = [
     pa.field("post_body", pa.string()),
     pa.field("post_body_raw", pa.string()),
     pa.field("time_stamp", pa.string(), nullable=False),
+    pa.field("url_etld1", pa.string()),
+    pa.field("top_level_url_etld1", pa.string()),
 ]
 PQ_SCHEMAS["http_requests"] = pa.schema(fields)
 
@@ -156,6 +158,9 @@ fields = [
     pa.field("value", pa.string()),
     pa.field("arguments", pa.string()),
     pa.field("time_stamp", pa.string(), nullable=False),
+    pa.field("script_url_etld1", pa.string()),
+    pa.field("document_url_etld1", pa.string()),
+    pa.field("top_level_url_etld1", pa.string()),
 ]
 PQ_SCHEMAS["javascript"] = pa.schema(fields)
 
@@ -181,6 +186,7 @@ fields = [
     pa.field("first_party_domain", pa.string()),
     pa.field("store_id", pa.string()),
     pa.field("time_stamp", pa.string()),
+    pa.field("host_etld1", pa.string()),
 ]
 PQ_SCHEMAS["javascript_cookies"] = pa.schema(fields)
 
@@ -76,7 +76,9 @@ CREATE TABLE IF NOT EXISTS http_requests(
   resource_type TEXT NOT NULL,
   post_body TEXT,
   post_body_raw TEXT,
-  time_stamp DATETIME NOT NULL
+  time_stamp DATETIME NOT NULL,
+  url_etld1 TEXT,
+  top_level_url_etld1 TEXT
 );
 
 /*
@@ -153,7 +155,10 @@ CREATE TABLE IF NOT EXISTS javascript(
   operation TEXT,
   value TEXT,
   arguments TEXT,
-  time_stamp DATETIME NOT NULL
+  time_stamp DATETIME NOT NULL,
+  script_url_etld1 TEXT,
+  document_url_etld1 TEXT,
+  top_level_url_etld1 TEXT
 );
 
 /*
@@ -179,7 +184,8 @@ CREATE TABLE IF NOT EXISTS javascript_cookies(
     same_site TEXT,
     first_party_domain TEXT,
     store_id STRING,
-    time_stamp DATETIME
+    time_stamp DATETIME,
+    host_etld1 TEXT
 );
 
 /*
@@ -1,7 +1,14 @@
+import asyncio
 import json
 import logging
 import os
+import queue
 import sqlite3
+import threading
+import time
+from asyncio import Task
+from collections import defaultdict
+from concurrent.futures import Future
 from pathlib import Path
 from sqlite3 import (
     Connection,
@@ -11,38 +18,180 @@ from sqlite3 import (
     OperationalError,
     ProgrammingError,
 )
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, DefaultDict, Dict, List, Optional, Tuple, TypeVar
 
 from openwpm.types import VisitId
 
+from .derived_columns import ETLD1_COLUMNS, add_etld1_columns
+from .indexes import ETLD1_INDEXES, INDEXES, create_indexes
 from .storage_providers import StructuredStorageProvider, TableName
 
 SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "schema.sql")
 
+BATCH_SIZE = 1000
+"""Buffered records after which they are written out"""
+BATCH_TIMEOUT = 5.0
+"""Seconds after which the buffered records are written out on the next store_record"""
+
+RecordShape = Tuple[TableName, Tuple[str, ...]]
+"""The table and the columns of a record"""
+
+WRITER_QUEUE_SIZE = 10000
+"""Operations the writer thread can have pending before store_record waits for it"""
+
+PRODUCTION_PRAGMAS = [
+    # Readers and the writer don't block each other,
+    # so the database can be read during the crawl
+    "PRAGMA journal_mode=WAL",
+    # Only syncs at checkpoints, which is safe with WAL
+    "PRAGMA synchronous=NORMAL",
+    # 64 MiB page cache
+    "PRAGMA cache_size=-65536",
+    # 256 MiB of the database memory mapped
+    "PRAGMA mmap_size=268435456",
+]
+
+T = TypeVar("T")
+
 
 class SQLiteStorageProvider(StructuredStorageProvider):
     db: Connection
     cur: Cursor
 
-    def __init__(self, db_path: Path) -> None:
+    def __init__(
+        self,
+        db_path: Path,
+        store_etld1: bool = False,
+        batch_size: int = BATCH_SIZE,
+        batch_timeout: float = BATCH_TIMEOUT,
+        production_mode: bool = False,
+        create_indexes: bool = False,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        db_path
+            path of the SQLite database
+        store_etld1
+            also store the eTLD+1 of the url columns listed in
+            derived_columns.ETLD1_COLUMNS and index them on shutdown
+        batch_size
+            amount of buffered records after which they are written out
+        batch_timeout
+            seconds after which the buffered records are written out
+        production_mode
+            use WAL and the PRODUCTION_PRAGMAS, and do all the SQLite I/O
+            in a writer thread, so the StorageController never waits for
+            the disk and the database can be read while crawling
+        create_indexes
+            create the indexes.INDEXES analysis queries use (and ANALYZE)
+            on shutdown, so they don't slow down the inserts of the crawl
+        """
         super().__init__()
         self.db_path = db_path
+        self.store_etld1 = store_etld1
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.production_mode = production_mode
+        self.create_indexes = create_indexes
         self._sql_counter = 0
         self._sql_commit_time = 0
         self.logger = logging.getLogger("openwpm")
 
+        # Rows waiting to be written out, per table and columns, so each
+        # batch is written with a single executemany
+        self._batches: DefaultDict[RecordShape, List[List[Any]]] = defaultdict(list)
+        self._buffered_records = 0
+        self._last_write_time = time.time()
+        # The INSERT statement of each record shape, generated only once
+        self._statements: Dict[RecordShape, str] = {}
+
+        # Operations for the writer thread (only in production mode)
+        self._queue: Optional[queue.Queue] = None
+        self._writer: Optional[threading.Thread] = None
+
     async def init(self) -> None:
+        if self.production_mode:
+            self._queue = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+            self._writer = threading.Thread(
+                target=self._run_writer, name="SQLiteWriter", daemon=True
+            )
+            self._writer.start()
+        await self._call(self._open)
+
+    def _open(self) -> None:
         self.db = sqlite3.connect(str(self.db_path))
         self.cur = self.db.cursor()
+        if self.production_mode:
+            for pragma in PRODUCTION_PRAGMAS:
+                self.db.execute(pragma)
         self._create_tables()
 
+    def _run_writer(self) -> None:
+        """Runs the operations of the queue until it gets None, in the writer thread"""
+        assert self._queue is not None
+        while True:
+            try:
+                operation = self._queue.get(timeout=self.batch_timeout)
+            except queue.Empty:
+                # No new records for a while, so the buffered ones are written out
+                self._write_batches()
+                continue
+            if operation is None:
+                break
+            function, args, future = operation
+            try:
+                result = function(*args)
+            except Exception as e:
+                if future is None:
+                    self.logger.exception("SQLite writer thread operation failed")
+                else:
+                    future.set_exception(e)
+            else:
+                if future is not None:
+                    future.set_result(result)
+
+    async def _put(self, operation: Any) -> None:
+        assert self._queue is not None
+        try:
+            self._queue.put_nowait(operation)
+        except queue.Full:
+            # The writer thread is behind, so the caller waits for it
+            await asyncio.to_thread(self._queue.put, operation)
+
+    async def _call(self, function: Callable[..., T], *args: Any) -> T:
+        """Runs the function in the writer thread in production mode,
+        otherwise right away"""
+        if self._queue is None:
+            return function(*args)
+        future: Future = Future()
+        await self._put((function, args, future))
+        return await asyncio.wrap_future(future)
+
     def _create_tables(self) -> None:
         """Create tables (if this is a new database)"""
         with open(SCHEMA_FILE, "r") as f:
             self.db.executescript(f.read())
+        if self.store_etld1:
+            self._create_etld1_columns()
         self.db.commit()
 
+    def _create_etld1_columns(self) -> None:
+        """Add the eTLD+1 columns to databases created before they were
+        part of the schema (they are indexed on shutdown)"""
+        for table, derived_columns in ETLD1_COLUMNS.items():
+            existing_columns = {
+                row[1] for row in self.db.execute(f"PRAGMA table_info({table})")
+            }
+            for column in derived_columns:
+                if column not in existing_columns:
+                    self.db.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+
     async def flush_cache(self) -> None:
+        await self._call(self._commit)
+
+    def _commit(self) -> None:
+        self._write_batches()
         self.db.commit()
 
     async def store_record(
@@ -52,7 +201,10 @@ class SQLiteStorageProvider(StructuredStorageProvider):
         The storing might not happen immediately
         """
         assert self.cur is not None
-        statement, args = self._generate_insert(table=table, data=record)
+        if self.store_etld1:
+            add_etld1_columns(table, record)
+        shape = (table, tuple(record.keys()))
+        args = list(record.values())
         for i in range(len(args)):
             if isinstance(args[i], bytes):
                 args[i] = str(args[i], errors="ignore")
@@ -60,6 +212,62 @@ class SQLiteStorageProvider(StructuredStorageProvider):
                 args[i] = str(args[i])
             elif type(args[i]) == dict:
                 args[i] = json.dumps(args[i])
+        if self._queue is None:
+            self._buffer_row(shape, args)
+        else:
+            await self._put((self._buffer_row, (shape, args), None))
+
+    def _buffer_row(self, shape: RecordShape, args: List[Any]) -> None:
+        self._batches[shape].append(args)
+        self._buffered_records += 1
+
+        if (
+            self._buffered_records >= self.batch_size
+            or time.time() - self._last_write_time >= self.batch_timeout
+        ):
+            self._write_batches()
+
+    def _get_statement(self, shape: RecordShape) -> str:
+        statement = self._statements.get(shape)
+        if statement is None:
+            table, columns = shape
+            statement, _ = self._generate_insert(
+                table=table, data=dict.fromkeys(columns)
+            )
+            self._statements[shape] = statement
+        return statement
+
+    def _write_batches(self) -> None:
+        """Write out the buffered records, in the current transaction
+        (they are committed on the next commit)"""
+        if not self._batches:
+            return
+        # Otherwise releasing the savepoint would commit
+        if not self.db.in_transaction:
+            self.cur.execute("BEGIN")
+        for shape, rows in self._batches.items():
+            statement = self._get_statement(shape)
+            # If a row can't be stored, the rows of its batch are stored one by one
+            # so only the unsupported ones are left out
+            self.cur.execute("SAVEPOINT store_batch")
+            try:
+                self.cur.executemany(statement, rows)
+                self._sql_counter += len(rows)
+            except (
+                OperationalError,
+                ProgrammingError,
+                IntegrityError,
+                InterfaceError,
+            ):
+                self.cur.execute("ROLLBACK TO store_batch")
+                for args in rows:
+                    self._execute_row(statement, args)
+            self.cur.execute("RELEASE store_batch")
+        self._batches.clear()
+        self._buffered_records = 0
+        self._last_write_time = time.time()
+
+    def _execute_row(self, statement: str, args: List[Any]) -> None:
         try:
             self.cur.execute(statement, args)
             self._sql_counter += 1
@@ -93,17 +301,58 @@ class SQLiteStorageProvider(StructuredStorageProvider):
         return statement, values
 
     def execute_statement(self, statement: str) -> None:
+        if self._queue is None:
+            self._execute_statement(statement)
+            return
+        future: Future = Future()
+        self._queue.put((self._execute_statement, (statement,), future))
+        future.result()
+
+    def _execute_statement(self, statement: str) -> None:
+        self._write_batches()
         self.cur.execute(statement)
         self.db.commit()
 
     async def finalize_visit_id(
         self, visit_id: VisitId, interrupted: bool = False
-    ) -> None:
+    ) -> Optional[Task[None]]:
         if interrupted:
             self.logger.warning("Visit with visit_id %d got interrupted", visit_id)
+        if self._queue is None:
+            self._finalize_visit_id(visit_id, interrupted)
+            return None
+        # Resolves once the writer thread committed the records of the visit
+        future: Future = Future()
+        await self._put((self._finalize_visit_id, (visit_id, interrupted), future))
+
+        async def wait_for_commit() -> None:
+            await asyncio.wrap_future(future)
+
+        return asyncio.create_task(wait_for_commit())
+
+    def _finalize_visit_id(self, visit_id: VisitId, interrupted: bool) -> None:
+        self._write_batches()
+        if interrupted:
             self.cur.execute("INSERT INTO incomplete_visits VALUES (?)", (visit_id,))
         self.db.commit()
 
     async def shutdown(self) -> None:
+        await self._call(self._close)
+        if self._writer is not None:
+            await self._put(None)
+            await asyncio.to_thread(self._writer.join)
+            self._queue = None
+            self._writer = None
+
+    def _close(self) -> None:
+        self._write_batches()
         self.db.commit()
+        # The indexes are only created once the crawl is over, as they slow down inserts
+        indexes = {}
+        if self.create_indexes:
+            indexes.update(INDEXES)
+        if self.store_etld1:
+            indexes.update(ETLD1_INDEXES)
+        if indexes:
+            create_indexes(self.db, indexes, analyze=self.create_indexes)
         self.db.close()
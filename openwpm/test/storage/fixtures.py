@@ -20,6 +20,7 @@ from test.storage.test_values import dt_test_values, generate_test_values
 
 memory_structured = "memory_structured"
 sqlite = "sqlite"
+sqlite_production = "sqlite_production"
 memory_arrow = "memory_arrow"
 
 
@@ -32,6 +33,9 @@ def structured_provider(
     elif request.param == sqlite:
         tmp_path = tmp_path_factory.mktemp("sqlite")
         return SQLiteStorageProvider(tmp_path / "test_db.sqlite")
+    elif request.param == sqlite_production:
+        tmp_path = tmp_path_factory.mktemp("sqlite")
+        return SQLiteStorageProvider(tmp_path / "test_db.sqlite", production_mode=True)
     elif request.param == memory_arrow:
         return MemoryArrowProvider()
     assert isinstance(
@@ -43,6 +47,7 @@ def structured_provider(
 structured_scenarios: List[str] = [
     memory_structured,
     sqlite,
+    sqlite_production,
     memory_arrow,
 ]
 
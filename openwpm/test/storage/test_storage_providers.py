@@ -1,12 +1,19 @@
 import asyncio
+import sqlite3
 from pathlib import Path
+from typing import Any, Dict, List
 
 import pytest
 from pandas import DataFrame
-from pyarrow.parquet import ParquetDataset
+from pyarrow.parquet import ParquetDataset, ParquetFile
 
+from openwpm.storage.arrow_storage import FlushPolicy, ParquetOptions
+from openwpm.storage.in_memory_storage import MemoryArrowProvider
+from openwpm.storage.indexes import INDEXES, create_indexes
 from openwpm.storage.local_storage import LocalArrowProvider
-from openwpm.storage.storage_controller import INVALID_VISIT_ID
+from openwpm.storage.parquet_compaction import compact_dataset
+from openwpm.storage.parquet_schema import PQ_SCHEMAS
+from openwpm.storage.sql_provider import SQLiteStorageProvider
 from openwpm.storage.storage_providers import (
     StructuredStorageProvider,
     TableName,
@@ -39,10 +46,12 @@ async def test_local_arrow_storage_provider(
         dataset = ParquetDataset(tmp_path / table_name)
         df: DataFrame = dataset.read().to_pandas()
         assert df.shape[0] == 1
+        # The records aren't changed, so the missing columns are null in the
+        # expected rows, and the instance_id is the provider's
+        expected = {name: test_data.get(name) for name in PQ_SCHEMAS[table_name].names}
+        expected["instance_id"] = structured_provider._instance_id
         for row in df.itertuples(index=False):
-            if test_data["visit_id"] == INVALID_VISIT_ID:
-                del test_data["visit_id"]
-            assert row._asdict() == test_data
+            assert row._asdict() == expected
 
 
 @pytest.mark.parametrize("structured_provider", structured_scenarios, indirect=True)
@@ -75,3 +84,327 @@ async def test_basic_unstructured_storing(
     await unstructured_provider.store_blob("test", blob)
     await unstructured_provider.flush_cache()
     await unstructured_provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_etld1_columns(tmp_path: Path) -> None:
+    db_path = tmp_path / "test_db.sqlite"
+    structured_provider = SQLiteStorageProvider(db_path, store_etld1=True)
+    await structured_provider.init()
+    await structured_provider.store_record(
+        TableName("http_requests"),
+        VisitId(1),
+        {
+            "browser_id": 1,
+            "visit_id": 1,
+            "url": "https://tracker.example.co.uk/collect?q=test",
+            "top_level_url": "https://www.google.com/search?q=test",
+            "method": "GET",
+            "referrer": "",
+            "headers": "",
+            "request_id": 1,
+            "resource_type": "xmlhttprequest",
+            "time_stamp": "2023-01-01T00:00:00.000Z",
+        },
+    )
+    await structured_provider.finalize_visit_id(VisitId(1))
+    await structured_provider.shutdown()
+
+    with sqlite3.connect(db_path) as db:
+        assert db.execute(
+            "SELECT url_etld1, top_level_url_etld1 FROM http_requests"
+        ).fetchall() == [("example.co.uk", "google.com")]
+        indexes = {row[1] for row in db.execute("PRAGMA index_list(http_requests)")}
+        assert "http_requests_url_etld1_index" in indexes
+        assert "http_requests_top_level_url_etld1_index" in indexes
+
+
+@pytest.mark.asyncio
+async def test_arrow_etld1_columns() -> None:
+    structured_provider = MemoryArrowProvider(store_etld1=True)
+    await structured_provider.init()
+    await structured_provider.store_record(
+        TableName("javascript_cookies"),
+        VisitId(1),
+        {"visit_id": 1, "host": ".doubleclick.net"},
+    )
+    token = await structured_provider.finalize_visit_id(VisitId(1))
+    await structured_provider.flush_cache()
+    await token
+    await asyncio.sleep(1)
+    handle = structured_provider.handle
+    handle.poll_queue()
+    table = handle.storage["javascript_cookies"][0]
+    assert table.column("host_etld1").to_pylist() == ["doubleclick.net"]
+
+
+@pytest.mark.asyncio
+async def test_sqlite_batched_writes(tmp_path: Path) -> None:
+    db_path = tmp_path / "test_db.sqlite"
+    structured_provider = SQLiteStorageProvider(
+        db_path, batch_size=3, batch_timeout=3600
+    )
+    await structured_provider.init()
+    for visit_id in range(5):
+        await structured_provider.store_record(
+            TableName("site_visits"),
+            VisitId(visit_id),
+            {"visit_id": visit_id, "browser_id": 1, "site_url": "https://example.com"},
+        )
+        await structured_provider.store_record(
+            TableName("site_visits"),
+            VisitId(visit_id + 10),
+            {"visit_id": visit_id + 10, "browser_id": 1, "site_url": b"bytes"},
+        )
+    # An unsupported record only leaves out itself, not the rest of its batch
+    await structured_provider.store_record(
+        TableName("site_visits"),
+        VisitId(20),
+        {"visit_id": 20, "browser_id": 1, "site_url": None},
+    )
+    await structured_provider.store_record(
+        TableName("site_visits"),
+        VisitId(21),
+        {"visit_id": 21, "browser_id": 1, "site_url": "https://example.com"},
+    )
+    await structured_provider.store_record(
+        TableName("site_visits"),
+        VisitId(22),
+        {"visit_id": 22, "browser_id": 1, "site_url": "https://a.com", "site_rank": 1},
+    )
+    # One statement per table and columns
+    assert len(structured_provider._statements) == 1
+    await structured_provider.finalize_visit_id(VisitId(22))
+    assert len(structured_provider._statements) == 2
+    await structured_provider.shutdown()
+
+    with sqlite3.connect(db_path) as db:
+        rows = db.execute(
+            "SELECT visit_id, site_url FROM site_visits ORDER BY visit_id"
+        ).fetchall()
+    assert [visit_id for visit_id, _ in rows] == [
+        0,
+        1,
+        2,
+        3,
+        4,
+        10,
+        11,
+        12,
+        13,
+        14,
+        21,
+        22,
+    ]
+    assert ("bytes",) in {(site_url,) for _, site_url in rows}
+
+
+@pytest.mark.asyncio
+async def test_sqlite_batch_timeout(tmp_path: Path) -> None:
+    db_path = tmp_path / "test_db.sqlite"
+    structured_provider = SQLiteStorageProvider(db_path, batch_timeout=0)
+    await structured_provider.init()
+    await structured_provider.store_record(
+        TableName("site_visits"),
+        VisitId(1),
+        {"visit_id": 1, "browser_id": 1, "site_url": "https://example.com"},
+    )
+    # Written out right away, as the timeout is past
+    assert structured_provider._buffered_records == 0
+    await structured_provider.flush_cache()
+
+    with sqlite3.connect(db_path) as db:
+        assert db.execute("SELECT COUNT(*) FROM site_visits").fetchone() == (1,)
+    await structured_provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_production_mode(tmp_path: Path) -> None:
+    db_path = tmp_path / "test_db.sqlite"
+    structured_provider = SQLiteStorageProvider(db_path, production_mode=True)
+    await structured_provider.init()
+    for visit_id in range(3):
+        await structured_provider.store_record(
+            TableName("site_visits"),
+            VisitId(visit_id),
+            {"visit_id": visit_id, "browser_id": 1, "site_url": "https://example.com"},
+        )
+    token = await structured_provider.finalize_visit_id(VisitId(2), interrupted=True)
+    # The commit happens in the writer thread
+    assert token is not None
+    await token
+
+    # The database can be read while the provider is still writing to it
+    with sqlite3.connect(db_path) as db:
+        assert db.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+        assert db.execute("SELECT COUNT(*) FROM site_visits").fetchone() == (3,)
+        assert db.execute("SELECT * FROM incomplete_visits").fetchall() == [(2,)]
+
+    structured_provider.execute_statement("DELETE FROM site_visits WHERE visit_id = 0")
+    await structured_provider.shutdown()
+    with sqlite3.connect(db_path) as db:
+        assert db.execute("SELECT COUNT(*) FROM site_visits").fetchone() == (2,)
+
+
+@pytest.mark.asyncio
+async def test_sqlite_create_indexes(tmp_path: Path) -> None:
+    db_path = tmp_path / "test_db.sqlite"
+    structured_provider = SQLiteStorageProvider(db_path, create_indexes=True)
+    await structured_provider.init()
+    await structured_provider.store_record(
+        TableName("site_visits"),
+        VisitId(1),
+        {"visit_id": 1, "browser_id": 1, "site_url": "https://example.com"},
+    )
+    await structured_provider.finalize_visit_id(VisitId(1))
+
+    # Not during the crawl, so the inserts stay fast
+    with sqlite3.connect(db_path) as db:
+        assert (
+            db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+            ).fetchall()
+            == []
+        )
+
+    await structured_provider.shutdown()
+    with sqlite3.connect(db_path) as db:
+        indexes = {
+            row[0]
+            for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        }
+        assert set(INDEXES) <= indexes
+        # ANALYZE ran
+        assert db.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] > 0
+
+
+def test_create_indexes_skips_missing_columns(tmp_path: Path) -> None:
+    with sqlite3.connect(tmp_path / "test_db.sqlite") as db:
+        db.execute("CREATE TABLE site_visits (visit_id INTEGER, site_url TEXT)")
+        created = create_indexes(db)
+    assert created == ["site_visits_site_url_index"]
+
+
+@pytest.mark.asyncio
+async def test_arrow_columnar_batches() -> None:
+    structured_provider = MemoryArrowProvider()
+    await structured_provider.init()
+    records: List[Dict[str, Any]] = [
+        {"visit_id": visit_id, "browser_id": 1, "site_url": "https://example.com"}
+        for visit_id in range(3)
+    ]
+    tokens = []
+    for record in records:
+        await structured_provider.store_record(
+            TableName("site_visits"), VisitId(record["visit_id"]), record
+        )
+        tokens.append(
+            await structured_provider.finalize_visit_id(VisitId(record["visit_id"]))
+        )
+    # A visit whose records don't fit the schema is left out on its own
+    await structured_provider.store_record(
+        TableName("site_visits"),
+        VisitId(3),
+        {"visit_id": 3, "browser_id": 1, "site_url": 1234},
+    )
+    tokens.append(await structured_provider.finalize_visit_id(VisitId(3)))
+    await structured_provider.flush_cache()
+    await asyncio.gather(*tokens)
+
+    # The records are not modified
+    assert records[0] == {
+        "visit_id": 0,
+        "browser_id": 1,
+        "site_url": "https://example.com",
+    }
+    await asyncio.sleep(1)
+    handle = structured_provider.handle
+    handle.poll_queue()
+    table = handle.storage["site_visits"][0]
+    assert table.column("visit_id").to_pylist() == [0, 1, 2]
+    assert table.column("site_rank").to_pylist() == [None, None, None]
+    # The batches of the visits are written out as one
+    assert table.column("visit_id").num_chunks == 1
+
+
+@pytest.mark.asyncio
+async def test_arrow_int_bool_columns() -> None:
+    # The extension sends 0/1 (boolToInt) for the columns the schema types as bool
+    structured_provider = MemoryArrowProvider()
+    await structured_provider.init()
+    await structured_provider.store_record(
+        TableName("javascript_cookies"),
+        VisitId(1),
+        {
+            "visit_id": 1,
+            "browser_id": 1,
+            "is_secure": 1,
+            "is_http_only": 0,
+            "is_host_only": 1,
+            "is_session": None,
+        },
+    )
+    token = await structured_provider.finalize_visit_id(VisitId(1))
+    await structured_provider.flush_cache()
+    await token
+    await asyncio.sleep(1)
+    handle = structured_provider.handle
+    handle.poll_queue()
+    table = handle.storage["javascript_cookies"][0]
+    assert table.column("is_secure").to_pylist() == [True]
+    assert table.column("is_http_only").to_pylist() == [False]
+    assert table.column("is_host_only").to_pylist() == [True]
+    assert table.column("is_session").to_pylist() == [None]
+
+
+@pytest.mark.asyncio
+async def test_arrow_size_based_flush() -> None:
+    structured_provider = MemoryArrowProvider(
+        flush_policy=FlushPolicy(max_batches=None, max_bytes=1)
+    )
+    await structured_provider.init()
+    await structured_provider.store_record(
+        TableName("site_visits"),
+        VisitId(1),
+        {"visit_id": 1, "browser_id": 1, "site_url": "https://example.com"},
+    )
+    token = await structured_provider.finalize_visit_id(VisitId(1))
+    # The batch is over the byte limit, so it was written out without a flush_cache
+    await asyncio.wait_for(token, timeout=1)
+    assert not structured_provider._batches
+    await asyncio.sleep(1)
+    handle = structured_provider.handle
+    handle.poll_queue()
+    assert handle.storage["site_visits"][0].column("visit_id").to_pylist() == [1]
+
+
+@pytest.mark.asyncio
+async def test_parquet_compaction(tmp_path: Path) -> None:
+    # Every visit is written out to its own file
+    structured_provider = LocalArrowProvider(
+        tmp_path,
+        flush_policy=FlushPolicy(max_batches=0),
+        parquet_options=ParquetOptions(compression="zstd"),
+    )
+    await structured_provider.init()
+    tokens = []
+    for visit_id in range(5):
+        await structured_provider.store_record(
+            TableName("site_visits"),
+            VisitId(visit_id),
+            {"visit_id": visit_id, "browser_id": 1, "site_url": "https://example.com"},
+        )
+        tokens.append(await structured_provider.finalize_visit_id(VisitId(visit_id)))
+    await asyncio.gather(*tokens)
+    await structured_provider.shutdown()
+
+    files = list((tmp_path / "site_visits").glob("*.parquet"))
+    assert len(files) == 5
+    assert ParquetFile(files[0]).metadata.row_group(0).column(0).compression == "ZSTD"
+
+    assert compact_dataset(tmp_path) == (5, 1)
+    files = list((tmp_path / "site_visits").glob("*.parquet"))
+    assert len(files) == 1
+    table = ParquetDataset(tmp_path / "site_visits").read()
+    assert sorted(table.column("visit_id").to_pylist()) == list(range(5))
+    assert table.schema.names == PQ_SCHEMAS["site_visits"].names
@@ -88,6 +88,8 @@ def generate_test_values() -> dt_test_values:
         "post_body": random_word(12),
         "post_body_raw": random_word(12),
         "time_stamp": random_word(12),
+        "url_etld1": random_word(12),
+        "top_level_url_etld1": random_word(12),
     }
     test_values[TableName("http_requests")] = fields
     # http_responses
@@ -156,6 +158,9 @@ def generate_test_values() -> dt_test_values:
         "value": random_word(12),
         "arguments": random_word(12),
         "time_stamp": random_word(12),
+        "script_url_etld1": random_word(12),
+        "document_url_etld1": random_word(12),
+        "top_level_url_etld1": random_word(12),
     }
     test_values[TableName("javascript")] = fields
     # javascript_cookies
@@ -179,6 +184,7 @@ def generate_test_values() -> dt_test_values:
         "first_party_domain": random_word(12),
         "store_id": random_word(12),
         "time_stamp": random_word(12),
+        "host_etld1": random_word(12),
     }
     test_values[TableName("javascript_cookies")] = fields
     # navigations